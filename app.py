@@ -4,6 +4,7 @@ Sistema de gestión de clientes con extracción y rellenado automático de docum
 """
 import streamlit as st
 import os
+import tempfile
 from pathlib import Path
 from datetime import datetime
 import json
@@ -14,6 +15,14 @@ load_dotenv()
 
 from database import DatabaseManager, Cliente
 from modules import PDFExtractor, PDFFiller, WordHandler, CloudinaryStorage, AuthManager, mostrar_pagina_login
+from modules.documento import DocumentoPDF, DocumentoWord
+from modules.preparacion import PreparadorPlantillas, huella_bytes
+from modules.cola_subidas import ColaSubidas
+from modules.almacenamiento import PREFIJO_TEMPORAL, AlmacenamientoLocal
+from modules.indice_archivos import exportar_documentos_cliente, sincronizar_indice
+from modules.cache_descargas import CacheDescargas
+from modules.retencion import POLITICAS_RETENCION, aplicar_retencion
+from modules.trabajos import ColaTrabajos
 
 # Función para obtener configuración (de secrets o .env)
 def get_config(key, default=None):
@@ -31,6 +40,11 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def obtener_preparador():
+    """Preparador de plantillas compartido por todas las sesiones y la cola de trabajos"""
+    return PreparadorPlantillas()
+
 # Inicializar session state
 if 'db_manager' not in st.session_state:
     st.session_state.db_manager = None
@@ -40,12 +54,231 @@ if 'pdf_filler' not in st.session_state:
     st.session_state.pdf_filler = None
 if 'word_handler' not in st.session_state:
     st.session_state.word_handler = None
-if 'cloudinary_storage' not in st.session_state:
-    st.session_state.cloudinary_storage = None
+if 'almacenamiento' not in st.session_state:
+    st.session_state.almacenamiento = None
+if 'cola_subidas' not in st.session_state:
+    st.session_state.cola_subidas = None
+if 'cola_trabajos' not in st.session_state:
+    st.session_state.cola_trabajos = None
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 if 'auth_manager' not in st.session_state:
     st.session_state.auth_manager = AuthManager()
+if 'preparador' not in st.session_state:
+    st.session_state.preparador = obtener_preparador()
+
+# Datos de un cliente que se pueden volcar en un formulario
+CAMPOS_CLIENTE = [
+    c.name for c in Cliente.__table__.columns
+    if c.name not in ('id', 'fecha_creacion', 'fecha_actualizacion')
+]
+
+
+@st.cache_resource
+def obtener_cola_subidas(_db_manager, _storage, tipo_almacenamiento):
+    """Cola de subidas compartida por todas las sesiones (un solo pool de hilos por almacén)"""
+    cola = ColaSubidas(_db_manager, _storage)
+    cola.iniciar()
+    return cola
+
+
+def mostrar_subida(subida_id):
+    """Muestra el estado de una subida en segundo plano y su enlace cuando termina"""
+    estado = st.session_state.cola_subidas.estado(subida_id) if subida_id else None
+    if estado is None:
+        return
+    if estado['estado'] == 'completada':
+        if (estado['url'] or '').startswith(('http://', 'https://')):
+            st.markdown(f"🔗 **Link permanente:** [Abrir en la nube]({estado['url']})")
+        else:
+            # Almacén local: un enlace file:// no se abre desde la página, así que se
+            # ofrece el archivo guardado como descarga
+            st.caption("💾 Archivo guardado en el almacenamiento local del servidor")
+            st.download_button(
+                "📥 Descargar archivo guardado",
+                data=st.session_state.almacenamiento.descargar_bytes(estado['public_id']),
+                file_name=Path(estado['nombre_archivo']).name,
+                key=f"subida_guardada_{subida_id}"
+            )
+    elif estado['estado'] == 'fallida':
+        st.warning(f"No se pudo guardar el archivo tras {estado['intentos']} intentos: {estado['error']}")
+    else:
+        reintentos = f" (reintento {estado['intentos']})" if estado['intentos'] else ""
+        st.caption(f"📤 Guardando el archivo en segundo plano{reintentos}...")
+
+
+@st.cache_resource
+def obtener_cache_descargas():
+    """Caché en disco de las descargas, compartida por todas las sesiones"""
+    max_mb = int(get_config('CACHE_DESCARGAS_MB', 512))
+    return CacheDescargas(get_config('CACHE_DESCARGAS_DIR', '.cache_descargas'), max_bytes=max_mb * 1024 * 1024)
+
+
+# Lecturas cacheadas: la clave incluye la versión de la tabla, que cambia con cada
+# escritura hecha por DatabaseManager, así que los reruns solo consultan la base de
+# datos cuando los datos han cambiado. La versión solo cuenta las escrituras de este
+# proceso: las de otros procesos (otra instancia de la aplicación) se ven al caducar
+# la entrada, como mucho TTL_LECTURAS segundos después
+TTL_LECTURAS = 60
+
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=TTL_LECTURAS)
+def cargar_clientes(_db_manager, base_datos, version):
+    """Todos los clientes en una versión de la tabla"""
+    return _db_manager.obtener_todos_clientes()
+
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=TTL_LECTURAS)
+def cargar_resumen_clientes(_db_manager, base_datos, version):
+    """Columnas de la tabla de clientes en una versión de la tabla"""
+    return _db_manager.obtener_resumen_clientes()
+
+
+@st.cache_data(show_spinner=False, max_entries=64, ttl=TTL_LECTURAS)
+def cargar_documentos(_db_manager, base_datos, version, texto):
+    """Documentos del índice que coinciden con una búsqueda, en una versión del índice"""
+    return [d.to_dict() for d in _db_manager.buscar_archivos(texto=texto)]
+
+
+def obtener_clientes():
+    """Todos los clientes (de la caché si no ha habido escrituras desde la última consulta)"""
+    db_manager = st.session_state.db_manager
+    return cargar_clientes(db_manager, str(db_manager.engine.url), db_manager.version('clientes'))
+
+
+def obtener_resumen_clientes():
+    """Columnas principales de todos los clientes (de la caché si no ha habido escrituras)"""
+    db_manager = st.session_state.db_manager
+    return cargar_resumen_clientes(db_manager, str(db_manager.engine.url), db_manager.version('clientes'))
+
+
+def buscar_documentos(texto=None):
+    """Documentos guardados que coinciden con una búsqueda (de la caché si el índice no ha cambiado)"""
+    db_manager = st.session_state.db_manager
+    return cargar_documentos(db_manager, str(db_manager.engine.url), db_manager.version('archivos'), texto)
+
+
+def huella_correcciones(extension):
+    """Huella de las etiquetas corregidas, parte de los parámetros de los rellenados de PDF"""
+    return st.session_state.db_manager.huella_correcciones() if extension == 'pdf' else None
+
+
+def funcion_preparacion(extension, pdf_filler, word_handler):
+    """Función que prepara una plantilla (PDF o Word) sin depender del cliente"""
+    if extension == 'pdf':
+        return lambda datos: pdf_filler.preparar_plantilla(datos, CAMPOS_CLIENTE)
+    return word_handler.preparar_plantilla
+
+
+@st.cache_resource
+def obtener_cola_trabajos(_db_manager, api_key):
+    """
+    Cola de extracciones y rellenados compartida por todas las sesiones
+
+    Los trabajos se hacen en hilos del servidor con sus propios extractores y
+    rellenadores, así que no dependen de la sesión que los pidió. Antes de cada
+    rellenado de PDF se cargan las correcciones de etiquetas guardadas desde
+    cualquier sesión.
+    """
+    extractor = PDFExtractor(api_key)
+    pdf_filler = PDFFiller(api_key, db_manager=_db_manager)
+    word_handler = WordHandler(api_key)
+    preparador = obtener_preparador()
+
+    def extraer(entrada, parametros):
+        extension = parametros['extension']
+        if extension == 'pdf':
+            documento = DocumentoPDF(entrada, parametros.get('nombre_archivo'))
+            datos = extractor.extraer_datos_cliente(documento)
+        else:
+            documento = DocumentoWord(entrada, parametros.get('nombre_archivo'))
+            datos = word_handler.extraer_datos_cliente_word(documento)
+
+        # Reparar solo los campos incorrectos o vacíos (no se repite la extracción)
+        campos_fallidos = extractor.campos_a_reparar(datos)
+        if campos_fallidos:
+            if extension == 'pdf':
+                datos = extractor.reparar_datos(documento, datos, campos_fallidos)
+            else:
+                datos = extractor.reparar_datos_texto(documento.texto, datos, campos_fallidos)
+        return {'resultado': datos}
+
+    def rellenar(entrada, parametros):
+        extension = parametros['extension']
+        cliente = _db_manager.obtener_cliente(parametros['cliente_id'])
+        if cliente is None:
+            raise ValueError("El cliente ya no existe")
+
+        # Plantilla ya preparada en segundo plano al subirla (si no, se prepara ahora)
+        preparada = preparador.obtener(
+            entrada, extension, funcion_preparacion(extension, pdf_filler, word_handler), huella=huella_bytes(entrada)
+        )
+        if extension == 'pdf':
+            pdf_filler.actualizar_sinonimos()
+            resultado = pdf_filler.rellenar_preparado(preparada, cliente.to_dict())
+        else:
+            resultado = word_handler.rellenar_word_bytes(preparada['datos'], cliente.to_dict())
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        razon_social_limpia = cliente.razon_social.replace(" ", "_").replace("/", "_")
+        contenido = resultado.pop('contenido')
+        resultado.pop('optimizacion', None)
+        return {
+            'resultado': resultado,
+            'salida': contenido,
+            'nombre_salida': f"{razon_social_limpia}_{timestamp}.{extension}"
+        }
+
+    def rellenar_lote(entrada, parametros):
+        handler = pdf_filler if parametros['extension'] == 'pdf' else word_handler
+        if handler is pdf_filler:
+            pdf_filler.actualizar_sinonimos()
+        resultado_lote = handler.rellenar_lote(
+            entrada,
+            parametros['cliente_ids'],
+            db_manager=_db_manager,
+            nombre_plantilla=parametros.get('nombre_archivo')
+        )
+        return {
+            'resultado': resultado_lote['manifiesto'],
+            'salida': resultado_lote['zip'],
+            'nombre_salida': f"lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        }
+
+    cola = ColaTrabajos(_db_manager)
+    cola.registrar('extraccion', extraer)
+    cola.registrar('rellenado', rellenar)
+    cola.registrar('lote', rellenar_lote)
+    cola.iniciar()
+    return cola
+
+
+@st.fragment(run_every=2)
+def esperar_trabajo(trabajo_id, mensaje):
+    """Consulta el estado de un trabajo cada dos segundos y recarga la página cuando termina"""
+    estado = st.session_state.cola_trabajos.estado(trabajo_id)
+    if estado is None or estado['estado'] not in ('pendiente', 'en_curso'):
+        st.rerun()
+    st.info(f"⏳ {mensaje} (en segundo plano: puedes cambiar de página y volver)")
+
+
+def mostrar_trabajo(trabajo_id, mensaje):
+    """
+    Muestra el progreso de un trabajo en segundo plano
+
+    Returns:
+        Estado del trabajo si ha terminado bien, None si sigue en curso o ha fallado
+    """
+    estado = st.session_state.cola_trabajos.estado(trabajo_id)
+    if estado is None:
+        return None
+    if estado['estado'] in ('pendiente', 'en_curso'):
+        esperar_trabajo(trabajo_id, mensaje)
+        return None
+    if estado['estado'] == 'fallido':
+        st.error(f"Error en el trabajo: {estado['error']}")
+        return None
+    return estado
 
 def inicializar_servicios():
     """Inicializa los servicios de base de datos y API"""
@@ -64,27 +297,38 @@ def inicializar_servicios():
             st.session_state.db_manager = DatabaseManager(db_url=db_url)
             st.session_state.db_manager.create_tables()
 
-        # Inicializar Cloudinary
-        if st.session_state.cloudinary_storage is None:
+        # Inicializar almacenamiento: Cloudinary si está configurado, si no, almacén local
+        if st.session_state.almacenamiento is None:
             cloud_name = get_config('CLOUDINARY_CLOUD_NAME')
             api_key_cloud = get_config('CLOUDINARY_API_KEY')
             api_secret = get_config('CLOUDINARY_API_SECRET')
 
             if all([cloud_name, api_key_cloud, api_secret]):
-                st.session_state.cloudinary_storage = CloudinaryStorage(cloud_name, api_key_cloud, api_secret)
+                st.session_state.almacenamiento = CloudinaryStorage(
+                    cloud_name, api_key_cloud, api_secret, cache=obtener_cache_descargas()
+                )
             else:
                 st.warning("⚠️ Cloudinary no configurado. Los archivos se guardarán localmente.")
+                st.session_state.almacenamiento = AlmacenamientoLocal(get_config('ALMACENAMIENTO_LOCAL', 'almacenamiento'))
+
+            st.session_state.cola_subidas = obtener_cola_subidas(
+                st.session_state.db_manager, st.session_state.almacenamiento,
+                type(st.session_state.almacenamiento).__name__
+            )
 
         # Inicializar módulos de procesamiento
         if st.session_state.pdf_extractor is None:
             st.session_state.pdf_extractor = PDFExtractor(api_key)
 
         if st.session_state.pdf_filler is None:
-            st.session_state.pdf_filler = PDFFiller(api_key)
+            st.session_state.pdf_filler = PDFFiller(api_key, db_manager=st.session_state.db_manager)
 
         if st.session_state.word_handler is None:
             st.session_state.word_handler = WordHandler(api_key)
 
+        if st.session_state.cola_trabajos is None:
+            st.session_state.cola_trabajos = obtener_cola_trabajos(st.session_state.db_manager, api_key)
+
         return True
 
     except Exception as e:
@@ -123,9 +367,85 @@ def pagina_inicio():
     ### 🚀 Comienza seleccionando una opción del menú lateral
     """)
 
+    # Documentos guardados: se buscan en el índice local, sin recorrer el almacenamiento
+    if st.session_state.db_manager and st.session_state.almacenamiento:
+        with st.expander("📂 Documentos guardados"):
+            col1, col2, col3 = st.columns([3, 1, 1])
+            with col1:
+                buscar_documento = st.text_input("🔍 Buscar por nombre", key="buscar_documento")
+            with col2:
+                sincronizar_todo = st.checkbox("Sincronización completa", key="sincronizar_todo")
+            with col3:
+                if st.button("🔄 Sincronizar"):
+                    with st.spinner("Sincronizando índice de documentos..."):
+                        try:
+                            resumen = sincronizar_indice(
+                                st.session_state.almacenamiento,
+                                st.session_state.db_manager,
+                                completo=sincronizar_todo
+                            )
+                            st.success(f"✅ {resumen['nuevos']} nuevos, {resumen['eliminados']} eliminados")
+                        except Exception as e:
+                            st.error(f"Error al sincronizar: {e}")
+
+            documentos = buscar_documentos(buscar_documento or None)
+            if documentos:
+                st.dataframe(documentos, use_container_width=True, hide_index=True)
+            else:
+                st.caption("No hay documentos en el índice")
+
+        # Retención: primero se simula y solo después se permite borrar
+        with st.expander("🧹 Limpieza de documentos antiguos"):
+            for carpeta, politica in POLITICAS_RETENCION.items():
+                st.caption(
+                    f"**{carpeta}**: máximo {politica['max_dias'] or '∞'} días, "
+                    f"{politica['max_archivos'] or '∞'} archivos"
+                )
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔍 Simular limpieza"):
+                    with st.spinner("Calculando qué se borraría..."):
+                        try:
+                            st.session_state.informe_retencion = aplicar_retencion(
+                                st.session_state.almacenamiento, st.session_state.db_manager
+                            )
+                        except Exception as e:
+                            st.error(f"Error al simular la limpieza: {e}")
+
+            informe = st.session_state.get('informe_retencion')
+            with col2:
+                if informe and informe['simulacion'] and st.button("🗑️ Aplicar limpieza", type="primary"):
+                    with st.spinner("Borrando documentos antiguos..."):
+                        try:
+                            informe = aplicar_retencion(
+                                st.session_state.almacenamiento, st.session_state.db_manager, simular=False
+                            )
+                            st.session_state.informe_retencion = informe
+                        except Exception as e:
+                            st.error(f"Error al aplicar la limpieza: {e}")
+
+            if informe:
+                st.dataframe([
+                    {
+                        'carpeta': carpeta,
+                        'archivos': resumen['candidatos'],
+                        'MB': round(resumen['bytes'] / 1024 / 1024, 2),
+                        'eliminados': resumen['eliminados'],
+                        'errores': len(resumen['errores'])
+                    }
+                    for carpeta, resumen in informe['carpetas'].items()
+                ], use_container_width=True, hide_index=True)
+                temporales = informe['temporales']
+                st.caption(
+                    f"{'Se borrarían' if informe['simulacion'] else 'Borrados'}: "
+                    f"{temporales['archivos']} temporales ({temporales['bytes'] / 1024 / 1024:.1f} MB), "
+                    f"{informe['subidas']} subidas y {informe['trabajos']} trabajos terminados"
+                )
+
     # Estadísticas
     if st.session_state.db_manager:
-        clientes = st.session_state.db_manager.obtener_todos_clientes()
+        clientes = obtener_clientes()
         col1, col2, col3 = st.columns(3)
 
         with col1:
@@ -151,99 +471,97 @@ def pagina_extraer_datos():
     )
 
     if archivo:
-        # Guardar archivo temporalmente para procesamiento
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(archivo.name).suffix) as tmp:
-            tmp.write(archivo.getbuffer())
-            archivo_path = tmp.name
-
-        # Subir a Cloudinary si está configurado
-        cloudinary_url = None
-        if st.session_state.cloudinary_storage:
-            try:
-                resultado = st.session_state.cloudinary_storage.subir_desde_bytes(
-                    archivo.getbuffer(),
-                    archivo.name,
-                    folder="soporte_admin/uploaded"
-                )
-                cloudinary_url = resultado['url']
-                st.success(f"✅ Archivo subido a Cloudinary: {archivo.name}")
-            except Exception as e:
-                st.warning(f"No se pudo subir a Cloudinary: {e}")
-        else:
-            st.success(f"Archivo cargado: {archivo.name}")
-
+        # Leer el archivo a memoria una sola vez
+        archivo_bytes = archivo.getvalue()
+
+        # Guardar el archivo en segundo plano (el mismo archivo solo se encola una vez
+        # aunque la página se recargue)
+        subida_id = None
+        if st.session_state.cola_subidas:
+            subida_id = st.session_state.cola_subidas.encolar(
+                archivo_bytes,
+                archivo.name,
+                folder="soporte_admin/uploaded"
+            )
+        st.success(f"Archivo cargado: {archivo.name}")
+        mostrar_subida(subida_id)
+
+        # La extracción se hace en segundo plano: el resultado se conserva aunque se
+        # cambie de página, y el mismo archivo no se vuelve a extraer
+        extension = archivo.name.split('.')[-1].lower()
+        huella_archivo = huella_bytes(archivo_bytes)
         if st.button("🤖 Extraer Datos con IA", type="primary"):
-            with st.spinner("Analizando documento con IA..."):
-                try:
-                    # Determinar tipo de archivo
-                    extension = archivo.name.split('.')[-1].lower()
-
-                    if extension == 'pdf':
-                        datos = st.session_state.pdf_extractor.extraer_datos_cliente(str(archivo_path))
-                    elif extension == 'docx':
-                        datos = st.session_state.word_handler.extraer_datos_cliente_word(str(archivo_path))
-                    else:
-                        st.error("Formato no soportado")
-                        return
-
-                    st.success("✅ Datos extraídos correctamente")
-
-                    # Mostrar datos extraídos
-                    st.subheader("Datos Extraídos:")
-
-                    col1, col2 = st.columns(2)
-
-                    with col1:
-                        st.markdown("**Representante Legal**")
-                        st.write(f"Nombre: {datos.get('nombre_representante_legal', 'N/A')}")
-                        st.write(f"DNI: {datos.get('dni_representante', 'N/A')}")
-
-                        st.markdown("**Empresa**")
-                        st.write(f"Razón Social: {datos.get('razon_social', 'N/A')}")
-                        st.write(f"CIF: {datos.get('cif', 'N/A')}")
-                        st.write(f"Dirección: {datos.get('direccion', 'N/A')}")
-                        st.write(f"Email: {datos.get('correo_electronico', 'N/A')}")
-
-                    with col2:
-                        st.markdown("**Datos Operacionales**")
-                        st.write(f"Trabajadores: {datos.get('numero_trabajadores', 'N/A')}")
-                        st.write(f"Facturación: {datos.get('facturacion', 'N/A')}")
-
-                        st.markdown("**Certificaciones**")
-                        st.write(f"Habilitaciones: {datos.get('habilitaciones', 'N/A')}")
-                        st.write(f"ISOs: {datos.get('isos', 'N/A')}")
-                        st.write(f"ROLECE: {datos.get('rolece', 'N/A')}")
-
-                        st.markdown("**Políticas**")
-                        st.write(f"Plan Igualdad: {'✅ Sí' if datos.get('tiene_plan_igualdad') else '❌ No'}")
-                        st.write(f"Protocolo Acoso: {'✅ Sí' if datos.get('tiene_protocolo_acoso') else '❌ No'}")
-
-                    # Guardar en session state para poder guardarlo
-                    st.session_state.datos_extraidos = datos
-
-                    if st.button("💾 Guardar en Base de Datos"):
-                        try:
-                            # Limpiar datos antes de guardar
-                            datos_limpios = {k: v for k, v in datos.items() if k not in ['pdf_original_nombre', 'pdf_original_ruta']}
-                            datos_limpios['pdf_original_nombre'] = archivo.name
-                            # Guardar URL de Cloudinary si está disponible, sino ruta local
-                            datos_limpios['pdf_original_ruta'] = cloudinary_url if cloudinary_url else str(archivo_path)
+            if extension not in ('pdf', 'docx'):
+                st.error("Formato no soportado")
+                return
+            st.session_state.trabajo_extraccion = {
+                'id': st.session_state.cola_trabajos.enviar(
+                    'extraccion', archivo_bytes, archivo.name, {'extension': extension}
+                ),
+                'huella': huella_archivo
+            }
+
+        trabajo = st.session_state.get('trabajo_extraccion')
+        if not trabajo or trabajo['huella'] != huella_archivo:
+            return
+        estado = mostrar_trabajo(trabajo['id'], "Analizando documento con IA...")
+        if estado is None:
+            return
+        datos = estado['resultado']
 
-                            cliente = st.session_state.db_manager.agregar_cliente(datos_limpios)
-                            st.success(f"✅ Cliente guardado con ID: {cliente.id}")
+        st.success("✅ Datos extraídos correctamente")
+        if datos.get('campos_reparados'):
+            st.caption("Campos corregidos: " + ", ".join(
+                f"{campo} ({datos['confianza_campos'][campo]:.0%})" for campo in datos['campos_reparados']
+            ))
 
-                            # Limpiar archivo temporal
-                            try:
-                                os.unlink(archivo_path)
-                            except:
-                                pass
+        # Mostrar datos extraídos
+        st.subheader("Datos Extraídos:")
 
-                        except Exception as e:
-                            st.error(f"Error al guardar: {e}")
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.markdown("**Representante Legal**")
+            st.write(f"Nombre: {datos.get('nombre_representante_legal', 'N/A')}")
+            st.write(f"DNI: {datos.get('dni_representante', 'N/A')}")
+
+            st.markdown("**Empresa**")
+            st.write(f"Razón Social: {datos.get('razon_social', 'N/A')}")
+            st.write(f"CIF: {datos.get('cif', 'N/A')}")
+            st.write(f"Dirección: {datos.get('direccion', 'N/A')}")
+            st.write(f"Email: {datos.get('correo_electronico', 'N/A')}")
+
+        with col2:
+            st.markdown("**Datos Operacionales**")
+            st.write(f"Trabajadores: {datos.get('numero_trabajadores', 'N/A')}")
+            st.write(f"Facturación: {datos.get('facturacion', 'N/A')}")
+
+            st.markdown("**Certificaciones**")
+            st.write(f"Habilitaciones: {datos.get('habilitaciones', 'N/A')}")
+            st.write(f"ISOs: {datos.get('isos', 'N/A')}")
+            st.write(f"ROLECE: {datos.get('rolece', 'N/A')}")
 
-                except Exception as e:
-                    st.error(f"Error al extraer datos: {e}")
+            st.markdown("**Políticas**")
+            st.write(f"Plan Igualdad: {'✅ Sí' if datos.get('tiene_plan_igualdad') else '❌ No'}")
+            st.write(f"Protocolo Acoso: {'✅ Sí' if datos.get('tiene_protocolo_acoso') else '❌ No'}")
+
+        # Guardar en session state para poder guardarlo
+        st.session_state.datos_extraidos = datos
+
+        if st.button("💾 Guardar en Base de Datos"):
+            try:
+                # Limpiar datos antes de guardar
+                datos_limpios = {k: v for k, v in datos.items() if k not in ['pdf_original_nombre', 'pdf_original_ruta', 'confianza_campos', 'campos_reparados']}
+                datos_limpios['pdf_original_nombre'] = archivo.name
+
+                cliente = st.session_state.db_manager.agregar_cliente(datos_limpios)
+                # La URL del archivo se escribe en el cliente cuando termine la subida
+                if subida_id:
+                    st.session_state.db_manager.asignar_cliente_subida(subida_id, cliente.id)
+                st.success(f"✅ Cliente guardado con ID: {cliente.id}")
+
+            except Exception as e:
+                st.error(f"Error al guardar: {e}")
 
 def pagina_gestionar_clientes():
     """Página para ver y gestionar clientes"""
@@ -320,8 +638,8 @@ def pagina_gestionar_clientes():
 
     # TAB 2: Ver Clientes
     with tab2:
-        # Obtener todos los clientes
-        clientes = st.session_state.db_manager.obtener_todos_clientes()
+        # Solo las columnas de la tabla; el cliente completo se carga al seleccionarlo
+        clientes = obtener_resumen_clientes()
 
         if not clientes:
             st.info("📭 No hay clientes registrados. Añade el primero en la pestaña 'Añadir Cliente'.")
@@ -340,48 +658,105 @@ def pagina_gestionar_clientes():
         # Filtrar clientes según búsqueda
         if buscar:
             clientes_filtrados = [c for c in clientes if
-                                  buscar.lower() in c.razon_social.lower() or
-                                  (c.cif and buscar.lower() in c.cif.lower())]
+                                  buscar.lower() in (c['razon_social'] or '').lower() or
+                                  (c['cif'] and buscar.lower() in c['cif'].lower())]
             if clientes_filtrados:
                 st.info(f"🔍 {len(clientes_filtrados)} cliente(s) encontrado(s)")
             else:
                 st.warning("No se encontraron clientes con ese criterio")
+                return
         else:
             clientes_filtrados = clientes
 
-        # Mostrar clientes
-        for cliente in clientes_filtrados:
-            with st.expander(f"🏢 {cliente.razon_social} - CIF: {cliente.cif}"):
-                col1, col2 = st.columns(2)
+        # Tabla virtualizada (el navegador solo pinta las filas visibles y permite ordenar)
+        seleccion = st.dataframe(
+            clientes_filtrados,
+            use_container_width=True,
+            hide_index=True,
+            column_order=['razon_social', 'cif', 'nombre_representante_legal', 'correo_electronico',
+                          'numero_trabajadores', 'facturacion'],
+            column_config={
+                'razon_social': st.column_config.TextColumn("Razón social"),
+                'cif': st.column_config.TextColumn("CIF"),
+                'nombre_representante_legal': st.column_config.TextColumn("Representante"),
+                'correo_electronico': st.column_config.TextColumn("Email"),
+                'numero_trabajadores': st.column_config.NumberColumn("Trabajadores"),
+                'facturacion': st.column_config.NumberColumn("Facturación", format="%.2f €")
+            },
+            on_select="rerun",
+            selection_mode="single-row",
+            # La selección se reinicia al cambiar la búsqueda o los datos
+            key=f"tabla_clientes_{buscar}_{st.session_state.db_manager.version('clientes')}"
+        )
+
+        filas = seleccion.selection.rows
+        if not filas or filas[0] >= len(clientes_filtrados):
+            st.caption("Selecciona un cliente en la tabla para ver sus datos")
+            return
 
-                with col1:
-                    st.markdown("**Representante Legal**")
-                    st.write(f"Nombre: {cliente.nombre_representante_legal or 'N/A'}")
-                    st.write(f"DNI: {cliente.dni_representante or 'N/A'}")
-
-                    st.markdown("**Contacto**")
-                    st.write(f"Email: {cliente.correo_electronico or 'N/A'}")
-                    st.write(f"Dirección: {cliente.direccion or 'N/A'}")
-
-                with col2:
-                    st.markdown("**Datos Operacionales**")
-                    st.write(f"Trabajadores: {cliente.numero_trabajadores or 0}")
-                    st.write(f"Facturación: {cliente.facturacion or 0} €")
-
-                    st.markdown("**Certificaciones**")
-                    st.write(f"Habilitaciones: {cliente.habilitaciones or 'N/A'}")
-                    st.write(f"ISOs: {cliente.isos or 'N/A'}")
-                    st.write(f"ROLECE: {cliente.rolece or 'N/A'}")
-
-                    st.markdown("**Políticas**")
-                    st.write(f"Plan Igualdad: {'✅ Sí' if cliente.tiene_plan_igualdad else '❌ No'}")
-                    st.write(f"Protocolo Acoso: {'✅ Sí' if cliente.tiene_protocolo_acoso else '❌ No'}")
-
-                # Botón para eliminar
-                if st.button(f"🗑️ Eliminar Cliente", key=f"del_{cliente.id}"):
-                    if st.session_state.db_manager.eliminar_cliente(cliente.id):
-                        st.success("Cliente eliminado")
-                        st.rerun()
+        cliente = st.session_state.db_manager.obtener_cliente(clientes_filtrados[filas[0]]['id'])
+        if cliente is None:
+            st.warning("El cliente seleccionado ya no existe")
+            return
+
+        # Datos del cliente seleccionado
+        with st.container(border=True):
+            st.markdown(f"### 🏢 {cliente.razon_social} - CIF: {cliente.cif}")
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.markdown("**Representante Legal**")
+                st.write(f"Nombre: {cliente.nombre_representante_legal or 'N/A'}")
+                st.write(f"DNI: {cliente.dni_representante or 'N/A'}")
+
+                st.markdown("**Contacto**")
+                st.write(f"Email: {cliente.correo_electronico or 'N/A'}")
+                st.write(f"Dirección: {cliente.direccion or 'N/A'}")
+
+            with col2:
+                st.markdown("**Datos Operacionales**")
+                st.write(f"Trabajadores: {cliente.numero_trabajadores or 0}")
+                st.write(f"Facturación: {cliente.facturacion or 0} €")
+
+                st.markdown("**Certificaciones**")
+                st.write(f"Habilitaciones: {cliente.habilitaciones or 'N/A'}")
+                st.write(f"ISOs: {cliente.isos or 'N/A'}")
+                st.write(f"ROLECE: {cliente.rolece or 'N/A'}")
+
+                st.markdown("**Políticas**")
+                st.write(f"Plan Igualdad: {'✅ Sí' if cliente.tiene_plan_igualdad else '❌ No'}")
+                st.write(f"Protocolo Acoso: {'✅ Sí' if cliente.tiene_protocolo_acoso else '❌ No'}")
+
+            # Exportar todos los documentos guardados del cliente
+            if st.session_state.almacenamiento and st.button("📦 Exportar documentos", key=f"exp_{cliente.id}"):
+                with st.spinner("Descargando documentos..."):
+                    try:
+                        # El ZIP se escribe en disco: el botón de descarga lo lee una sola vez
+                        with tempfile.TemporaryDirectory(prefix=PREFIJO_TEMPORAL) as directorio:
+                            zip_path = os.path.join(directorio, 'documentos.zip')
+                            manifiesto = exportar_documentos_cliente(
+                                st.session_state.almacenamiento, st.session_state.db_manager, cliente.id, zip_path
+                            )
+                            if manifiesto['total'] == 0:
+                                st.info("Este cliente no tiene documentos guardados")
+                            else:
+                                st.success(f"✅ {manifiesto['correctos']} de {manifiesto['total']} documentos en {manifiesto['segundos']} s")
+                                with open(zip_path, 'rb') as zip_archivo:
+                                    st.download_button(
+                                        label="📥 Descargar ZIP",
+                                        data=zip_archivo,
+                                        file_name=f"documentos_{cliente.cif or cliente.id}.zip",
+                                        mime='application/zip',
+                                        key=f"zip_{cliente.id}"
+                                    )
+                    except Exception as e:
+                        st.error(f"Error al exportar documentos: {e}")
+
+            # Botón para eliminar
+            if st.button(f"🗑️ Eliminar Cliente", key=f"del_{cliente.id}"):
+                if st.session_state.db_manager.eliminar_cliente(cliente.id):
+                    st.success("Cliente eliminado")
+                    st.rerun()
 
 def pagina_rellenar_documentos():
     """Página para rellenar documentos con datos de clientes"""
@@ -389,7 +764,7 @@ def pagina_rellenar_documentos():
     st.markdown("Sube un formulario vacío y selecciona el cliente para rellenarlo automáticamente")
 
     # Obtener clientes
-    clientes = st.session_state.db_manager.obtener_todos_clientes()
+    clientes = obtener_clientes()
 
     if not clientes:
         st.warning("⚠️ No hay clientes registrados. Ve a 'Gestionar Clientes' para añadir el primero.")
@@ -457,99 +832,165 @@ def pagina_rellenar_documentos():
         # Opciones de rellenado
         extension = formulario.name.split('.')[-1].lower()
 
+        # Leer y analizar la plantilla en segundo plano mientras se elige el cliente
+        # (una vez por contenido: las recargas de la página reutilizan el trabajo hecho)
+        formulario_bytes = formulario.getvalue()
+        huella_formulario = huella_bytes(formulario_bytes)
+        st.session_state.preparador.preparar(
+            formulario_bytes, extension,
+            funcion_preparacion(extension, st.session_state.pdf_filler, st.session_state.word_handler),
+            huella=huella_formulario
+        )
+        estado = st.session_state.preparador.estado(formulario_bytes, extension, huella=huella_formulario)
+        if estado == 'en_curso':
+            st.caption("⏳ Analizando el formulario en segundo plano...")
+        elif estado == 'lista':
+            st.caption("⚡ Formulario analizado: el rellenado será inmediato")
+
+        # El rellenado se hace en segundo plano con la plantilla ya preparada; el
+        # documento generado se conserva para descargarlo aunque se cambie de página
         if st.button("🎯 Rellenar Documento", type="primary"):
-            with st.spinner("Rellenando documento..."):
-                try:
-                    import tempfile
-
-                    # Guardar formulario en archivo temporal
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(formulario.name).suffix) as tmp_input:
-                        tmp_input.write(formulario.getbuffer())
-                        formulario_path = tmp_input.name
-
-                    # Generar nombre de salida
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    razon_social_limpia = cliente_seleccionado.razon_social.replace(" ", "_").replace("/", "_")
-                    output_nombre = f"{razon_social_limpia}_{timestamp}.{extension}"
-
-                    # Crear archivo temporal para output
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{extension}") as tmp_output:
-                        output_path = tmp_output.name
-
-                    # Convertir cliente a dict
-                    datos_cliente = cliente_seleccionado.to_dict()
-
-                    # Rellenar según tipo
-                    if extension == 'pdf':
-                        resultado = st.session_state.pdf_filler.rellenar_pdf(
-                            formulario_path,
-                            datos_cliente,
-                            output_path
-                        )
-                    elif extension == 'docx':
-                        resultado = st.session_state.word_handler.rellenar_word(
-                            formulario_path,
-                            datos_cliente,
-                            output_path
+            st.session_state.trabajo_rellenado = {
+                'id': st.session_state.cola_trabajos.enviar(
+                    'rellenado', formulario_bytes, formulario.name,
+                    {
+                        'extension': extension,
+                        'cliente_id': cliente_seleccionado.id,
+                        # Si cambian los datos del cliente o las etiquetas corregidas, es otro trabajo
+                        'actualizado': cliente_seleccionado.fecha_actualizacion,
+                        'correcciones': huella_correcciones(extension)
+                    }
+                ),
+                'huella': huella_formulario,
+                'cliente_id': cliente_seleccionado.id
+            }
+
+        trabajo = st.session_state.get('trabajo_rellenado')
+        if (trabajo and trabajo['huella'] == huella_formulario
+                and trabajo['cliente_id'] == cliente_seleccionado.id):
+            estado_trabajo = mostrar_trabajo(trabajo['id'], "Rellenando documento...")
+            if estado_trabajo is not None:
+                resultado = estado_trabajo['resultado']
+                output_nombre = estado_trabajo['nombre_salida']
+                contenido = st.session_state.cola_trabajos.salida(trabajo['id'])
+
+                st.success(f"✅ {resultado['mensaje']}")
+                if 'ruta' in resultado:
+                    st.caption(f"Ruta de rellenado: {resultado['ruta']} · {resultado['segundos']:.2f} s")
+
+                st.markdown("---")
+                st.subheader("3️⃣ Descarga tu Documento")
+
+                # Guardar el documento generado en segundo plano (una vez por trabajo)
+                if st.session_state.cola_subidas and trabajo.get('subida') is None:
+                    trabajo['subida'] = st.session_state.cola_subidas.encolar(
+                        contenido,
+                        output_nombre,
+                        folder="soporte_admin/generated",
+                        cliente_id=cliente_seleccionado.id
+                    )
+                    st.session_state.ultima_subida = trabajo['subida']
+
+                # Mostrar análisis si existe (y guardarlo para poder corregir las etiquetas)
+                if 'analisis' in resultado:
+                    st.session_state.ultimo_analisis = resultado['analisis']
+                    with st.expander("📊 Ver análisis del documento"):
+                        st.json(resultado['analisis'])
+
+                # Botón de descarga
+                col1, col2 = st.columns([2, 1])
+                with col1:
+                    st.download_button(
+                        label="📥 Descargar Documento Rellenado",
+                        data=contenido,
+                        file_name=output_nombre,
+                        mime='application/pdf' if extension == 'pdf' else 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                        type="primary",
+                        use_container_width=True
+                    )
+
+        # Estado de la subida del último documento generado
+        if st.session_state.cola_subidas and st.session_state.get('ultima_subida'):
+            mostrar_subida(st.session_state.ultima_subida)
+
+        # Corregir las etiquetas que la IA emparejó mal (se recuerdan para los próximos formularios)
+        campos_analisis = [
+            c for c in (st.session_state.get('ultimo_analisis') or {}).get('campos', [])
+            if c.get('etiqueta_en_pdf')
+        ]
+        if extension == 'pdf' and campos_analisis:
+            with st.expander("✏️ Corregir etiquetas del formulario"):
+                datos_posibles = CAMPOS_CLIENTE
+                with st.form("form_correcciones"):
+                    correcciones = {}
+                    for i, campo in enumerate(campos_analisis):
+                        opciones = datos_posibles if campo.get('campo_cliente') in datos_posibles else [campo.get('campo_cliente')] + datos_posibles
+                        correcciones[campo['etiqueta_en_pdf']] = st.selectbox(
+                            campo['etiqueta_en_pdf'],
+                            opciones,
+                            index=opciones.index(campo.get('campo_cliente')),
+                            key=f"correccion_{i}"
                         )
 
-                    st.success(f"✅ {resultado['mensaje']}")
-
-                    st.markdown("---")
-                    st.subheader("3️⃣ Descarga tu Documento")
-
-                    # Subir a Cloudinary si está configurado
-                    cloudinary_url = None
-                    if st.session_state.cloudinary_storage:
-                        try:
-                            with open(output_path, 'rb') as f:
-                                resultado_upload = st.session_state.cloudinary_storage.subir_desde_bytes(
-                                    f.read(),
-                                    output_nombre,
-                                    folder="soporte_admin/generated"
-                                )
-                                cloudinary_url = resultado_upload['url']
-                        except Exception as e:
-                            st.warning(f"No se pudo subir a Cloudinary: {e}")
-
-                    # Mostrar análisis si existe
-                    if 'analisis' in resultado:
-                        with st.expander("📊 Ver análisis del documento"):
-                            st.json(resultado['analisis'])
-
-                    # Botón de descarga
-                    with open(output_path, 'rb') as f:
-                        contenido = f.read()
-
-                        col1, col2 = st.columns([2, 1])
-                        with col1:
-                            st.download_button(
-                                label="📥 Descargar Documento Rellenado",
-                                data=contenido,
-                                file_name=output_nombre,
-                                mime='application/pdf' if extension == 'pdf' else 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                                type="primary",
-                                use_container_width=True
-                            )
-
-                    # Si está en Cloudinary, mostrar también el link
-                    if cloudinary_url:
-                        st.success("📤 Documento guardado en Cloudinary")
-                        st.markdown(f"🔗 **Link permanente:** [Abrir en la nube]({cloudinary_url})")
-                        st.caption("Este link estará disponible permanentemente en Cloudinary")
-
-                    st.info("ℹ️ Los archivos temporales se eliminan automáticamente del servidor después de la descarga")
-
-                    # Limpiar archivos temporales
-                    try:
-                        os.unlink(formulario_path)
-                        os.unlink(output_path)
-                    except:
-                        pass
-
-                except Exception as e:
-                    st.error(f"Error al rellenar documento: {e}")
-                    st.exception(e)
+                    if st.form_submit_button("💾 Guardar correcciones"):
+                        cambiadas = 0
+                        for campo in campos_analisis:
+                            nuevo = correcciones[campo['etiqueta_en_pdf']]
+                            if nuevo != campo.get('campo_cliente'):
+                                cambiadas += st.session_state.pdf_filler.confirmar_sinonimo(campo['etiqueta_en_pdf'], nuevo)
+                                campo['campo_cliente'] = nuevo
+
+                        # Aplicar también las correcciones a la plantilla ya preparada
+                        preparada = st.session_state.preparador.obtener(
+                            formulario_bytes, extension,
+                            funcion_preparacion(extension, st.session_state.pdf_filler, st.session_state.word_handler),
+                            huella=huella_formulario
+                        )
+                        for campo in (preparada.get('analisis') or {}).get('campos', []):
+                            if campo.get('etiqueta_en_pdf') in correcciones:
+                                campo['campo_cliente'] = correcciones[campo['etiqueta_en_pdf']]
+                        st.success(f"✅ {cambiadas} etiqueta(s) corregida(s); se usarán en los próximos formularios")
+
+        # Rellenado en lote: misma plantilla para varios clientes
+        with st.expander("📦 Rellenar en lote (varios clientes)"):
+            seleccion_lote = st.multiselect(
+                "Selecciona los clientes",
+                list(opciones_clientes.keys()),
+                key="select_lote"
+            )
+
+            if st.button("📦 Generar ZIP", disabled=not seleccion_lote):
+                clientes_lote = [opciones_clientes[o] for o in seleccion_lote]
+                st.session_state.trabajo_lote = {
+                    'id': st.session_state.cola_trabajos.enviar(
+                        'lote', formulario_bytes, formulario.name,
+                        {
+                            'extension': extension,
+                            'cliente_ids': [c.id for c in clientes_lote],
+                            # Si cambian los datos de algún cliente o las etiquetas corregidas, es otro trabajo
+                            'actualizados': [c.fecha_actualizacion for c in clientes_lote],
+                            'correcciones': huella_correcciones(extension)
+                        }
+                    ),
+                    'huella': huella_formulario
+                }
+
+            trabajo_lote = st.session_state.get('trabajo_lote')
+            if trabajo_lote and trabajo_lote['huella'] == huella_formulario:
+                estado_lote = mostrar_trabajo(trabajo_lote['id'], "Rellenando documentos del lote...")
+                if estado_lote is not None:
+                    manifiesto = estado_lote['resultado']
+                    st.success(f"✅ {manifiesto['correctos']} de {manifiesto['total']} documentos generados en {manifiesto['segundos']} s")
+                    if manifiesto['fallidos']:
+                        st.warning(f"⚠️ {manifiesto['fallidos']} documento(s) fallaron (ver manifest.json)")
+
+                    st.download_button(
+                        label="📥 Descargar ZIP",
+                        data=st.session_state.cola_trabajos.salida(trabajo_lote['id']),
+                        file_name=estado_lote['nombre_salida'],
+                        mime='application/zip',
+                        type="primary"
+                    )
 
 def main():
     """Función principal de la aplicación"""
@@ -591,7 +1032,14 @@ def main():
     with st.sidebar.expander("⚙️ Configuración"):
         st.write("**Base de Datos:** Neon (PostgreSQL)")
         st.write("**IA:** Claude API (Anthropic)")
-        st.write("**Almacenamiento:** Cloudinary")
+        almacenamiento = st.session_state.get('almacenamiento')
+        st.write(f"**Almacenamiento:** {'Local' if isinstance(almacenamiento, AlmacenamientoLocal) else 'Cloudinary'}")
+        if getattr(almacenamiento, 'cache', None) is not None:
+            cache = almacenamiento.cache.estadisticas()
+            st.caption(
+                f"Caché de descargas: {cache['aciertos']} aciertos, {cache['fallos']} fallos, "
+                f"{cache['bytes_ahorrados'] / 1024 / 1024:.1f} MB ahorrados"
+            )
 
         if st.button("🔄 Reconectar Servicios"):
             # Mantener la sesión autenticada
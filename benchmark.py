@@ -0,0 +1,362 @@
+"""
+Script para medir el rendimiento del rellenado de documentos
+
+Uso:
+    python benchmark.py overlay [paginas] [repeticiones]
+    python benchmark.py word [paginas] [repeticiones]
+    python benchmark.py texto [filas] [repeticiones]
+    python benchmark.py salida [paginas] [repeticiones]
+    python benchmark.py optimizacion [paginas] [repeticiones]
+    python benchmark.py sincronizacion [archivos] [nuevos]
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from io import BytesIO
+
+from docx import Document
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+
+from database import DatabaseManager
+from modules.almacenamiento import AlmacenamientoLocal
+from modules.indice_archivos import sincronizar_indice
+from modules.pdf_optimizador import optimizar_pdf
+from modules.pdf_overlay import OverlayCompilado, _posicion_zona
+from modules.documento import DocumentoWord
+from modules.reemplazo_word import MotorReemplazos, PlantillaWordCompilada
+from modules.texto_docx import extraer_texto_docx
+from modules.word_handler import WordHandler
+
+
+def _medir(funcion, repeticiones: int) -> float:
+    """Devuelve el tiempo medio en milisegundos de una función"""
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) * 1000 / repeticiones
+
+
+def crear_pdf_formulario(paginas: int) -> bytes:
+    """Crea un formulario PDF no interactivo de varias páginas"""
+    buffer = BytesIO()
+    can = canvas.Canvas(buffer)
+    for num in range(paginas):
+        can.drawString(50, 800, f"FORMULARIO - PÁGINA {num + 1}")
+        for linea in range(40):
+            can.drawString(50, 760 - linea * 18, f"Apartado {linea + 1}: ..................................")
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+
+def _overlay_reportlab(pdf_bytes: bytes, campos: list) -> bytes:
+    """Implementación anterior: un canvas por página y merge_page en todas las páginas"""
+    reader = PdfReader(BytesIO(pdf_bytes))
+    writer = PdfWriter()
+
+    for page_num, page in enumerate(reader.pages):
+        packet = BytesIO()
+        page_width = float(page.mediabox.width)
+        page_height = float(page.mediabox.height)
+
+        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+        can.setFont("Helvetica", 10)
+        for campo in campos:
+            if campo.get('pagina', 1) == page_num + 1:
+                x, y = _posicion_zona(campo.get('zona'), page_width, page_height)
+                can.drawString(x, y, str(campo.get('valor', '')))
+        can.save()
+
+        packet.seek(0)
+        page.merge_page(PdfReader(packet).pages[0])
+        writer.add_page(page)
+
+    salida = BytesIO()
+    writer.write(salida)
+    return salida.getvalue()
+
+
+def _overlay_compilado(pdf_bytes: bytes, campos: list, overlay: OverlayCompilado) -> bytes:
+    """Implementación actual: overlay precompilado y solo páginas con campos"""
+    reader = PdfReader(BytesIO(pdf_bytes))
+    salida = BytesIO()
+    overlay.renderizar(reader, campos).write(salida)
+    return salida.getvalue()
+
+
+def benchmark_overlay(paginas: int = 50, repeticiones: int = 10):
+    """Compara el overlay anterior con el precompilado en un formulario de N páginas"""
+    pdf_bytes = crear_pdf_formulario(paginas)
+    campos = [
+        {'pagina': 1, 'zona': 'superior izquierda', 'valor': 'Empresa Ejemplo S.L.'},
+        {'pagina': 1, 'zona': 'media derecha', 'valor': 'B12345678'},
+        {'pagina': 2, 'zona': 'superior centro', 'valor': 'Juan Pérez García'},
+        {'pagina': paginas, 'zona': 'inferior izquierda', 'valor': 'Madrid'},
+    ]
+    overlay = OverlayCompilado(PdfReader(BytesIO(pdf_bytes)))
+
+    anterior = _medir(lambda: _overlay_reportlab(pdf_bytes, campos), repeticiones)
+    actual = _medir(lambda: _overlay_compilado(pdf_bytes, campos, overlay), repeticiones)
+
+    print(f"📄 Formulario de {paginas} páginas, {len(campos)} campos, {repeticiones} repeticiones")
+    print(f"   Overlay anterior (reportlab + merge_page): {anterior:8.1f} ms/documento")
+    print(f"   Overlay precompilado:                       {actual:8.1f} ms/documento")
+    print(f"   Mejora: x{anterior / actual:.1f}")
+
+
+def crear_docx_licitacion(paginas: int) -> bytes:
+    """Crea un pliego Word de unas N páginas con marcadores, puntos suspensivos y tablas"""
+    doc = Document()
+    for num in range(paginas):
+        doc.add_heading(f"ANEXO {num + 1} - DECLARACIÓN RESPONSABLE", level=2)
+        para = doc.add_paragraph()
+        para.add_run("D./Dña. ").bold = True
+        para.add_run("{{NOMBRE_")
+        para.add_run("REPRESENTANTE}}, con DNI {{DNI_REPRESENTANTE}}, en representación de ")
+        para.add_run("{{RAZON_SOCIAL}}").italic = True
+        para.add_run(", con CIF {{CIF}} y domicilio en " + "." * 25)
+        doc.add_paragraph("Vecino de " + "…" * 12 + ", provincia de " + "." * 18 + ".")
+        for apartado in range(8):
+            doc.add_paragraph(
+                f"{apartado + 1}. Que la empresa cumple las condiciones establecidas en el pliego "
+                "de cláusulas administrativas particulares y en el de prescripciones técnicas."
+            )
+        tabla = doc.add_table(rows=3, cols=2)
+        tabla.cell(0, 0).text = "Correo electrónico"
+        tabla.cell(0, 1).text = "{{EMAIL}}"
+        tabla.cell(1, 0).text = "Nº de trabajadores"
+        tabla.cell(1, 1).text = "{{NUM_TRABAJADORES}}"
+        tabla.cell(2, 0).text = "Firma"
+        tabla.cell(2, 1).text = "Haga clic aquí para escribir texto"
+        doc.add_page_break()
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _reemplazar_anterior(doc, reemplazos: dict):
+    """Implementación anterior: str.replace por patrón y asignación de para.text"""
+    parrafos = list(doc.paragraphs)
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                parrafos.extend(cell.paragraphs)
+
+    for para in parrafos:
+        texto_original = para.text
+        texto_nuevo = texto_original
+        for patron, valor in reemplazos.items():
+            texto_nuevo = texto_nuevo.replace(patron, str(valor) if valor else '')
+        if texto_nuevo != texto_original:
+            para.text = texto_nuevo
+
+
+def benchmark_word(paginas: int = 200, repeticiones: int = 3):
+    """Compara los reemplazos anteriores con el motor de una sola pasada en un pliego de N páginas"""
+    docx_bytes = crear_docx_licitacion(paginas)
+    datos = {
+        'nombre_representante_legal': 'Juan Pérez García',
+        'dni_representante': '12345678A',
+        'razon_social': 'Empresa Ejemplo S.L.',
+        'cif': 'B12345678',
+        'correo_electronico': 'info@ejemplo.es',
+        'numero_trabajadores': 25,
+    }
+    reemplazos = WordHandler('benchmark')._crear_mapeo_reemplazos(datos)
+
+    def anterior():
+        doc = Document(BytesIO(docx_bytes))
+        _reemplazar_anterior(doc, reemplazos)
+        doc.save(BytesIO())
+
+    def motor():
+        doc = Document(BytesIO(docx_bytes))
+        MotorReemplazos(reemplazos).aplicar_documento(doc)
+        doc.save(BytesIO())
+
+    plantilla = PlantillaWordCompilada(DocumentoWord(docx_bytes), reemplazos.keys())
+
+    base = _medir(lambda: Document(BytesIO(docx_bytes)).save(BytesIO()), repeticiones)
+    tiempos = {
+        'Reemplazos anteriores (str.replace)': _medir(anterior, repeticiones),
+        'Motor de una sola pasada': _medir(motor, repeticiones),
+        f'Plantilla compilada ({plantilla.num_campos} campos)': _medir(
+            lambda: plantilla.rellenar(reemplazos, BytesIO()), repeticiones
+        ),
+    }
+
+    print(f"📝 Pliego de {paginas} páginas, {len(reemplazos)} patrones, {repeticiones} repeticiones")
+    print(f"   Lectura y guardado sin reemplazos:           {base:8.1f} ms/documento")
+    referencia = None
+    for nombre, tiempo in tiempos.items():
+        referencia = referencia or tiempo
+        print(f"   {nombre + ':':44} {tiempo:8.1f} ms/documento (x{referencia / tiempo:.1f})")
+
+def crear_docx_tablas(filas: int, tablas: int = 2) -> bytes:
+    """Crea un documento Word con tablas grandes y celdas combinadas"""
+    doc = Document()
+    doc.add_paragraph("ANEXO - RELACIÓN DE MEDIOS")
+    for num_tabla in range(tablas):
+        tabla = doc.add_table(rows=filas, cols=4)
+        tabla.cell(0, 0).merge(tabla.cell(0, 3)).text = f"Tabla {num_tabla + 1}"
+        for fila in range(1, filas):
+            # Se escribe directamente en el XML: tabla.cell() también es cuadrático
+            for columna, tc in enumerate(tabla.rows[fila]._tr.tc_lst):
+                tc.p_lst[0].add_r().text = f"F{fila}C{columna}"
+        doc.add_paragraph(f"Fin de la tabla {num_tabla + 1}")
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _texto_anterior(docx_bytes: bytes) -> str:
+    """Implementación anterior: árbol python-docx completo y row.cells"""
+    doc = Document(BytesIO(docx_bytes))
+    texto_completo = [para.text for para in doc.paragraphs]
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                texto_completo.append(cell.text)
+    return '\n'.join(texto_completo)
+
+
+def benchmark_texto(filas: int = 1000, repeticiones: int = 3):
+    """Compara la extracción de texto con python-docx y en streaming en tablas de N filas"""
+    docx_bytes = crear_docx_tablas(filas)
+
+    anterior = _medir(lambda: _texto_anterior(docx_bytes), repeticiones)
+    actual = _medir(lambda: extraer_texto_docx(docx_bytes), repeticiones)
+
+    print(f"📑 Documento con 2 tablas de {filas} filas x 4 columnas, {repeticiones} repeticiones")
+    print(f"   python-docx + row.cells:  {anterior:8.1f} ms/documento")
+    print(f"   Streaming (iterparse):    {actual:8.1f} ms/documento")
+    print(f"   Mejora: x{anterior / actual:.1f}")
+
+
+def _logo_png(ancho: int = 800, alto: int = 300) -> bytes:
+    """Genera un PNG de ruido (poco comprimible, como una foto o un logo detallado)"""
+    def bloque(tipo: bytes, datos: bytes) -> bytes:
+        return struct.pack('>I', len(datos)) + tipo + datos + struct.pack('>I', zlib.crc32(tipo + datos))
+
+    filas = b''.join(b'\x00' + os.urandom(ancho * 3) for _ in range(alto))
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloque(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 2, 0, 0, 0))
+            + bloque(b'IDAT', zlib.compress(filas))
+            + bloque(b'IEND', b''))
+
+
+def _memoria_pico(funcion) -> float:
+    """Memoria máxima reservada por una función, en MB"""
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico / 1024 / 1024
+
+
+def benchmark_salida(paginas: int = 20, repeticiones: int = 5):
+    """Compara Document.save con la copia de las partes sin cambios en una plantilla con logos"""
+    doc = Document(BytesIO(crear_docx_licitacion(paginas)))
+    logo = _logo_png()
+    doc.sections[0].header.paragraphs[0].add_run().add_picture(BytesIO(logo))
+    doc.add_picture(BytesIO(_logo_png()))
+    buffer = BytesIO()
+    doc.save(buffer)
+    docx_bytes = buffer.getvalue()
+
+    reemplazos = WordHandler('benchmark')._crear_mapeo_reemplazos({'nombre_representante_legal': 'Juan Pérez'})
+    plantilla = PlantillaWordCompilada(DocumentoWord(docx_bytes), reemplazos.keys())
+
+    def con_python_docx():
+        doc = Document(BytesIO(docx_bytes))
+        MotorReemplazos(reemplazos).aplicar_documento(doc)
+        doc.save(BytesIO())
+
+    def copia_directa():
+        plantilla.rellenar(reemplazos, BytesIO())
+
+    anterior = _medir(con_python_docx, repeticiones)
+    actual = _medir(copia_directa, repeticiones)
+
+    print(f"🖼️  Plantilla de {paginas} páginas con 2 imágenes ({len(docx_bytes) / 1024:.0f} KB), {repeticiones} repeticiones")
+    print(f"   python-docx (Document.save):          {anterior:8.1f} ms/documento, {_memoria_pico(con_python_docx):6.1f} MB pico")
+    print(f"   Copia directa de partes sin cambios:  {actual:8.1f} ms/documento, {_memoria_pico(copia_directa):6.1f} MB pico")
+    print(f"   Mejora: x{anterior / actual:.1f}")
+
+
+def benchmark_optimizacion(paginas: int = 50, repeticiones: int = 5):
+    """Mide el ahorro y el coste de optimizar un PDF rellenado con overlay"""
+    pdf_bytes = crear_pdf_formulario(paginas)
+    reader = PdfReader(BytesIO(pdf_bytes))
+    overlay = OverlayCompilado(reader)
+    campos = [{'pagina': num + 1, 'zona': 'superior izquierda', 'valor': 'Empresa Ejemplo S.L.'} for num in range(paginas)]
+
+    # Solo aquí se mide el tamaño sin optimizar: en la aplicación duplicaría el guardado
+    informe = optimizar_pdf(overlay.renderizar(reader, campos), BytesIO(), medir=True)
+
+    sin_optimizar = _medir(lambda: overlay.renderizar(reader, campos).write(BytesIO()), repeticiones)
+    optimizado = _medir(lambda: optimizar_pdf(overlay.renderizar(reader, campos), BytesIO()), repeticiones)
+
+    print(f"🗜️  Formulario de {paginas} páginas con un campo por página, {repeticiones} repeticiones")
+    print(f"   Sin optimizar: {informe['bytes_original'] / 1024:8.1f} KB, {sin_optimizar:8.1f} ms/documento")
+    print(f"   Optimizado:    {informe['bytes_final'] / 1024:8.1f} KB, {optimizado:8.1f} ms/documento")
+    print(f"   Ahorro: {informe['bytes_ahorrados'] / 1024:.1f} KB")
+
+
+def benchmark_sincronizacion(archivos: int = 2000, nuevos: int = 20):
+    """Compara la sincronización completa del índice con la incremental en un almacén local"""
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenamientoLocal(os.path.join(directorio, 'almacen'))
+        db_manager = DatabaseManager(f"sqlite:///{os.path.join(directorio, 'indice.db')}")
+        db_manager.create_tables()
+
+        # Los archivos ya sincronizados son anteriores (uno por segundo); los nuevos, de ahora
+        antiguo = int(time.time()) - 3600
+        for num in range(archivos):
+            public_id = almacen.subir_archivo(f"documento {num}".encode(), nombre_archivo=f"doc{num}.pdf")['public_id']
+            os.utime(almacen.ruta_en_carpeta("soporte_admin", public_id), (antiguo - num, antiguo - num))
+
+        inicio = time.perf_counter()
+        completa = sincronizar_indice(almacen, db_manager, completo=True)
+        segundos_completa = time.perf_counter() - inicio
+
+        for num in range(nuevos):
+            almacen.subir_archivo(f"documento nuevo {num}".encode(), nombre_archivo=f"nuevo{num}.pdf")
+
+        inicio = time.perf_counter()
+        incremental = sincronizar_indice(almacen, db_manager)
+        segundos_incremental = time.perf_counter() - inicio
+        db_manager.engine.dispose()
+
+    print(f"🗂️  Almacén local con {archivos} archivos y {nuevos} nuevos")
+    print(f"   Completa:    {completa['recorridos']:6d} recorridos, {completa['nuevos']:6d} nuevos, {segundos_completa * 1000:8.1f} ms")
+    print(f"   Incremental: {incremental['recorridos']:6d} recorridos, {incremental['nuevos']:6d} nuevos, {segundos_incremental * 1000:8.1f} ms")
+    # Se vuelve a recorrer el último ya indexado: su fecha es la del corte
+    if incremental['recorridos'] > nuevos + 1 or incremental['nuevos'] != nuevos:
+        print("   ⚠️  La sincronización incremental no se ha cortado en los archivos ya indexados")
+
+
+BENCHMARKS = {
+    'overlay': benchmark_overlay,
+    'word': benchmark_word,
+    'texto': benchmark_texto,
+    'salida': benchmark_salida,
+    'optimizacion': benchmark_optimizacion,
+    'sincronizacion': benchmark_sincronizacion,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(__doc__)
+        print("Benchmarks disponibles:", ", ".join(BENCHMARKS))
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
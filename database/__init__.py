@@ -1,7 +1,7 @@
 """
 Paquete de base de datos
 """
-from .models import Cliente, Base
+from .models import Cliente, SinonimoCampo, SubidaPendiente, ArchivoAlmacenado, Trabajo, Base
 from .db_manager import DatabaseManager
 
-__all__ = ['Cliente', 'Base', 'DatabaseManager']
+__all__ = ['Cliente', 'SinonimoCampo', 'SubidaPendiente', 'ArchivoAlmacenado', 'Trabajo', 'Base', 'DatabaseManager']
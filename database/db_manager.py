@@ -1,12 +1,22 @@
 """
 Gestor de base de datos (SQLite o PostgreSQL)
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from .models import Base, Cliente
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, Session, defer
+from .models import Base, Cliente, SinonimoCampo, SubidaPendiente, ArchivoAlmacenado, Trabajo
+import hashlib
 import os
+import threading
+from datetime import datetime
 from pathlib import Path
 
+# Versión de los datos de cada tabla, por base de datos: cada escritura la incrementa.
+# Es común a todos los DatabaseManager del proceso (uno por sesión de la aplicación),
+# así que las cachés de lectura de cualquier sesión ven los cambios de las demás.
+_VERSIONES = {}
+_LOCK_VERSIONES = threading.Lock()
+
 class DatabaseManager:
     def __init__(self, db_url: str = None):
         """
@@ -44,13 +54,38 @@ class DatabaseManager:
         self.SessionLocal = sessionmaker(bind=self.engine)
 
     def create_tables(self):
-        """Crea todas las tablas en la base de datos"""
+        """Crea todas las tablas en la base de datos (y los índices únicos que falten en las ya creadas)"""
         Base.metadata.create_all(bind=self.engine)
+        for tabla in Base.metadata.sorted_tables:
+            for indice in tabla.indexes:
+                if not indice.unique:
+                    continue
+                try:
+                    indice.create(bind=self.engine, checkfirst=True)
+                except Exception as e:
+                    print(f"No se pudo crear el índice {indice.name}: {e}")
 
     def get_session(self) -> Session:
         """Retorna una nueva sesión de base de datos"""
         return self.SessionLocal()
 
+    def version(self, tabla: str = 'clientes') -> int:
+        """
+        Versión de los datos de una tabla ('clientes' o 'archivos')
+
+        Cambia con cada escritura hecha a través de cualquier DatabaseManager del
+        proceso, así que sirve como clave de las cachés de lectura.
+        """
+        with _LOCK_VERSIONES:
+            return _VERSIONES.get((self.engine.url, tabla), 0)
+
+    def _registrar_cambio(self, *tablas: str):
+        """Incrementa la versión de las tablas modificadas (tras confirmar la escritura)"""
+        with _LOCK_VERSIONES:
+            for tabla in tablas:
+                clave = (self.engine.url, tabla)
+                _VERSIONES[clave] = _VERSIONES.get(clave, 0) + 1
+
     def agregar_cliente(self, cliente_data: dict) -> Cliente:
         """
         Agrega un nuevo cliente a la base de datos
@@ -67,6 +102,7 @@ class DatabaseManager:
             session.add(cliente)
             session.commit()
             session.refresh(cliente)
+            self._registrar_cambio('clientes')
             return cliente
         except Exception as e:
             session.rollback()
@@ -82,6 +118,14 @@ class DatabaseManager:
         finally:
             session.close()
 
+    def obtener_clientes_por_ids(self, cliente_ids: list[int]) -> list[Cliente]:
+        """Obtiene varios clientes por ID en una sola consulta"""
+        session = self.get_session()
+        try:
+            return session.query(Cliente).filter(Cliente.id.in_(list(cliente_ids))).all()
+        finally:
+            session.close()
+
     def obtener_todos_clientes(self) -> list[Cliente]:
         """Obtiene todos los clientes"""
         session = self.get_session()
@@ -90,6 +134,25 @@ class DatabaseManager:
         finally:
             session.close()
 
+    def obtener_resumen_clientes(self) -> list[dict]:
+        """
+        Obtiene las columnas principales de todos los clientes (sin cargar el resto)
+
+        Returns:
+            Lista de diccionarios con id, razon_social, cif, nombre_representante_legal,
+            correo_electronico, numero_trabajadores y facturacion, ordenada por razón social
+        """
+        columnas = [
+            Cliente.id, Cliente.razon_social, Cliente.cif, Cliente.nombre_representante_legal,
+            Cliente.correo_electronico, Cliente.numero_trabajadores, Cliente.facturacion
+        ]
+        session = self.get_session()
+        try:
+            filas = session.query(*columnas).order_by(Cliente.razon_social)
+            return [fila._asdict() for fila in filas]
+        finally:
+            session.close()
+
     def actualizar_cliente(self, cliente_id: int, datos_nuevos: dict) -> Cliente:
         """Actualiza un cliente existente"""
         session = self.get_session()
@@ -101,6 +164,7 @@ class DatabaseManager:
                         setattr(cliente, key, value)
                 session.commit()
                 session.refresh(cliente)
+                self._registrar_cambio('clientes')
             return cliente
         except Exception as e:
             session.rollback()
@@ -116,6 +180,7 @@ class DatabaseManager:
             if cliente:
                 session.delete(cliente)
                 session.commit()
+                self._registrar_cambio('clientes')
                 return True
             return False
         except Exception as e:
@@ -131,3 +196,774 @@ class DatabaseManager:
             return session.query(Cliente).filter(Cliente.cif == cif).first()
         finally:
             session.close()
+
+    def obtener_sinonimos(self) -> list[SinonimoCampo]:
+        """Obtiene todas las etiquetas de formulario aprendidas"""
+        session = self.get_session()
+        try:
+            return session.query(SinonimoCampo).all()
+        finally:
+            session.close()
+
+    def obtener_correcciones(self) -> list[SinonimoCampo]:
+        """Obtiene las etiquetas de formulario corregidas por el usuario"""
+        session = self.get_session()
+        try:
+            return session.query(SinonimoCampo).filter(SinonimoCampo.origen == 'usuario').all()
+        finally:
+            session.close()
+
+    def huella_correcciones(self) -> str:
+        """
+        Huella de las correcciones del usuario guardadas (cambia con cada corrección)
+
+        Se calcula sobre la base de datos, así que la ven igual todos los procesos.
+        """
+        session = self.get_session()
+        try:
+            filas = session.query(SinonimoCampo.etiqueta_normalizada, SinonimoCampo.campo_cliente).filter(
+                SinonimoCampo.origen == 'usuario'
+            ).order_by(SinonimoCampo.etiqueta_normalizada)
+            huella = hashlib.sha256()
+            for etiqueta, campo_cliente in filas:
+                huella.update(f"{etiqueta}\x00{campo_cliente}\x00".encode('utf-8'))
+            return huella.hexdigest()
+        finally:
+            session.close()
+
+    def guardar_sinonimos(self, sinonimos: list[dict]) -> int:
+        """
+        Guarda etiquetas de formulario confirmadas (inserta o actualiza por etiqueta normalizada)
+
+        Una etiqueta confirmada por el usuario no se sobrescribe con lo que diga la IA.
+
+        Args:
+            sinonimos: Lista de diccionarios con 'etiqueta', 'etiqueta_normalizada',
+                       'campo_cliente' y 'origen'
+
+        Returns:
+            Número de etiquetas insertadas o modificadas
+        """
+        if not sinonimos:
+            return 0
+
+        session = self.get_session()
+        try:
+            claves = {s['etiqueta_normalizada'] for s in sinonimos}
+            existentes = {
+                s.etiqueta_normalizada: s
+                for s in session.query(SinonimoCampo).filter(SinonimoCampo.etiqueta_normalizada.in_(claves))
+            }
+
+            cambios = 0
+            for datos in sinonimos:
+                sinonimo = existentes.get(datos['etiqueta_normalizada'])
+                if sinonimo is None:
+                    sinonimo = SinonimoCampo(**datos)
+                    session.add(sinonimo)
+                    existentes[datos['etiqueta_normalizada']] = sinonimo
+                    cambios += 1
+                elif sinonimo.origen == 'usuario' and datos.get('origen') != 'usuario':
+                    if sinonimo.campo_cliente == datos['campo_cliente']:
+                        sinonimo.usos = (sinonimo.usos or 0) + 1
+                else:
+                    if sinonimo.campo_cliente != datos['campo_cliente'] or sinonimo.origen != datos.get('origen'):
+                        cambios += 1
+                    sinonimo.campo_cliente = datos['campo_cliente']
+                    sinonimo.origen = datos.get('origen', sinonimo.origen)
+                    sinonimo.usos = (sinonimo.usos or 0) + 1
+
+            session.commit()
+            return cambios
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def encolar_subida(self, nombre_archivo: str, carpeta: str, contenido: bytes, huella: str,
+                       cliente_id: int = None) -> int:
+        """
+        Añade un archivo a la cola de subida a la nube
+
+        Si el mismo contenido ya está en la cola (o subido) para esa carpeta, no se duplica.
+        El índice único sobre (huella, carpeta) lo garantiza también cuando dos peticiones
+        encolan el mismo archivo a la vez: la segunda reutiliza la subida de la primera.
+
+        Returns:
+            ID de la subida
+        """
+        session = self.get_session()
+        try:
+            for _ in range(2):
+                subida = session.query(SubidaPendiente).filter(
+                    SubidaPendiente.huella == huella,
+                    SubidaPendiente.carpeta == carpeta,
+                    SubidaPendiente.estado != 'fallida'
+                ).first()
+                if subida is None:
+                    subida = SubidaPendiente(
+                        nombre_archivo=nombre_archivo, carpeta=carpeta, contenido=contenido,
+                        huella=huella, cliente_id=cliente_id, proximo_intento=datetime.utcnow()
+                    )
+                    session.add(subida)
+                elif cliente_id is not None:
+                    subida.cliente_id = cliente_id
+                try:
+                    session.commit()
+                    return subida.id
+                except IntegrityError:
+                    # Otra petición la ha encolado entre la consulta y la inserción
+                    session.rollback()
+            raise RuntimeError(f"No se pudo encolar la subida de {nombre_archivo}")
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def obtener_subida(self, subida_id: int) -> SubidaPendiente:
+        """Obtiene una subida de la cola por ID (sin cargar el contenido)"""
+        session = self.get_session()
+        try:
+            return session.query(SubidaPendiente).options(
+                defer(SubidaPendiente.contenido)
+            ).filter(SubidaPendiente.id == subida_id).first()
+        finally:
+            session.close()
+
+    def tomar_subidas_pendientes(self, limite: int = 10) -> list[dict]:
+        """
+        Reserva las subidas pendientes cuyo próximo intento ya ha llegado
+
+        Cada subida se marca como 'subiendo' con una actualización condicional, de modo
+        que dos procesos nunca suben la misma.
+
+        Returns:
+            Lista de diccionarios con 'id', 'nombre_archivo', 'carpeta', 'contenido' e 'intentos'
+        """
+        session = self.get_session()
+        try:
+            candidatas = session.query(SubidaPendiente.id).filter(
+                SubidaPendiente.estado == 'pendiente',
+                SubidaPendiente.proximo_intento <= datetime.utcnow()
+            ).order_by(SubidaPendiente.proximo_intento).limit(limite).all()
+
+            reservadas = []
+            for (subida_id,) in candidatas:
+                actualizadas = session.query(SubidaPendiente).filter(
+                    SubidaPendiente.id == subida_id,
+                    SubidaPendiente.estado == 'pendiente'
+                ).update({'estado': 'subiendo', 'fecha_actualizacion': datetime.utcnow()}, synchronize_session=False)
+                if actualizadas:
+                    reservadas.append(subida_id)
+            session.commit()
+
+            if not reservadas:
+                return []
+            return [
+                {
+                    'id': s.id,
+                    'nombre_archivo': s.nombre_archivo,
+                    'carpeta': s.carpeta,
+                    'contenido': s.contenido,
+                    'intentos': s.intentos or 0
+                }
+                for s in session.query(SubidaPendiente).filter(SubidaPendiente.id.in_(reservadas))
+            ]
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def completar_subida(self, subida_id: int, url: str, public_id: str, resource_type: str = None):
+        """
+        Marca una subida como completada y escribe la URL en el cliente asociado
+
+        Args:
+            subida_id: ID de la subida
+            url: URL del archivo subido
+            public_id: ID público del archivo subido
+            resource_type: Tipo de recurso con el que se guardó (hace falta para borrarlo)
+        """
+        session = self.get_session()
+        try:
+            subida = session.query(SubidaPendiente).filter(SubidaPendiente.id == subida_id).first()
+            if subida is None:
+                return
+            subida.estado = 'completada'
+            subida.url = url
+            subida.public_id = public_id
+            subida.intentos = (subida.intentos or 0) + 1
+            subida.error = None
+            tamano = len(subida.contenido) if subida.contenido is not None else None
+            subida.contenido = None
+
+            if subida.cliente_id is not None:
+                session.query(Cliente).filter(Cliente.id == subida.cliente_id).update(
+                    {'pdf_original_ruta': url}, synchronize_session=False
+                )
+
+            # Añadir el archivo al índice local sin esperar a la próxima sincronización
+            self._indexar_archivos(session, [{
+                'public_id': public_id,
+                'resource_type': resource_type,
+                'carpeta': subida.carpeta,
+                'nombre_archivo': subida.nombre_archivo,
+                'formato': Path(subida.nombre_archivo).suffix.lstrip('.') or None,
+                'bytes': tamano,
+                'url': url,
+                'cliente_id': subida.cliente_id,
+                'fecha_subida': datetime.utcnow()
+            }])
+            session.commit()
+            self._registrar_cambio('archivos', *(['clientes'] if subida.cliente_id is not None else []))
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def fallar_subida(self, subida_id: int, error: str, proximo_intento: datetime = None):
+        """
+        Registra un intento fallido de subida
+
+        Args:
+            subida_id: ID de la subida
+            error: Mensaje de error
+            proximo_intento: Cuándo reintentar (None si no quedan intentos: queda 'fallida')
+        """
+        session = self.get_session()
+        try:
+            subida = session.query(SubidaPendiente).filter(SubidaPendiente.id == subida_id).first()
+            if subida is None:
+                return
+            subida.intentos = (subida.intentos or 0) + 1
+            subida.error = error[:2000]
+            if proximo_intento is None:
+                subida.estado = 'fallida'
+            else:
+                subida.estado = 'pendiente'
+                subida.proximo_intento = proximo_intento
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def asignar_cliente_subida(self, subida_id: int, cliente_id: int):
+        """Asocia una subida a un cliente (si ya terminó, le escribe la URL en ese momento)"""
+        session = self.get_session()
+        try:
+            subida = session.query(SubidaPendiente).filter(SubidaPendiente.id == subida_id).first()
+            if subida is None:
+                return
+            subida.cliente_id = cliente_id
+            if subida.estado == 'completada' and subida.url:
+                session.query(Cliente).filter(Cliente.id == cliente_id).update(
+                    {'pdf_original_ruta': subida.url}, synchronize_session=False
+                )
+                session.query(ArchivoAlmacenado).filter(ArchivoAlmacenado.public_id == subida.public_id).update(
+                    {'cliente_id': cliente_id}, synchronize_session=False
+                )
+            session.commit()
+            self._registrar_cambio('clientes', 'archivos')
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def renovar_subidas(self, subida_ids: list[int]):
+        """Renueva el latido de las subidas en curso de este proceso"""
+        if not subida_ids:
+            return
+        session = self.get_session()
+        try:
+            session.query(SubidaPendiente).filter(
+                SubidaPendiente.id.in_(subida_ids),
+                SubidaPendiente.estado == 'subiendo'
+            ).update({'fecha_actualizacion': datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def reanudar_subidas_interrumpidas(self, sin_latido_desde: datetime) -> int:
+        """
+        Vuelve a poner en cola las subidas que quedaron a medias (p. ej. tras un reinicio)
+
+        Solo se retoman las que llevan sin latido desde la fecha indicada: las que
+        sigue subiendo otro proceso renuevan el suyo y no se tocan.
+
+        Args:
+            sin_latido_desde: Fecha límite del último latido
+
+        Returns:
+            Número de subidas retomadas
+        """
+        session = self.get_session()
+        try:
+            reanudadas = session.query(SubidaPendiente).filter(
+                SubidaPendiente.estado == 'subiendo',
+                SubidaPendiente.fecha_actualizacion < sin_latido_desde
+            ).update({'estado': 'pendiente'}, synchronize_session=False)
+            session.commit()
+            return reanudadas
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @staticmethod
+    def _indexar_archivos(session: Session, archivos: list[dict]) -> int:
+        """
+        Inserta o actualiza entradas del índice de archivos dentro de una sesión abierta
+
+        Los archivos sin cliente se asocian al cliente cuyo documento original tiene esa URL.
+        La carpeta de un archivo ya indexado no se cambia (el mismo contenido puede estar
+        en varias carpetas y cada sincronización lo vería en una distinta).
+
+        Returns:
+            Número de archivos nuevos en el índice
+        """
+        ids = [a['public_id'] for a in archivos]
+        existentes = {
+            a.public_id: a
+            for a in session.query(ArchivoAlmacenado).filter(ArchivoAlmacenado.public_id.in_(ids))
+        }
+
+        urls = [a['url'] for a in archivos if a.get('url') and a.get('cliente_id') is None]
+        clientes_por_url = dict(
+            session.query(Cliente.pdf_original_ruta, Cliente.id).filter(Cliente.pdf_original_ruta.in_(urls))
+        ) if urls else {}
+
+        nuevos = 0
+        for datos in archivos:
+            datos = {k: v for k, v in datos.items() if v is not None}
+            if 'cliente_id' not in datos and datos.get('url') in clientes_por_url:
+                datos['cliente_id'] = clientes_por_url[datos['url']]
+
+            archivo = existentes.get(datos['public_id'])
+            if archivo is None:
+                archivo = ArchivoAlmacenado(**datos)
+                session.add(archivo)
+                existentes[datos['public_id']] = archivo
+                nuevos += 1
+            else:
+                if archivo.carpeta:
+                    datos.pop('carpeta', None)
+                for clave, valor in datos.items():
+                    setattr(archivo, clave, valor)
+        return nuevos
+
+    def guardar_archivos(self, archivos: list[dict]) -> int:
+        """
+        Inserta o actualiza archivos en el índice local (por public_id)
+
+        Args:
+            archivos: Lista de diccionarios con las columnas de ArchivoAlmacenado
+
+        Returns:
+            Número de archivos nuevos en el índice
+        """
+        if not archivos:
+            return 0
+
+        session = self.get_session()
+        try:
+            nuevos = self._indexar_archivos(session, archivos)
+            session.commit()
+            self._registrar_cambio('archivos')
+            return nuevos
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def ultima_fecha_sincronizada(self, carpeta: str = None):
+        """Fecha de subida del archivo más reciente visto al sincronizar una carpeta (None si nunca)"""
+        session = self.get_session()
+        try:
+            consulta = session.query(func.max(ArchivoAlmacenado.fecha_subida)).filter(
+                ArchivoAlmacenado.fecha_sincronizacion.isnot(None)
+            )
+            if carpeta is not None:
+                consulta = consulta.filter(ArchivoAlmacenado.carpeta.like(f"{carpeta}%"))
+            return consulta.scalar()
+        finally:
+            session.close()
+
+    def eliminar_archivos_no_vistos(self, vistos: set, carpeta: str = None) -> int:
+        """
+        Quita del índice los archivos de una carpeta que ya no están en el almacenamiento
+
+        Args:
+            vistos: public_id de todos los archivos que existen
+            carpeta: Carpeta sincronizada (None para todo el índice)
+
+        Returns:
+            Número de archivos quitados
+        """
+        session = self.get_session()
+        try:
+            consulta = session.query(ArchivoAlmacenado)
+            if carpeta is not None:
+                consulta = consulta.filter(ArchivoAlmacenado.carpeta.like(f"{carpeta}%"))
+            eliminados = 0
+            for archivo in consulta:
+                if archivo.public_id not in vistos:
+                    session.delete(archivo)
+                    eliminados += 1
+            session.commit()
+            if eliminados:
+                self._registrar_cambio('archivos')
+            return eliminados
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def buscar_archivos(self, texto: str = None, carpeta: str = None, cliente_id: int = None,
+                        limite: int = 100) -> list[ArchivoAlmacenado]:
+        """
+        Busca archivos en el índice local, del más reciente al más antiguo
+
+        Args:
+            texto: Texto a buscar en el nombre del archivo o en su public_id
+            carpeta: Solo archivos de esta carpeta (y subcarpetas)
+            cliente_id: Solo archivos de este cliente
+            limite: Número máximo de resultados (None para todos)
+
+        Returns:
+            Lista de archivos
+        """
+        session = self.get_session()
+        try:
+            consulta = session.query(ArchivoAlmacenado)
+            if texto:
+                patron = f"%{texto}%"
+                consulta = consulta.filter(
+                    ArchivoAlmacenado.nombre_archivo.ilike(patron) | ArchivoAlmacenado.public_id.ilike(patron)
+                )
+            if carpeta:
+                consulta = consulta.filter(ArchivoAlmacenado.carpeta.like(f"{carpeta}%"))
+            if cliente_id is not None:
+                consulta = consulta.filter(ArchivoAlmacenado.cliente_id == cliente_id)
+            consulta = consulta.order_by(ArchivoAlmacenado.fecha_subida.desc())
+            return (consulta.limit(limite) if limite is not None else consulta).all()
+        finally:
+            session.close()
+
+    def candidatos_retencion(self, carpeta: str, antes_de: datetime = None,
+                             conservar: int = None) -> list[ArchivoAlmacenado]:
+        """
+        Archivos del índice de una carpeta que sobran según una política de retención
+
+        Sobran los subidos antes de la fecha indicada y los que quedan fuera de los
+        'conservar' más recientes. Los documentos originales de los clientes (su URL
+        está en pdf_original_ruta) nunca se proponen ni cuentan para el límite.
+
+        Args:
+            carpeta: Carpeta (y subcarpetas) a revisar
+            antes_de: Fecha de subida por debajo de la cual sobra un archivo
+            conservar: Número de archivos más recientes que se conservan
+
+        Returns:
+            Lista de archivos, del más antiguo al más reciente
+        """
+        session = self.get_session()
+        try:
+            originales = select(Cliente.pdf_original_ruta).where(Cliente.pdf_original_ruta.isnot(None))
+            consulta = session.query(ArchivoAlmacenado).filter(
+                ArchivoAlmacenado.carpeta.like(f"{carpeta}%"),
+                ArchivoAlmacenado.url.is_(None) | ArchivoAlmacenado.url.notin_(originales)
+            )
+
+            candidatos = {}
+            if antes_de is not None:
+                for archivo in consulta.filter(ArchivoAlmacenado.fecha_subida < antes_de):
+                    candidatos[archivo.id] = archivo
+            if conservar is not None:
+                # Los archivos sin fecha cuentan como los más antiguos
+                sobrantes = consulta.order_by(
+                    ArchivoAlmacenado.fecha_subida.desc().nulls_last(), ArchivoAlmacenado.id.desc()
+                ).offset(conservar)
+                for archivo in sobrantes:
+                    candidatos[archivo.id] = archivo
+
+            return sorted(candidatos.values(), key=lambda a: (a.fecha_subida or datetime.min, a.id))
+        finally:
+            session.close()
+
+    def eliminar_archivos_indice(self, public_ids: list[str]) -> int:
+        """
+        Quita archivos del índice local (tras borrarlos del almacenamiento)
+
+        Returns:
+            Número de entradas quitadas
+        """
+        if not public_ids:
+            return 0
+
+        session = self.get_session()
+        try:
+            eliminados = session.query(ArchivoAlmacenado).filter(
+                ArchivoAlmacenado.public_id.in_(public_ids)
+            ).delete(synchronize_session=False)
+            session.commit()
+            self._registrar_cambio('archivos')
+            return eliminados
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def purgar_subidas(self, antes_de: datetime, simular: bool = False) -> int:
+        """
+        Borra de la cola las subidas completadas o fallidas que no cambian desde antes de una fecha
+
+        Las fallidas conservan el contenido del archivo, así que sin esta purga la
+        tabla solo crece.
+
+        Args:
+            antes_de: Fecha de la última actualización por debajo de la cual se borran
+            simular: Solo contar las subidas que se borrarían
+
+        Returns:
+            Número de subidas borradas (o que se borrarían)
+        """
+        session = self.get_session()
+        try:
+            consulta = session.query(SubidaPendiente).filter(
+                SubidaPendiente.estado.in_(['completada', 'fallida']),
+                SubidaPendiente.fecha_actualizacion < antes_de
+            )
+            if simular:
+                return consulta.count()
+            purgadas = consulta.delete(synchronize_session=False)
+            session.commit()
+            return purgadas
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def crear_trabajo(self, tipo: str, huella: str, entrada: bytes, nombre_archivo: str = None,
+                      parametros: str = None) -> int:
+        """
+        Añade un trabajo a la cola de trabajos en segundo plano
+
+        Si ya hay un trabajo igual (misma huella) pendiente, en curso o completado, no se
+        duplica: se devuelve ese, así que repetir la petición reutiliza su resultado. El
+        índice único sobre la huella lo garantiza también cuando dos sesiones piden el
+        mismo trabajo a la vez: la segunda reutiliza el de la primera.
+
+        Args:
+            tipo: Tipo de trabajo ('extraccion', 'rellenado' o 'lote')
+            huella: Huella del tipo, la entrada y los parámetros
+            entrada: Documento de entrada
+            nombre_archivo: Nombre del documento de entrada
+            parametros: Parámetros del trabajo en JSON
+
+        Returns:
+            ID del trabajo
+        """
+        session = self.get_session()
+        try:
+            for _ in range(2):
+                trabajo = session.query(Trabajo).options(
+                    defer(Trabajo.entrada), defer(Trabajo.salida)
+                ).filter(
+                    Trabajo.huella == huella,
+                    Trabajo.estado != 'fallido'
+                ).first()
+                if trabajo is None:
+                    trabajo = Trabajo(
+                        tipo=tipo, huella=huella, entrada=entrada,
+                        nombre_archivo=nombre_archivo, parametros=parametros
+                    )
+                    session.add(trabajo)
+                try:
+                    session.commit()
+                    return trabajo.id
+                except IntegrityError:
+                    # Otra sesión lo ha creado entre la consulta y la inserción
+                    session.rollback()
+            raise RuntimeError(f"No se pudo crear el trabajo {tipo}")
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def obtener_trabajo(self, trabajo_id: int, con_salida: bool = False) -> Trabajo:
+        """Obtiene un trabajo por ID (sin cargar la entrada ni, salvo que se pida, la salida)"""
+        session = self.get_session()
+        try:
+            consulta = session.query(Trabajo).options(defer(Trabajo.entrada))
+            if not con_salida:
+                consulta = consulta.options(defer(Trabajo.salida))
+            return consulta.filter(Trabajo.id == trabajo_id).first()
+        finally:
+            session.close()
+
+    def tomar_trabajos_pendientes(self, limite: int = 2) -> list[dict]:
+        """
+        Reserva los trabajos pendientes más antiguos
+
+        Cada trabajo se marca como 'en_curso' con una actualización condicional, de modo
+        que dos procesos nunca hacen el mismo.
+
+        Returns:
+            Lista de diccionarios con 'id', 'tipo', 'nombre_archivo', 'entrada' y 'parametros'
+        """
+        session = self.get_session()
+        try:
+            candidatos = session.query(Trabajo.id).filter(
+                Trabajo.estado == 'pendiente'
+            ).order_by(Trabajo.id).limit(limite).all()
+
+            reservados = []
+            for (trabajo_id,) in candidatos:
+                actualizados = session.query(Trabajo).filter(
+                    Trabajo.id == trabajo_id,
+                    Trabajo.estado == 'pendiente'
+                ).update({
+                    'estado': 'en_curso', 'fecha_inicio': datetime.utcnow(), 'fecha_actualizacion': datetime.utcnow()
+                }, synchronize_session=False)
+                if actualizados:
+                    reservados.append(trabajo_id)
+            session.commit()
+
+            if not reservados:
+                return []
+            return [
+                {
+                    'id': t.id,
+                    'tipo': t.tipo,
+                    'nombre_archivo': t.nombre_archivo,
+                    'entrada': t.entrada,
+                    'parametros': t.parametros
+                }
+                for t in session.query(Trabajo).options(defer(Trabajo.salida)).filter(Trabajo.id.in_(reservados))
+            ]
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def completar_trabajo(self, trabajo_id: int, resultado: str, salida: bytes = None, nombre_salida: str = None):
+        """Guarda el resultado de un trabajo terminado y libera su entrada"""
+        session = self.get_session()
+        try:
+            session.query(Trabajo).filter(Trabajo.id == trabajo_id).update({
+                'estado': 'completado',
+                'resultado': resultado,
+                'salida': salida,
+                'nombre_salida': nombre_salida,
+                'error': None,
+                'entrada': None,
+                'fecha_fin': datetime.utcnow()
+            }, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def fallar_trabajo(self, trabajo_id: int, error: str):
+        """Marca un trabajo como fallido (repetir la petición crea uno nuevo)"""
+        session = self.get_session()
+        try:
+            session.query(Trabajo).filter(Trabajo.id == trabajo_id).update({
+                'estado': 'fallido',
+                'error': error,
+                'entrada': None,
+                'fecha_fin': datetime.utcnow()
+            }, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def renovar_trabajos(self, trabajo_ids: list[int]):
+        """Renueva el latido de los trabajos en curso de este proceso"""
+        if not trabajo_ids:
+            return
+        session = self.get_session()
+        try:
+            session.query(Trabajo).filter(
+                Trabajo.id.in_(trabajo_ids),
+                Trabajo.estado == 'en_curso'
+            ).update({'fecha_actualizacion': datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def reanudar_trabajos_interrumpidos(self, sin_latido_desde: datetime) -> int:
+        """
+        Vuelve a poner en cola los trabajos que quedaron a medias (p. ej. tras un reinicio)
+
+        Solo se retoman los que llevan sin latido desde la fecha indicada: los que
+        sigue haciendo otro proceso renuevan el suyo y no se tocan.
+
+        Args:
+            sin_latido_desde: Fecha límite del último latido
+
+        Returns:
+            Número de trabajos retomados
+        """
+        session = self.get_session()
+        try:
+            reanudados = session.query(Trabajo).filter(
+                Trabajo.estado == 'en_curso',
+                Trabajo.fecha_actualizacion < sin_latido_desde
+            ).update({'estado': 'pendiente'}, synchronize_session=False)
+            session.commit()
+            return reanudados
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def purgar_trabajos(self, antes_de: datetime, simular: bool = False) -> int:
+        """
+        Borra los trabajos completados o fallidos que terminaron antes de una fecha
+
+        Returns:
+            Número de trabajos borrados (o que se borrarían)
+        """
+        session = self.get_session()
+        try:
+            consulta = session.query(Trabajo).filter(
+                Trabajo.estado.in_(['completado', 'fallido']),
+                Trabajo.fecha_fin < antes_de
+            )
+            if simular:
+                return consulta.count()
+            purgados = consulta.delete(synchronize_session=False)
+            session.commit()
+            return purgados
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
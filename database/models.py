@@ -1,7 +1,7 @@
 """
 Modelos de base de datos para la aplicación de Soporte Administrativo
 """
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, LargeBinary
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, LargeBinary, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -67,3 +67,148 @@ class Cliente(Base):
             'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
             'fecha_actualizacion': self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None
         }
+
+
+class SinonimoCampo(Base):
+    """Etiqueta o nombre de campo de un formulario confirmado para un dato del cliente"""
+    __tablename__ = 'sinonimos_campos'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Etiqueta tal y como aparece en el formulario y su forma normalizada (clave única)
+    etiqueta = Column(String(300), nullable=False)
+    etiqueta_normalizada = Column(String(300), unique=True, index=True, nullable=False)
+
+    # Dato del cliente al que corresponde (p. ej. 'razon_social')
+    campo_cliente = Column(String(100), nullable=False)
+
+    # Quién lo confirmó: 'ia' o 'usuario' (las correcciones del usuario prevalecen)
+    origen = Column(String(20), default='ia')
+    usos = Column(Integer, default=1)
+
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SinonimoCampo {self.etiqueta} -> {self.campo_cliente} ({self.origen})>"
+
+
+class SubidaPendiente(Base):
+    """Archivo en la cola de subida a la nube (sobrevive a reinicios de la aplicación)"""
+    __tablename__ = 'subidas_pendientes'
+    __table_args__ = (
+        # Un mismo contenido solo puede estar una vez en la cola de cada carpeta (salvo
+        # las subidas fallidas), aunque lo encolen dos peticiones a la vez
+        Index(
+            'ux_subidas_huella_carpeta', 'huella', 'carpeta', unique=True,
+            sqlite_where=text("estado != 'fallida'"), postgresql_where=text("estado != 'fallida'")
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    nombre_archivo = Column(String(300), nullable=False)
+    carpeta = Column(String(300), nullable=False)
+    huella = Column(String(64), index=True)  # SHA-256 del contenido, para no subir dos veces lo mismo
+    contenido = Column(LargeBinary)  # Se borra al completar la subida
+
+    # Cliente cuyo documento original es este archivo (se le escribe la URL al terminar)
+    cliente_id = Column(Integer, index=True)
+
+    # 'pendiente', 'subiendo', 'completada' o 'fallida'. Mientras se sube,
+    # fecha_actualizacion hace de latido: si deja de renovarse, la subida se retoma
+    estado = Column(String(20), default='pendiente', index=True)
+    intentos = Column(Integer, default=0)
+    proximo_intento = Column(DateTime, default=datetime.utcnow)
+    error = Column(Text)
+
+    # Resultado de la subida
+    url = Column(String(500))
+    public_id = Column(String(300))
+
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SubidaPendiente {self.nombre_archivo} ({self.estado})>"
+
+
+class ArchivoAlmacenado(Base):
+    """Índice local de los archivos guardados en el almacenamiento (para listar y buscar sin red)"""
+    __tablename__ = 'archivos_almacenados'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    public_id = Column(String(300), unique=True, index=True, nullable=False)
+    resource_type = Column(String(20))
+    carpeta = Column(String(300), index=True)
+    nombre_archivo = Column(String(300))
+    formato = Column(String(20))
+    bytes = Column(Integer)
+    url = Column(String(500))
+
+    # Cliente al que pertenece el documento (si se conoce)
+    cliente_id = Column(Integer, index=True)
+
+    fecha_subida = Column(DateTime, index=True)
+    # Última vez que se vio en el almacenamiento al sincronizar (None si solo se ha indexado al subir)
+    fecha_sincronizacion = Column(DateTime)
+
+    def __repr__(self):
+        return f"<ArchivoAlmacenado {self.public_id}>"
+
+    def to_dict(self):
+        """Convierte el objeto a diccionario"""
+        return {
+            'public_id': self.public_id,
+            'resource_type': self.resource_type,
+            'carpeta': self.carpeta,
+            'nombre_archivo': self.nombre_archivo,
+            'formato': self.formato,
+            'bytes': self.bytes,
+            'url': self.url,
+            'cliente_id': self.cliente_id,
+            'fecha_subida': self.fecha_subida.isoformat() if self.fecha_subida else None
+        }
+
+
+class Trabajo(Base):
+    """Extracción o rellenado en segundo plano (el resultado se guarda para descargarlo después)"""
+    __tablename__ = 'trabajos'
+    __table_args__ = (
+        # Un mismo trabajo solo puede estar una vez en la cola (salvo los fallidos),
+        # aunque lo pidan dos sesiones a la vez
+        Index(
+            'ux_trabajos_huella', 'huella', unique=True,
+            sqlite_where=text("estado != 'fallido'"), postgresql_where=text("estado != 'fallido'")
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # 'extraccion', 'rellenado' o 'lote'
+    tipo = Column(String(20), nullable=False, index=True)
+    # SHA-256 del tipo, la entrada y los parámetros: el mismo trabajo no se hace dos veces
+    huella = Column(String(64), index=True)
+
+    nombre_archivo = Column(String(300))
+    entrada = Column(LargeBinary)  # Se borra al terminar
+    parametros = Column(Text)  # JSON
+
+    # 'pendiente', 'en_curso', 'completado' o 'fallido'. Mientras se hace,
+    # fecha_actualizacion hace de latido: si deja de renovarse, el trabajo se retoma
+    estado = Column(String(20), default='pendiente', index=True)
+    error = Column(Text)
+
+    # Resultado (JSON) y documento generado, si lo hay
+    resultado = Column(Text)
+    salida = Column(LargeBinary)
+    nombre_salida = Column(String(300))
+
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_inicio = Column(DateTime)
+    fecha_fin = Column(DateTime)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Trabajo {self.tipo} {self.id} ({self.estado})>"
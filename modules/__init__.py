@@ -4,7 +4,8 @@ Módulos de procesamiento de documentos
 from .pdf_extractor import PDFExtractor
 from .pdf_filler import PDFFiller
 from .word_handler import WordHandler
+from .almacenamiento import Almacenamiento, AlmacenamientoLocal
 from .cloudinary_storage import CloudinaryStorage
 from .auth import AuthManager, mostrar_pagina_login
 
-__all__ = ['PDFExtractor', 'PDFFiller', 'WordHandler', 'CloudinaryStorage', 'AuthManager', 'mostrar_pagina_login']
+__all__ = ['PDFExtractor', 'PDFFiller', 'WordHandler', 'Almacenamiento', 'AlmacenamientoLocal', 'CloudinaryStorage', 'AuthManager', 'mostrar_pagina_login']
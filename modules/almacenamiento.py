@@ -0,0 +1,389 @@
+"""
+Interfaz común de almacenamiento de archivos y almacén local direccionado por contenido
+"""
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Los archivos se leen y copian en bloques de este tamaño
+_TAMANO_BLOQUE = 1024 * 1024
+
+# Transferencias simultáneas por defecto en las operaciones en bloque
+_WORKERS_TRANSFERENCIA = 8
+
+# Prefijo de los temporales del sistema creados por la aplicación (así la limpieza los reconoce)
+PREFIJO_TEMPORAL = 'soporte_admin_'
+
+# Extensiones que Cloudinary guarda como 'image' con resource_type="auto" (incluido el
+# PDF); el resto se guarda como 'raw'
+_EXTENSIONES_IMAGEN = {
+    '.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.svg', '.ico', '.heic', '.avif'
+}
+
+# Directorio del almacén local con las marcas de carpeta de cada archivo
+_DIRECTORIO_CARPETAS = '_carpetas'
+
+OrigenArchivo = Union[str, Path, bytes, bytearray, memoryview, BinaryIO]
+
+
+def tipo_recurso(nombre: Optional[str]) -> str:
+    """Tipo de recurso ('image' o 'raw') que corresponde a un nombre de archivo o a su extensión"""
+    return 'image' if Path(nombre or '').suffix.lower() in _EXTENSIONES_IMAGEN else 'raw'
+
+
+def _bloques(origen: OrigenArchivo):
+    """Recorre el contenido de una ruta, unos bytes o un archivo binario en bloques"""
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        vista = memoryview(origen)
+        for inicio in range(0, len(vista), _TAMANO_BLOQUE):
+            yield vista[inicio:inicio + _TAMANO_BLOQUE]
+        return
+
+    if isinstance(origen, (str, Path)):
+        with open(origen, 'rb') as archivo:
+            yield from iter(lambda: archivo.read(_TAMANO_BLOQUE), b'')
+        return
+
+    posicion = origen.tell() if hasattr(origen, 'tell') else None
+    yield from iter(lambda: origen.read(_TAMANO_BLOQUE), b'')
+    if posicion is not None:
+        origen.seek(posicion)
+
+
+def en_paralelo(funcion: Callable, elementos: Sequence, workers: int = _WORKERS_TRANSFERENCIA) -> List[Dict]:
+    """
+    Aplica una función a cada elemento en un pool de hilos acotado
+
+    Los errores no interrumpen el resto: cada elemento tiene su resultado.
+
+    Returns:
+        Lista de diccionarios con 'exito' y 'resultado' o 'error', en el orden de entrada
+    """
+    def ejecutar(elemento):
+        try:
+            return {'exito': True, 'resultado': funcion(elemento)}
+        except Exception as e:
+            return {'exito': False, 'error': str(e)}
+
+    if not elementos:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(elementos)))) as executor:
+        return list(executor.map(ejecutar, elementos))
+
+
+def huella_archivo(origen: OrigenArchivo) -> str:
+    """
+    Huella SHA-256 de un archivo, leyéndolo en bloques
+
+    Args:
+        origen: Ruta, bytes o archivo binario (se deja en la posición en que estaba)
+
+    Returns:
+        Huella en hexadecimal
+    """
+    huella = hashlib.sha256()
+    for bloque in _bloques(origen):
+        huella.update(bloque)
+    return huella.hexdigest()
+
+
+class Almacenamiento(ABC):
+    """
+    Almacenamiento de archivos subidos y generados
+
+    Todas las implementaciones deduplican por contenido: subir dos veces el mismo
+    archivo lo guarda una sola vez y devuelve la referencia ('public_id') existente,
+    con 'duplicado' a True.
+    """
+
+    @abstractmethod
+    def subir_archivo(self, archivo_path: OrigenArchivo, folder: str = "soporte_admin",
+                      resource_type: str = "auto", nombre_archivo: str = None) -> Dict:
+        """
+        Guarda un archivo
+
+        Args:
+            archivo_path: Ruta local del archivo, bytes o archivo binario
+            folder: Carpeta lógica donde guardar
+            resource_type: Tipo de recurso (solo lo usan los almacenes que lo distinguen)
+            nombre_archivo: Nombre del archivo (necesario si no se pasa una ruta)
+
+        Returns:
+            Diccionario con 'public_id', 'url', 'format', 'size', 'created_at' y 'duplicado'
+        """
+
+    def subir_desde_bytes(self, archivo_bytes: bytes, nombre_archivo: str, folder: str = "soporte_admin") -> Dict:
+        """Guarda un archivo que está en memoria"""
+        return self.subir_archivo(archivo_bytes, folder=folder, nombre_archivo=nombre_archivo)
+
+    def subir_archivos(self, archivos: Sequence[Tuple[OrigenArchivo, str]], folder: str = "soporte_admin",
+                       workers: int = _WORKERS_TRANSFERENCIA) -> List[Dict]:
+        """
+        Guarda varios archivos a la vez
+
+        Args:
+            archivos: Lista de tuplas (ruta, bytes o archivo binario, nombre_archivo)
+            folder: Carpeta donde guardarlos
+            workers: Subidas simultáneas
+
+        Returns:
+            Un diccionario por archivo, en el mismo orden, con 'nombre_archivo', 'exito'
+            y 'resultado' (lo que devuelve subir_archivo) o 'error'
+        """
+        resultados = en_paralelo(
+            lambda archivo: self.subir_archivo(archivo[0], folder=folder, nombre_archivo=archivo[1]),
+            archivos, workers
+        )
+        return [dict(r, nombre_archivo=nombre) for (_, nombre), r in zip(archivos, resultados)]
+
+    def descargar_archivos(self, public_ids: Sequence[str], directorio: Union[str, Path],
+                           workers: int = _WORKERS_TRANSFERENCIA) -> List[Dict]:
+        """
+        Descarga varios archivos a la vez en un directorio
+
+        Cada archivo se guarda con su public_id como nombre ('/' se cambia por '_').
+
+        Returns:
+            Un diccionario por archivo, en el mismo orden, con 'public_id', 'exito'
+            y 'resultado' (la ruta descargada) o 'error'
+        """
+        directorio = Path(directorio)
+        directorio.mkdir(parents=True, exist_ok=True)
+
+        def descargar(public_id):
+            ruta = directorio / public_id.replace('/', '_')
+            try:
+                with open(ruta, 'wb') as destino:
+                    self.descargar_a(public_id, destino)
+            except Exception:
+                # No dejar archivos a medio escribir
+                ruta.unlink(missing_ok=True)
+                raise
+            return str(ruta)
+
+        resultados = en_paralelo(descargar, public_ids, workers)
+        return [dict(r, public_id=public_id) for public_id, r in zip(public_ids, resultados)]
+
+    def eliminar_archivos(self, public_ids: Sequence[str], resource_type: str = "raw") -> List[Dict]:
+        """
+        Elimina varios archivos
+
+        Returns:
+            Un diccionario por archivo, en el mismo orden, con 'public_id' y 'exito'
+        """
+        return [
+            {'public_id': public_id, 'exito': self.eliminar_archivo(public_id, resource_type)}
+            for public_id in public_ids
+        ]
+
+    @abstractmethod
+    def descargar_a(self, public_id: str, destino: BinaryIO) -> int:
+        """
+        Escribe por bloques un archivo guardado en un archivo binario
+
+        Returns:
+            Número de bytes escritos
+        """
+
+    def descargar_bytes(self, public_id: str) -> bytes:
+        """Devuelve el contenido de un archivo guardado"""
+        salida = BytesIO()
+        self.descargar_a(public_id, salida)
+        return salida.getvalue()
+
+    @abstractmethod
+    def eliminar_archivo(self, public_id: str, resource_type: str = "raw") -> bool:
+        """Elimina un archivo guardado (True si existía y se eliminó)"""
+
+    @abstractmethod
+    def obtener_url(self, public_id: str) -> str:
+        """URL con la que se accede a un archivo guardado"""
+
+    @abstractmethod
+    def iterar_archivos(self, folder: str = "soporte_admin", desde: datetime = None) -> Iterator[Dict]:
+        """
+        Recorre los archivos guardados (creados desde la fecha indicada, si se indica)
+
+        Returns:
+            Generador de diccionarios con 'public_id', 'bytes', 'created_at', 'format',
+            'folder', 'secure_url' y 'resource_type' (el formato de la API de Cloudinary)
+        """
+
+
+class AlmacenamientoLocal(Almacenamiento):
+    """
+    Almacén en disco direccionado por contenido
+
+    Cada archivo se guarda una sola vez en raiz/ab/cd/<sha256>, donde 'ab' y 'cd'
+    son los primeros caracteres de la huella (así ningún directorio acumula miles
+    de archivos). La referencia de un archivo es su huella. Sirve cuando no hay
+    Cloudinary configurado y como sustituto sin red en pruebas y benchmarks.
+    """
+
+    def __init__(self, raiz: Union[str, Path] = 'almacenamiento'):
+        """
+        Args:
+            raiz: Directorio del almacén (se crea si no existe)
+        """
+        self.raiz = Path(raiz)
+        self.raiz.mkdir(parents=True, exist_ok=True)
+
+    def ruta(self, public_id: str) -> Path:
+        """Ruta en disco de un archivo a partir de su huella"""
+        huella = Path(public_id).name
+        if len(huella) != 64 or any(c not in '0123456789abcdef' for c in huella):
+            raise ValueError(f"Referencia no válida para el almacén local: {public_id}")
+        return self.raiz / huella[:2] / huella[2:4] / huella
+
+    def ruta_en_carpeta(self, folder: str, public_id: str) -> Path:
+        """
+        Ruta de la marca que registra un archivo en una carpeta
+
+        El contenido se guarda una sola vez por huella; cada carpeta en la que se ha
+        subido tiene una marca con el nombre original (su fecha es la de la subida).
+        """
+        partes = Path(folder).parts
+        if not partes or Path(folder).is_absolute() or '..' in partes:
+            raise ValueError(f"Carpeta no válida para el almacén local: {folder}")
+        return self.raiz.joinpath(_DIRECTORIO_CARPETAS, *partes, self.ruta(public_id).name)
+
+    def subir_archivo(self, archivo_path: OrigenArchivo, folder: str = "soporte_admin",
+                      resource_type: str = "auto", nombre_archivo: str = None) -> Dict:
+        """
+        Guarda un archivo en el almacén (si ya está, no lo vuelve a escribir)
+
+        El contenido se copia a un temporal del almacén mientras se calcula su huella
+        y después se mueve a su ruta definitiva en una sola operación.
+        """
+        try:
+            huella = hashlib.sha256()
+            tamano = 0
+            with tempfile.NamedTemporaryFile(dir=self.raiz, prefix='.subida_', delete=False) as tmp:
+                try:
+                    for bloque in _bloques(archivo_path):
+                        huella.update(bloque)
+                        tmp.write(bloque)
+                        tamano += len(bloque)
+                except Exception:
+                    tmp.close()
+                    os.unlink(tmp.name)
+                    raise
+
+            public_id = huella.hexdigest()
+            destino = self.ruta(public_id)
+            duplicado = destino.exists()
+            if duplicado:
+                os.unlink(tmp.name)
+            else:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp.name, destino)
+
+            nombre = nombre_archivo or (Path(archivo_path).name if isinstance(archivo_path, (str, Path)) else None)
+            marca = self.ruta_en_carpeta(folder, public_id)
+            if not marca.exists():
+                marca.parent.mkdir(parents=True, exist_ok=True)
+                marca.write_text(nombre or '', encoding='utf-8')
+            return {
+                'public_id': public_id,
+                'url': destino.resolve().as_uri(),
+                'format': Path(nombre).suffix.lstrip('.') or None if nombre else None,
+                'resource_type': 'raw',
+                'size': tamano,
+                'created_at': datetime.utcfromtimestamp(destino.stat().st_mtime).isoformat(),
+                'duplicado': duplicado
+            }
+
+        except Exception as e:
+            raise Exception(f"Error al guardar archivo en el almacén local: {e}")
+
+    def descargar_a(self, public_id: str, destino: BinaryIO) -> int:
+        """Copia por bloques un archivo del almacén en un archivo binario"""
+        escritos = 0
+        for bloque in _bloques(self.ruta(public_id)):
+            destino.write(bloque)
+            escritos += len(bloque)
+        return escritos
+
+    def descargar_archivo(self, public_id: str, destino_path: Optional[str] = None) -> str:
+        """
+        Devuelve la ruta de un archivo del almacén (o lo copia al destino indicado)
+
+        Returns:
+            Ruta del archivo
+        """
+        if destino_path is None:
+            return str(self.ruta(public_id))
+        with open(destino_path, 'wb') as destino:
+            self.descargar_a(public_id, destino)
+        return str(destino_path)
+
+    def eliminar_archivo(self, public_id: str, resource_type: str = "raw") -> bool:
+        """Elimina un archivo del almacén (y sus marcas de carpeta)"""
+        try:
+            ruta = self.ruta(public_id)
+            ruta.unlink()
+        except (FileNotFoundError, ValueError):
+            return False
+        for marca in (self.raiz / _DIRECTORIO_CARPETAS).rglob(ruta.name):
+            marca.unlink(missing_ok=True)
+        return True
+
+    def obtener_url(self, public_id: str) -> str:
+        """URL file:// del archivo en disco (solo sirve en el servidor, no en el navegador)"""
+        return self.ruta(public_id).resolve().as_uri()
+
+    def iterar_archivos(self, folder: str = "soporte_admin", desde: datetime = None) -> Iterator[Dict]:
+        """
+        Recorre los archivos de una carpeta (y sus subcarpetas), del más reciente al más antiguo
+
+        La carpeta de cada archivo sale de sus marcas de carpeta. Los archivos guardados
+        antes de que existieran las marcas se devuelven sin carpeta ('folder' None),
+        así que el índice conserva la que ya tuvieran.
+        """
+        limite = (desde - datetime(1970, 1, 1)).total_seconds() if desde is not None else None
+        carpetas = self.raiz / _DIRECTORIO_CARPETAS
+        base = self.ruta_en_carpeta(folder, '0' * 64).parent
+
+        marcados = set()
+        archivos = []  # (fecha, huella, marca o None)
+        for marca in carpetas.rglob('*'):
+            if not marca.is_file():
+                continue
+            marcados.add(marca.name)
+            if marca.parent == base or base in marca.parents:
+                archivos.append((marca.stat().st_mtime, marca.name, marca))
+        for ruta in self.raiz.glob('??/??/*'):
+            if ruta.is_file() and not ruta.name.startswith('.') and ruta.name not in marcados:
+                archivos.append((ruta.stat().st_mtime, ruta.name, None))
+
+        # Un mismo contenido subido a varias carpetas se devuelve una vez (su subida más reciente)
+        devueltos = set()
+        for fecha, huella, marca in sorted(archivos, key=lambda a: a[0], reverse=True):
+            if limite is not None and fecha < limite:
+                break
+            if huella in devueltos:
+                continue
+            devueltos.add(huella)
+            ruta = self.ruta(huella)
+            try:
+                tamano = ruta.stat().st_size
+            except FileNotFoundError:
+                continue
+            carpeta = marca.parent.relative_to(carpetas).as_posix() if marca else None
+            nombre = (marca.read_text(encoding='utf-8') or None) if marca else None
+            yield {
+                'public_id': huella,
+                'bytes': tamano,
+                'created_at': datetime.utcfromtimestamp(fecha).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'format': Path(nombre).suffix.lstrip('.') or None if nombre else None,
+                'original_filename': nombre,
+                'folder': carpeta,
+                'secure_url': ruta.resolve().as_uri(),
+                'resource_type': 'raw'
+            }
@@ -0,0 +1,193 @@
+"""
+Módulo con una caché en disco, limitada por tamaño, para los archivos descargados del almacenamiento
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional, Union
+
+# Tamaño máximo por defecto de la caché
+_MAX_BYTES_CACHE = 512 * 1024 * 1024
+
+
+class CacheDescargas:
+    """
+    Caché LRU en disco de archivos descargados, por public_id y versión
+
+    Cada archivo se escribe primero en un temporal del directorio de la caché y se
+    mueve a su sitio en una sola operación, así que nunca se sirve un archivo a
+    medio escribir. Cuando la caché supera su tamaño máximo se borran los archivos
+    usados hace más tiempo.
+    """
+
+    def __init__(self, directorio: Union[str, Path] = '.cache_descargas', max_bytes: int = _MAX_BYTES_CACHE):
+        """
+        Args:
+            directorio: Directorio de la caché (se crea si no existe)
+            max_bytes: Tamaño máximo del contenido de la caché
+        """
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # nombre de archivo -> bytes, del menos al más usado
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.bytes_ahorrados = 0
+
+        # Retomar lo que haya en disco, ordenado por último uso
+        existentes = []
+        for ruta in self.directorio.iterdir():
+            if ruta.name.startswith('.'):
+                # Temporales de escrituras interrumpidas
+                ruta.unlink(missing_ok=True)
+            elif ruta.is_file():
+                estado = ruta.stat()
+                existentes.append((estado.st_mtime, ruta.name, estado.st_size))
+        for _, nombre, tamano in sorted(existentes):
+            self._entradas[nombre] = tamano
+            self._bytes += tamano
+        self._expulsar()
+
+    @staticmethod
+    def _nombre(public_id: str, version=None) -> str:
+        """
+        Nombre del archivo de la caché para un public_id y una versión
+
+        Empieza por la huella del public_id, así que se pueden encontrar todas las
+        versiones de un archivo sin conocerlas (ver olvidar).
+        """
+        return f"{CacheDescargas._prefijo(public_id)}_{hashlib.sha256(str(version or '').encode('utf-8')).hexdigest()[:16]}"
+
+    @staticmethod
+    def _prefijo(public_id: str) -> str:
+        """Parte común de los nombres de todas las versiones de un public_id"""
+        return hashlib.sha256(public_id.encode('utf-8')).hexdigest()
+
+    def abrir(self, public_id: str, version=None) -> Optional[BinaryIO]:
+        """
+        Abre el archivo en caché para leerlo, o devuelve None si no está (cuenta acierto o fallo)
+
+        El archivo se abre con el lock tomado, así que una expulsión posterior no
+        puede borrarlo antes de abrirlo; el archivo abierto se sigue leyendo entero
+        aunque se expulse mientras tanto.
+
+        Args:
+            public_id: ID público del archivo
+            version: Versión del archivo (None si el public_id no cambia de contenido)
+        """
+        nombre = self._nombre(public_id, version)
+        ruta = self.directorio / nombre
+        with self._lock:
+            tamano = self._entradas.get(nombre)
+            if tamano is not None:
+                try:
+                    archivo = open(ruta, 'rb')
+                except FileNotFoundError:
+                    # Borrado desde fuera de la caché
+                    del self._entradas[nombre]
+                    self._bytes -= tamano
+                else:
+                    self._entradas.move_to_end(nombre)
+                    self.aciertos += 1
+                    self.bytes_ahorrados += tamano
+                    os.utime(ruta)
+                    return archivo
+            self.fallos += 1
+            return None
+
+    def guardar(self, public_id: str, version, escribir: Callable[[BinaryIO], int]) -> Path:
+        """
+        Añade un archivo a la caché escribiéndolo de forma atómica
+
+        Args:
+            public_id: ID público del archivo
+            version: Versión del archivo
+            escribir: Función que escribe el contenido en el archivo binario que recibe
+
+        Returns:
+            Ruta del archivo en caché
+        """
+        ruta = self.directorio / self._nombre(public_id, version)
+        self._guardar(ruta, escribir, abrir=False)
+        return ruta
+
+    def abrir_o_descargar(self, public_id: str, version, descargar: Callable[[BinaryIO], int]) -> BinaryIO:
+        """Abre el archivo en caché para leerlo, descargándolo antes si no está"""
+        archivo = self.abrir(public_id, version)
+        if archivo is None:
+            archivo = self._guardar(self.directorio / self._nombre(public_id, version), descargar, abrir=True)
+        return archivo
+
+    def _guardar(self, ruta: Path, escribir: Callable[[BinaryIO], int], abrir: bool) -> Optional[BinaryIO]:
+        """Escribe un archivo en un temporal y lo pone en su sitio (abierto para leer si se pide)"""
+        with tempfile.NamedTemporaryFile(dir=self.directorio, prefix='.descarga_', delete=False) as tmp:
+            try:
+                escribir(tmp)
+            except Exception:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        tamano = os.path.getsize(tmp.name)
+
+        with self._lock:
+            os.replace(tmp.name, ruta)
+            archivo = open(ruta, 'rb') if abrir else None
+            self._bytes += tamano - self._entradas.pop(ruta.name, 0)
+            self._entradas[ruta.name] = tamano
+            self._expulsar(conservar=ruta.name)
+        return archivo
+
+    def olvidar(self, public_ids) -> int:
+        """
+        Quita de la caché todas las versiones de los archivos indicados (p. ej. al borrarlos)
+
+        Args:
+            public_ids: IDs públicos de los archivos
+
+        Returns:
+            Número de archivos quitados
+        """
+        prefijos = {self._prefijo(public_id) for public_id in public_ids}
+        with self._lock:
+            nombres = [nombre for nombre in self._entradas if nombre.split('_', 1)[0] in prefijos]
+            for nombre in nombres:
+                self._bytes -= self._entradas.pop(nombre)
+                self._borrar(nombre)
+        return len(nombres)
+
+    def _expulsar(self, conservar: str = None):
+        """Borra los archivos menos usados hasta volver al tamaño máximo (con el lock tomado)"""
+        while self._bytes > self.max_bytes and self._entradas:
+            nombre, tamano = next(iter(self._entradas.items()))
+            if nombre == conservar:
+                # Un archivo mayor que la caché entera se sirve, pero será el primero en salir
+                break
+            del self._entradas[nombre]
+            self._bytes -= tamano
+            self._borrar(nombre)
+
+    def _borrar(self, nombre: str):
+        """Borra un archivo de la caché del disco (con el lock tomado)"""
+        try:
+            (self.directorio / nombre).unlink(missing_ok=True)
+        except OSError:
+            # Abierto por una lectura en curso en un sistema que no deja borrarlo
+            # (Windows): se queda en disco y se retoma al reiniciar
+            pass
+
+    def estadisticas(self) -> Dict:
+        """Aciertos, fallos, bytes ahorrados y ocupación de la caché"""
+        with self._lock:
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'bytes_ahorrados': self.bytes_ahorrados,
+                'bytes_en_cache': self._bytes,
+                'archivos': len(self._entradas)
+            }
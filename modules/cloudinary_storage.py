@@ -4,14 +4,84 @@ Módulo para gestionar archivos en Cloudinary
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
 import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+from itertools import islice
 from pathlib import Path
-from typing import Optional, Dict
+from typing import BinaryIO, Iterator, Optional, Dict, Union
 import tempfile
 import requests
-
-class CloudinaryStorage:
-    def __init__(self, cloud_name: str = None, api_key: str = None, api_secret: str = None):
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .almacenamiento import PREFIJO_TEMPORAL, Almacenamiento, huella_archivo, tipo_recurso
+from .cache_descargas import CacheDescargas
+
+# Las descargas se escriben en bloques de este tamaño (nunca se cargan enteras en memoria)
+_TAMANO_BLOQUE = 1024 * 1024
+
+# A partir de este tamaño las subidas se hacen por partes (la memoria no crece con el archivo)
+_UMBRAL_SUBIDA_POR_PARTES = 20 * 1024 * 1024
+_TAMANO_PARTE = 20 * 1024 * 1024
+
+# Sesión HTTP compartida: reutiliza las conexiones entre descargas (keep-alive)
+_SESION = None
+_LOCK_SESION = threading.Lock()
+
+# Máximo de public_ids por llamada a la API de borrado por lotes
+_MAX_BORRADO_LOTE = 100
+
+# Archivos ya subidos en este proceso: (huella, carpeta) -> resultado de la subida
+# (se olvidan al borrarlos, para que volver a subirlos los suba de verdad)
+_SUBIDOS = OrderedDict()
+_MAX_SUBIDOS = 256
+_LOCK_SUBIDOS = threading.Lock()
+
+def _olvidar_subidos(public_ids):
+    """Quita de la memoria de subidas los archivos borrados"""
+    public_ids = set(public_ids)
+    with _LOCK_SUBIDOS:
+        for clave in [c for c, subido in _SUBIDOS.items() if subido['public_id'] in public_ids]:
+            del _SUBIDOS[clave]
+
+
+def _sesion_http() -> requests.Session:
+    """Sesión HTTP con pool de conexiones y reintentos de las descargas fallidas"""
+    global _SESION
+    with _LOCK_SESION:
+        if _SESION is None:
+            sesion = requests.Session()
+            reintentos = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                               allowed_methods=frozenset({'GET'}))
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=reintentos)
+            sesion.mount('https://', adaptador)
+            sesion.mount('http://', adaptador)
+            _SESION = sesion
+        return _SESION
+
+
+def _tamano_origen(origen) -> Optional[int]:
+    """Tamaño en bytes de una ruta, unos bytes o un archivo binario (None si no se puede saber)"""
+    if isinstance(origen, (str, Path)):
+        return os.path.getsize(origen)
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        return len(origen)
+    if hasattr(origen, 'seek') and hasattr(origen, 'tell'):
+        posicion = origen.tell()
+        origen.seek(0, os.SEEK_END)
+        tamano = origen.tell() - posicion
+        origen.seek(posicion)
+        return tamano
+    return None
+
+
+class CloudinaryStorage(Almacenamiento):
+    def __init__(self, cloud_name: str = None, api_key: str = None, api_secret: str = None,
+                 cache: CacheDescargas = None):
         """
         Inicializa el gestor de Cloudinary
 
@@ -19,7 +89,9 @@ class CloudinaryStorage:
             cloud_name: Nombre del cloud de Cloudinary
             api_key: API key de Cloudinary
             api_secret: API secret de Cloudinary
+            cache: Caché en disco de las descargas (opcional)
         """
+        self.cache = cache
         self.cloud_name = cloud_name or os.getenv('CLOUDINARY_CLOUD_NAME')
         self.api_key = api_key or os.getenv('CLOUDINARY_API_KEY')
         self.api_secret = api_secret or os.getenv('CLOUDINARY_API_SECRET')
@@ -35,35 +107,87 @@ class CloudinaryStorage:
             secure=True
         )
 
-    def subir_archivo(self, archivo_path: str, folder: str = "soporte_admin", resource_type: str = "auto") -> Dict:
+    def subir_archivo(self, archivo_path: Union[str, bytes, BinaryIO], folder: str = "soporte_admin",
+                      resource_type: str = "auto", nombre_archivo: str = None) -> Dict:
         """
         Sube un archivo a Cloudinary
 
+        El public_id es la huella SHA-256 del contenido y no se sobrescriben recursos
+        existentes, así que un archivo idéntico en la misma carpeta se guarda una sola
+        vez y se devuelve la referencia existente (sin volver a enviarlo si ya se subió
+        desde este proceso). Con resource_type="auto", los archivos que no son imágenes
+        ni PDF se suben como 'raw' y su public_id conserva la extensión (Cloudinary no
+        la guarda aparte para ellos); el nombre original queda como original_filename.
+
+        Los archivos grandes se suben por partes leyendo el origen poco a poco, así
+        que la memoria no crece con el tamaño del archivo (un archivo binario pasado
+        así queda cerrado al terminar).
+
         Args:
-            archivo_path: Ruta local del archivo
+            archivo_path: Ruta local del archivo, bytes o archivo binario
             folder: Carpeta en Cloudinary donde guardar
             resource_type: Tipo de recurso (auto, image, video, raw)
+            nombre_archivo: Nombre del archivo (necesario si no se pasa una ruta)
 
         Returns:
             Diccionario con información del archivo subido
         """
         try:
-            # Subir archivo
-            resultado = cloudinary.uploader.upload(
-                archivo_path,
-                folder=folder,
-                resource_type=resource_type,
-                use_filename=True,
-                unique_filename=True
-            )
-
-            return {
+            huella = huella_archivo(archivo_path)
+            clave = (huella, folder)
+            with _LOCK_SUBIDOS:
+                if clave in _SUBIDOS:
+                    _SUBIDOS.move_to_end(clave)
+                    return dict(_SUBIDOS[clave], duplicado=True)
+
+            nombre = nombre_archivo or (Path(archivo_path).name if isinstance(archivo_path, (str, Path)) else None)
+            if resource_type == 'auto' and nombre:
+                resource_type = tipo_recurso(nombre)
+
+            public_id = huella
+            if resource_type == 'raw' and nombre:
+                public_id += Path(nombre).suffix.lower()
+            opciones = {'public_id': public_id, 'overwrite': False}
+            if nombre:
+                opciones['filename'] = nombre
+                opciones['filename_override'] = nombre
+
+            tamano = _tamano_origen(archivo_path)
+            if tamano is not None and tamano > _UMBRAL_SUBIDA_POR_PARTES:
+                # Los bytes en memoria se leen por partes a través de una vista, sin copiarlos
+                if isinstance(archivo_path, (bytes, bytearray, memoryview)):
+                    archivo_path = BytesIO(archivo_path)
+                elif isinstance(archivo_path, Path):
+                    archivo_path = str(archivo_path)
+                resultado = cloudinary.uploader.upload_large(
+                    archivo_path,
+                    folder=folder,
+                    resource_type=resource_type,
+                    chunk_size=_TAMANO_PARTE,
+                    **opciones
+                )
+            else:
+                # Subir archivo (Cloudinary acepta ruta, bytes o archivo abierto)
+                resultado = cloudinary.uploader.upload(
+                    archivo_path,
+                    folder=folder,
+                    resource_type=resource_type,
+                    **opciones
+                )
+
+            subido = {
                 'public_id': resultado['public_id'],
                 'url': resultado['secure_url'],
                 'format': resultado.get('format'),
+                'resource_type': resultado.get('resource_type', resource_type),
                 'size': resultado.get('bytes'),
                 'created_at': resultado.get('created_at')
             }
+            with _LOCK_SUBIDOS:
+                _SUBIDOS[clave] = subido
+                while len(_SUBIDOS) > _MAX_SUBIDOS:
+                    _SUBIDOS.popitem(last=False)
+            return dict(subido, duplicado=bool(resultado.get('existing')))
 
         except Exception as e:
             raise Exception(f"Error al subir archivo a Cloudinary: {e}")
@@ -73,7 +197,7 @@ class CloudinaryStorage:
         Sube un archivo desde bytes a Cloudinary
 
         Args:
-            archivo_bytes: Contenido del archivo en bytes
+            archivo_bytes: Contenido del archivo en bytes (o archivo binario abierto)
             nombre_archivo: Nombre del archivo
             folder: Carpeta en Cloudinary
 
@@ -81,50 +205,101 @@ class CloudinaryStorage:
             Diccionario con información del archivo subido
         """
         try:
-            # Crear archivo temporal
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(nombre_archivo).suffix) as tmp:
-                tmp.write(archivo_bytes)
-                tmp_path = tmp.name
+            # Subir directamente desde memoria, sin archivo temporal
+            if isinstance(archivo_bytes, (bytearray, memoryview)) and len(archivo_bytes) <= _UMBRAL_SUBIDA_POR_PARTES:
+                archivo_bytes = bytes(archivo_bytes)
+            return self.subir_archivo(archivo_bytes, folder=folder, nombre_archivo=nombre_archivo)
 
-            # Subir archivo temporal
-            resultado = self.subir_archivo(tmp_path, folder=folder)
+        except Exception as e:
+            raise Exception(f"Error al subir archivo desde bytes: {e}")
 
-            # Eliminar archivo temporal
-            os.unlink(tmp_path)
+    def descargar_bytes(self, public_id: str, version=None) -> bytes:
+        """
+        Descarga un archivo de Cloudinary a memoria
 
-            return resultado
+        Args:
+            public_id: ID público del archivo en Cloudinary
+            version: Versión del archivo (None si el public_id no cambia de contenido)
+
+        Returns:
+            Contenido del archivo
+        """
+        try:
+            salida = BytesIO()
+            self.descargar_a(public_id, salida, version)
+            return salida.getvalue()
 
         except Exception as e:
-            raise Exception(f"Error al subir archivo desde bytes: {e}")
+            raise Exception(f"Error al descargar archivo de Cloudinary: {e}")
+
+    def descargar_a(self, public_id: str, destino: BinaryIO, version=None) -> int:
+        """
+        Descarga un archivo de Cloudinary escribiéndolo por bloques en un archivo binario
+
+        Si hay caché y el archivo está en ella, se copia desde disco sin ninguna petición.
+
+        Args:
+            public_id: ID público del archivo en Cloudinary
+            destino: Archivo binario abierto para escritura
+            version: Versión del archivo (None si el public_id no cambia de contenido)
+
+        Returns:
+            Número de bytes escritos
+        """
+        if self.cache is None:
+            return self._descargar_remoto(public_id, destino, version)
+
+        escritos = 0
+        with self.cache.abrir_o_descargar(
+            public_id, version, lambda f: self._descargar_remoto(public_id, f, version)
+        ) as origen:
+            for bloque in iter(lambda: origen.read(_TAMANO_BLOQUE), b''):
+                destino.write(bloque)
+                escritos += len(bloque)
+        return escritos
+
+    def _descargar_remoto(self, public_id: str, destino: BinaryIO, version=None) -> int:
+        """Descarga un archivo de Cloudinary por bloques (siempre por la red)"""
+        opciones = {'version': version} if version else {}
+        url = cloudinary.utils.cloudinary_url(public_id, resource_type=self._tipo_public_id(public_id), **opciones)[0]
+        escritos = 0
+        with _sesion_http().get(url, stream=True, timeout=(10, 60)) as response:
+            response.raise_for_status()
+            for bloque in response.iter_content(chunk_size=_TAMANO_BLOQUE):
+                destino.write(bloque)
+                escritos += len(bloque)
+        return escritos
 
-    def descargar_archivo(self, public_id: str, destino_path: Optional[str] = None) -> str:
+    def descargar_archivo(self, public_id: str, destino_path: Optional[str] = None, version=None) -> str:
         """
         Descarga un archivo de Cloudinary
 
         Args:
             public_id: ID público del archivo en Cloudinary
             destino_path: Ruta donde guardar (opcional, si no se usa archivo temporal)
+            version: Versión del archivo (None si el public_id no cambia de contenido)
 
         Returns:
             Ruta del archivo descargado
         """
         try:
-            # Obtener URL del archivo
-            url = cloudinary.CloudinaryImage(public_id).build_url()
-
-            # Descargar archivo
-            response = requests.get(url)
-            response.raise_for_status()
-
             # Si no se especifica destino, usar archivo temporal
             if destino_path is None:
                 extension = Path(public_id).suffix or '.bin'
-                with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp:
-                    tmp.write(response.content)
+                with tempfile.NamedTemporaryFile(delete=False, prefix=PREFIJO_TEMPORAL, suffix=extension) as tmp:
                     destino_path = tmp.name
             else:
+                destino_path = str(destino_path)
+
+            # Descargar por bloques directamente al destino
+            try:
                 with open(destino_path, 'wb') as f:
-                    f.write(response.content)
+                    self.descargar_a(public_id, f, version)
+            except Exception:
+                # No dejar archivos a medio escribir
+                if os.path.exists(destino_path):
+                    os.unlink(destino_path)
+                raise
 
             return destino_path
 
@@ -144,29 +319,101 @@ class CloudinaryStorage:
         """
         try:
             resultado = cloudinary.uploader.destroy(public_id, resource_type=resource_type)
+            if resultado.get('result') in ('ok', 'not found'):
+                self._olvidar([public_id])
             return resultado.get('result') == 'ok'
         except Exception as e:
             print(f"Error al eliminar archivo: {e}")
             return False
 
+    def iterar_archivos(self, folder: str = "soporte_admin", desde: datetime = None,
+                        resource_types=("image", "raw"), tamano_pagina: int = 500) -> Iterator[Dict]:
+        """
+        Recorre todos los archivos de una carpeta de Cloudinary, página a página
+
+        Usa la Search API ordenada por fecha de creación (la API de recursos con prefijo
+        ordena por public_id, que es una huella, así que no sirve para cortar por fecha)
+        y sigue su next_cursor, así que las carpetas grandes no se truncan. Dentro de
+        cada tipo de recurso los archivos llegan del más reciente al más antiguo.
+
+        Args:
+            folder: Carpeta a recorrer
+            desde: Solo archivos creados en esa fecha o después (UTC)
+            resource_types: Tipos de recurso a recorrer (los PDF se guardan como 'image', los .docx como 'raw')
+            tamano_pagina: Archivos por llamada a la API (máximo 500)
+
+        Returns:
+            Generador de diccionarios con los datos de cada archivo según la API
+        """
+        limite = desde.strftime('%Y-%m-%dT%H:%M:%S') if desde is not None else None
+        for resource_type in resource_types:
+            expresion = f'resource_type:{resource_type} AND type:upload AND folder:"{folder}/*"'
+            if desde is not None:
+                # El filtro de la API es por días; el corte exacto se hace abajo
+                expresion += f' AND created_at>={desde.strftime("%Y-%m-%d")}'
+
+            cursor = None
+            while True:
+                busqueda = cloudinary.Search().expression(expresion).sort_by('created_at', 'desc') \
+                    .max_results(min(tamano_pagina, 500))
+                if cursor:
+                    busqueda = busqueda.next_cursor(cursor)
+                pagina = busqueda.execute()
+
+                for recurso in pagina.get('resources', []):
+                    # Ordenados por fecha: el primero anterior a 'desde' cierra el recorrido
+                    if limite is not None and recurso.get('created_at', '')[:19] < limite:
+                        cursor = None
+                        break
+                    yield recurso
+                else:
+                    cursor = pagina.get('next_cursor')
+                if not cursor:
+                    break
+
+    def eliminar_archivos(self, public_ids, resource_type: str = "raw") -> list:
+        """
+        Elimina varios archivos de Cloudinary con la API de borrado por lotes
+
+        Se hace una llamada por cada 100 public_ids (el máximo que admite la API).
+
+        Args:
+            public_ids: IDs públicos de los archivos
+            resource_type: Tipo de recurso de todos ellos
+
+        Returns:
+            Un diccionario por archivo, en el mismo orden, con 'public_id', 'exito'
+            y 'estado' (el que devuelve la API, p. ej. 'deleted' o 'not_found') o 'error'
+        """
+        public_ids = list(public_ids)
+        resultados = []
+        for inicio in range(0, len(public_ids), _MAX_BORRADO_LOTE):
+            lote = public_ids[inicio:inicio + _MAX_BORRADO_LOTE]
+            try:
+                borrados = cloudinary.api.delete_resources(lote, resource_type=resource_type).get('deleted', {})
+            except Exception as e:
+                resultados.extend({'public_id': p, 'exito': False, 'error': str(e)} for p in lote)
+                continue
+            for public_id in lote:
+                estado = borrados.get(public_id)
+                resultados.append({'public_id': public_id, 'exito': estado == 'deleted', 'estado': estado})
+            self._olvidar([p for p in lote if borrados.get(p) in ('deleted', 'not_found')])
+        return resultados
+
     def listar_archivos(self, folder: str = "soporte_admin", max_results: int = 100) -> list:
         """
         Lista archivos en una carpeta de Cloudinary
 
         Args:
             folder: Carpeta a listar
-            max_results: Número máximo de resultados
+            max_results: Número máximo de resultados (None para todos)
 
         Returns:
             Lista de archivos
         """
         try:
-            resultado = cloudinary.api.resources(
-                type="upload",
-                prefix=folder,
-                max_results=max_results
-            )
-            return resultado.get('resources', [])
+            tamano_pagina = min(max_results, 500) if max_results else 500
+            return list(islice(self.iterar_archivos(folder, tamano_pagina=tamano_pagina), max_results))
         except Exception as e:
             print(f"Error al listar archivos: {e}")
             return []
@@ -181,7 +428,18 @@ class CloudinaryStorage:
         Returns:
             URL del archivo
         """
-        return cloudinary.CloudinaryImage(public_id).build_url(secure=True)
+        return cloudinary.utils.cloudinary_url(public_id, resource_type=self._tipo_public_id(public_id), secure=True)[0]
+
+    def _olvidar(self, public_ids: list):
+        """Quita los archivos borrados de la memoria de subidas y de la caché de descargas"""
+        _olvidar_subidos(public_ids)
+        if self.cache is not None:
+            self.cache.olvidar(public_ids)
+
+    @staticmethod
+    def _tipo_public_id(public_id: str) -> str:
+        """Tipo de recurso de un public_id: solo los 'raw' llevan extensión en el public_id"""
+        return 'raw' if Path(public_id).suffix and tipo_recurso(public_id) == 'raw' else 'image'
 
     def crear_carpetas(self):
         """
@@ -0,0 +1,174 @@
+"""
+Módulo para subir archivos a la nube en segundo plano, con cola persistente y reintentos
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+
+class ColaSubidas:
+    """
+    Cola de subidas al almacenamiento (Cloudinary o local) atendida por un pool de hilos
+
+    Los archivos se guardan en la base de datos antes de subirlos, así que la interfaz
+    no espera a la nube y las subidas pendientes sobreviven a un reinicio. Cada fallo
+    se reintenta con espera exponencial hasta agotar los intentos.
+
+    Mientras sube, el repartidor renueva el latido de sus subidas en la base de
+    datos; las que se quedan sin latido (su proceso ha muerto) se vuelven a poner en
+    cola, sin tocar las que está subiendo otro proceso.
+    """
+
+    def __init__(self, db_manager, storage, workers: int = 2, max_intentos: int = 5,
+                 espera_base: float = 2.0, espera_maxima: float = 300.0, intervalo: float = 5.0,
+                 caducidad: float = 120.0):
+        """
+        Args:
+            db_manager: Gestor de base de datos donde se guarda la cola
+            storage: Almacenamiento donde se guardan los archivos (Cloudinary o local)
+            workers: Número de subidas simultáneas
+            max_intentos: Intentos antes de dar una subida por fallida
+            espera_base: Segundos de espera tras el primer fallo (se duplican en cada fallo)
+            espera_maxima: Espera máxima entre reintentos, en segundos
+            intervalo: Cada cuántos segundos se revisa la cola aunque no lleguen archivos nuevos
+            caducidad: Segundos sin latido tras los que una subida en curso se da por abandonada
+                       (debe ser bastante mayor que el intervalo)
+        """
+        self.db_manager = db_manager
+        self.storage = storage
+        self.workers = workers
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.intervalo = intervalo
+        self.caducidad = caducidad
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='subida')
+        self._hay_trabajo = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        """Arranca el hilo que reparte las subidas (retoma las que quedaron a medias)"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._repartir, name='cola_subidas', daemon=True)
+        self._hilo.start()
+
+    def detener(self, esperar: bool = True):
+        """Detiene el reparto de subidas (las que están en curso terminan)"""
+        self._detener.set()
+        self._hay_trabajo.set()
+        if self._hilo is not None and esperar:
+            self._hilo.join()
+        self._executor.shutdown(wait=esperar)
+
+    def encolar(self, contenido: bytes, nombre_archivo: str, folder: str = "soporte_admin",
+                cliente_id: int = None) -> int:
+        """
+        Añade un archivo a la cola y vuelve inmediatamente
+
+        Args:
+            contenido: Contenido del archivo
+            nombre_archivo: Nombre del archivo
+            folder: Carpeta del almacenamiento
+            cliente_id: Cliente al que escribir la URL cuando termine la subida
+
+        Returns:
+            ID de la subida (para consultar su estado)
+        """
+        contenido = bytes(contenido)
+        subida_id = self.db_manager.encolar_subida(
+            nombre_archivo, folder, contenido, hashlib.sha256(contenido).hexdigest(), cliente_id
+        )
+        self._hay_trabajo.set()
+        return subida_id
+
+    def estado(self, subida_id: int) -> Optional[Dict]:
+        """
+        Estado de una subida
+
+        Returns:
+            Diccionario con 'estado', 'url', 'public_id', 'nombre_archivo', 'intentos' y
+            'error', o None si no existe
+        """
+        subida = self.db_manager.obtener_subida(subida_id)
+        if subida is None:
+            return None
+        return {
+            'estado': subida.estado,
+            'url': subida.url,
+            'public_id': subida.public_id,
+            'nombre_archivo': subida.nombre_archivo,
+            'intentos': subida.intentos,
+            'error': subida.error
+        }
+
+    def _repartir(self):
+        """
+        Bucle del hilo repartidor: reserva subidas en cuanto queda un hilo libre
+
+        Cada subida que termina despierta al repartidor, así que un hilo libre no
+        espera a que acaben las demás del lote. En cada vuelta se renueva el latido
+        de las subidas en curso y, de vez en cuando, se retoman las abandonadas.
+        """
+        en_curso = {}  # futuro -> ID de la subida
+        ultima_revision = None
+        while not self._detener.is_set():
+            self._hay_trabajo.clear()
+            en_curso = {futuro: subida_id for futuro, subida_id in en_curso.items() if not futuro.done()}
+
+            try:
+                if ultima_revision is None or time.monotonic() - ultima_revision >= self.caducidad / 2:
+                    self.db_manager.reanudar_subidas_interrumpidas(
+                        datetime.utcnow() - timedelta(seconds=self.caducidad)
+                    )
+                    ultima_revision = time.monotonic()
+                self.db_manager.renovar_subidas(list(en_curso.values()))
+
+                libres = self.workers - len(en_curso)
+                subidas = self.db_manager.tomar_subidas_pendientes(limite=libres) if libres > 0 else []
+            except Exception as e:
+                print(f"Error al leer la cola de subidas: {e}")
+                subidas = []
+
+            for subida in subidas:
+                futuro = self._executor.submit(self._subir, subida)
+                en_curso[futuro] = subida['id']
+                futuro.add_done_callback(lambda _: self._hay_trabajo.set())
+
+            # Dormir hasta que llegue un archivo, termine una subida o toque revisar
+            # los reintentos y renovar los latidos
+            self._hay_trabajo.wait(self.intervalo)
+
+    def _subir(self, subida: Dict):
+        """Sube un archivo reservado y registra el resultado"""
+        try:
+            resultado = self.storage.subir_desde_bytes(
+                subida['contenido'], subida['nombre_archivo'], folder=subida['carpeta']
+            )
+        except Exception as e:
+            intentos = subida['intentos'] + 1
+            proximo = None
+            if intentos < self.max_intentos:
+                espera = min(self.espera_base * 2 ** (intentos - 1), self.espera_maxima)
+                proximo = datetime.utcnow() + timedelta(seconds=espera)
+            self._registrar(self.db_manager.fallar_subida, subida['id'], str(e), proximo)
+            return
+
+        self._registrar(
+            self.db_manager.completar_subida, subida['id'], resultado['url'], resultado['public_id'],
+            resultado.get('resource_type')
+        )
+
+    @staticmethod
+    def _registrar(funcion, *args):
+        """Guarda el resultado de una subida sin tumbar el hilo si falla la base de datos"""
+        try:
+            funcion(*args)
+        except Exception as e:
+            print(f"Error al registrar el resultado de la subida: {e}")
@@ -0,0 +1,228 @@
+"""
+Utilidades para trabajar con documentos como rutas, bytes o archivos binarios
+"""
+import copy
+import hashlib
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Union
+
+# Un documento puede llegar como ruta, como bytes o como archivo binario abierto
+Origen = Union[str, Path, bytes, bytearray, memoryview, BinaryIO]
+
+
+def es_ruta(origen: Origen) -> bool:
+    """Indica si el origen es una ruta en disco"""
+    return isinstance(origen, (str, Path))
+
+
+def abrir_binario(origen: Origen) -> Union[str, BinaryIO]:
+    """
+    Prepara un origen para pasarlo a PdfReader o Document
+
+    Las rutas se devuelven tal cual; los bytes se envuelven en un BytesIO (sin copia
+    si ya son bytes) y los archivos abiertos se rebobinan.
+
+    Args:
+        origen: Ruta, bytes o archivo binario
+
+    Returns:
+        Ruta o archivo binario listo para leer desde el principio
+    """
+    if es_ruta(origen):
+        return str(origen)
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        return BytesIO(bytes(origen))
+    if hasattr(origen, 'seek'):
+        origen.seek(0)
+    return origen
+
+
+def leer_bytes(origen: Origen) -> bytes:
+    """
+    Lee el contenido completo de un origen
+
+    Args:
+        origen: Ruta, bytes o archivo binario
+
+    Returns:
+        Contenido del documento
+    """
+    if es_ruta(origen):
+        with open(origen, 'rb') as f:
+            return f.read()
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        return bytes(origen)
+    if hasattr(origen, 'getvalue'):
+        return origen.getvalue()
+    if hasattr(origen, 'seek'):
+        origen.seek(0)
+    return origen.read()
+
+
+def nombre_origen(origen: Origen, nombre_archivo: Optional[str] = None) -> Optional[str]:
+    """Nombre de archivo de un origen (el indicado, el de la ruta o el del archivo abierto)"""
+    if nombre_archivo:
+        return nombre_archivo
+    if es_ruta(origen):
+        return Path(origen).name
+    nombre = getattr(origen, 'name', None)
+    return Path(nombre).name if isinstance(nombre, str) else None
+
+
+class DocumentoPDF:
+    """
+    PDF leído una sola vez y compartido por todas las etapas del rellenado
+
+    El lector, el texto de cada página, el mapa de campos del formulario y la
+    geometría de las páginas se calculan de forma perezosa la primera vez que se
+    piden. 'parseos' cuenta cuántas veces se ha leído el PDF (debe ser 1).
+    """
+
+    # Número total de PDFs leídos en este proceso
+    parseos_totales = 0
+
+    def __init__(self, origen: Origen, nombre_archivo: str = None):
+        """
+        Args:
+            origen: Ruta, bytes o archivo binario del PDF
+            nombre_archivo: Nombre original del archivo (si no se pasa una ruta)
+        """
+        self.datos = leer_bytes(origen)
+        self.nombre = nombre_origen(origen, nombre_archivo)
+        self.ruta = str(origen) if es_ruta(origen) else None
+        self.parseos = 0
+        self._reader = None
+        self._huella = None
+        self._textos_paginas = None
+        self._mapa_formulario = None
+        self._overlay = None
+
+    @classmethod
+    def desde(cls, origen, nombre_archivo: str = None) -> 'DocumentoPDF':
+        """Devuelve el mismo objeto si ya es un DocumentoPDF; si no, lo crea"""
+        if isinstance(origen, cls):
+            return origen
+        return cls(origen, nombre_archivo)
+
+    @property
+    def reader(self):
+        """Lector pypdf del documento (se crea una sola vez)"""
+        if self._reader is None:
+            from pypdf import PdfReader
+            self._reader = PdfReader(BytesIO(self.datos))
+            self.parseos += 1
+            DocumentoPDF.parseos_totales += 1
+        return self._reader
+
+    @property
+    def huella(self) -> str:
+        """Huella SHA-256 del contenido"""
+        if self._huella is None:
+            self._huella = hashlib.sha256(self.datos).hexdigest()
+        return self._huella
+
+    @property
+    def textos_paginas(self) -> List[str]:
+        """Texto extraído de cada página"""
+        if self._textos_paginas is None:
+            self._textos_paginas = [page.extract_text() or '' for page in self.reader.pages]
+        return self._textos_paginas
+
+    @property
+    def mapa_formulario(self):
+        """Mapa campo → widgets → páginas del formulario interactivo"""
+        if self._mapa_formulario is None:
+            from .emparejador_campos import obtener_mapa_formulario
+            self._mapa_formulario = obtener_mapa_formulario(self.reader, self.huella)
+        return self._mapa_formulario
+
+    @property
+    def tiene_formulario(self) -> bool:
+        """Indica si el PDF tiene un formulario interactivo con campos"""
+        return '/AcroForm' in self.reader.trailer['/Root'] and bool(self.mapa_formulario.campos)
+
+    @property
+    def overlay(self):
+        """Geometría de las páginas precompilada para escribir overlays"""
+        if self._overlay is None:
+            from .pdf_overlay import OverlayCompilado
+            self._overlay = OverlayCompilado(self.reader)
+        return self._overlay
+
+
+class DocumentoWord:
+    """
+    Documento Word leído una sola vez y compartido por todas las etapas del rellenado
+
+    El texto se extrae en streaming del XML original, así que no depende de las
+    modificaciones que se hagan después. El árbol python-docx no se modifica nunca:
+    cada rellenado trabaja sobre copia_cuerpo(). 'parseos' cuenta todas las lecturas
+    del XML (árbol python-docx, texto y partes leídas por la plantilla compilada).
+    """
+
+    # Número total de documentos Word leídos en este proceso
+    parseos_totales = 0
+
+    def __init__(self, origen: Origen, nombre_archivo: str = None):
+        """
+        Args:
+            origen: Ruta, bytes o archivo binario del .docx
+            nombre_archivo: Nombre original del archivo (si no se pasa una ruta)
+        """
+        self.datos = leer_bytes(origen)
+        self.nombre = nombre_origen(origen, nombre_archivo)
+        self.ruta = str(origen) if es_ruta(origen) else None
+        self.parseos = 0
+        self._documento = None
+        self._huella = None
+        self._texto = None
+
+    @classmethod
+    def desde(cls, origen, nombre_archivo: str = None) -> 'DocumentoWord':
+        """Devuelve el mismo objeto si ya es un DocumentoWord; si no, lo crea"""
+        if isinstance(origen, cls):
+            return origen
+        return cls(origen, nombre_archivo)
+
+    @property
+    def documento(self):
+        """Documento python-docx (se crea una sola vez y no se modifica; ver copia_cuerpo)"""
+        if self._documento is None:
+            from docx import Document
+            self._documento = Document(BytesIO(self.datos))
+            self.registrar_parseo()
+        return self._documento
+
+    def copia_cuerpo(self):
+        """
+        Copia del elemento raíz de la parte principal, para rellenarla sin tocar el árbol compartido
+
+        Copiar el árbol ya leído es más barato que volver a leer el paquete, y así un
+        mismo DocumentoWord se puede rellenar varias veces (o desde varios hilos).
+
+        Returns:
+            Copia profunda de documento.element (w:document)
+        """
+        return copy.deepcopy(self.documento.element)
+
+    def registrar_parseo(self):
+        """Cuenta una lectura del XML del documento hecha fuera de esta clase"""
+        self.parseos += 1
+        DocumentoWord.parseos_totales += 1
+
+    @property
+    def huella(self) -> str:
+        """Huella SHA-256 del contenido"""
+        if self._huella is None:
+            self._huella = hashlib.sha256(self.datos).hexdigest()
+        return self._huella
+
+    @property
+    def texto(self) -> str:
+        """Texto de párrafos, tablas, cabeceras y pies (leído del XML, sin crear el árbol python-docx)"""
+        if self._texto is None:
+            from .texto_docx import extraer_texto_docx
+            self._texto = extraer_texto_docx(self.datos)
+            self.registrar_parseo()
+        return self._texto
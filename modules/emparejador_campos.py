@@ -0,0 +1,341 @@
+"""
+Módulo para emparejar campos de formularios PDF con los datos del cliente
+"""
+import difflib
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from pypdf import PdfReader
+
+# Variantes conocidas del nombre de cada campo del cliente en formularios
+MAPEO_CAMPOS = {
+    'nombre_representante_legal': ['nombre', 'representante', 'nombre_representante', 'rep_legal'],
+    'dni_representante': ['dni', 'nif', 'dni_representante', 'nif_representante'],
+    'razon_social': ['razon_social', 'empresa', 'nombre_empresa', 'denominacion'],
+    'cif': ['cif', 'nif_empresa', 'cif_empresa'],
+    'direccion': ['direccion', 'domicilio', 'direccion_social'],
+    'correo_electronico': ['email', 'correo', 'correo_electronico', 'e-mail'],
+    'numero_trabajadores': ['trabajadores', 'num_trabajadores', 'plantilla'],
+    'facturacion': ['facturacion', 'volumen_negocio', 'ingresos'],
+    'habilitaciones': ['habilitaciones', 'autorizaciones'],
+    'isos': ['iso', 'isos', 'certificaciones'],
+    'rolece': ['rolece', 'rea'],
+    'tiene_plan_igualdad': ['plan_igualdad', 'igualdad'],
+    'tiene_protocolo_acoso': ['protocolo_acoso', 'acoso']
+}
+
+# Palabras que no aportan significado en los nombres de campos
+PALABRAS_VACIAS = {
+    'txt', 'text', 'texto', 'campo', 'field', 'fld', 'cb', 'chk',
+    'de', 'del', 'la', 'el', 'los', 'las', 'y', 'en', 'con', 'por'
+}
+
+# Estados de casillas y botones de opción que significan "sí" / "no"
+ESTADOS_SI = {'si', 's', 'yes', 'y', 'true', 'on', '1', 'x'}
+ESTADOS_NO = {'no', 'n', 'false', '0'}
+
+# Bits de /Ff en botones (PDF 1.7, tabla 226)
+_FF_RADIO = 1 << 15
+_FF_PULSADOR = 1 << 16
+
+
+def normalizar(texto: str) -> str:
+    """Quita acentos, separa camelCase y pasa a minúsculas"""
+    texto = re.sub(r'([a-z])([A-Z])', r'\1 \2', str(texto))
+    texto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto: str) -> List[str]:
+    """Divide un nombre de campo en palabras significativas"""
+    return [
+        token for token in re.findall(r'[a-z0-9]+', normalizar(texto))
+        if token not in PALABRAS_VACIAS and not re.fullmatch(r'[a-z]?\d+', token)
+    ]
+
+
+def clave_etiqueta(etiqueta: str) -> str:
+    """Forma normalizada de una etiqueta con la que se guarda y se busca"""
+    return ' '.join(tokenizar(etiqueta))
+
+
+class IndiceCampos:
+    """
+    Índice de tokens normalizados para emparejar nombres de campos con datos del cliente
+
+    Cada variante de MAPEO_CAMPOS se indexa por sus palabras (y por su forma unida,
+    p. ej. 'razonsocial'), de modo que emparejar un nombre solo puntúa las variantes
+    que comparten alguna palabra con él.
+    """
+
+    def __init__(self, mapeo: Dict[str, List[str]] = None, umbral: float = 0.5, corte_difuso: float = 0.85):
+        """
+        Args:
+            mapeo: Diccionario {campo_cliente: [variantes]} (por defecto MAPEO_CAMPOS)
+            umbral: Puntuación mínima para aceptar un emparejamiento
+            corte_difuso: Similitud mínima para aceptar una palabra mal escrita (de 5 o más letras)
+        """
+        self.umbral = umbral
+        self.corte_difuso = corte_difuso
+        self._variantes = []  # [(campo_cliente, tokens)]
+        self._conocidas = set()
+        self._aprendidas = {}  # etiqueta normalizada -> campo_cliente confirmado
+        self._indice = {}  # token -> {posiciones en _variantes}
+        self._difusos = {}
+        self._emparejamientos = {}
+
+        for campo_cliente, variantes in (mapeo or MAPEO_CAMPOS).items():
+            for variante in variantes:
+                self.agregar(campo_cliente, variante)
+
+    def agregar(self, campo_cliente: str, variante: str):
+        """Añade una variante del nombre de un campo del cliente al índice"""
+        tokens = tuple(tokenizar(variante))
+        if not tokens or (campo_cliente, tokens) in self._conocidas:
+            return
+
+        posicion = len(self._variantes)
+        self._conocidas.add((campo_cliente, tokens))
+        self._variantes.append((campo_cliente, tokens))
+        for token in set(tokens) | {''.join(tokens)}:
+            self._indice.setdefault(token, set()).add(posicion)
+
+        # El vocabulario ha cambiado: invalidar cachés
+        self._difusos.clear()
+        self._emparejamientos.clear()
+
+    def aprender(self, etiqueta: str, campo_cliente: str):
+        """
+        Registra una etiqueta confirmada (por la IA o por el usuario) para un dato del cliente
+
+        La etiqueta exacta se empareja siempre con ese dato, y sus palabras se añaden
+        al índice para reconocer variantes parecidas.
+        """
+        clave = clave_etiqueta(etiqueta)
+        if not clave:
+            return
+        if self._aprendidas.get(clave) != campo_cliente:
+            self._aprendidas[clave] = campo_cliente
+            self._emparejamientos.clear()
+        self.agregar(campo_cliente, etiqueta)
+
+    def _token_conocido(self, token: str) -> Tuple[Optional[str], float]:
+        """Devuelve el token del vocabulario equivalente (exacto o aproximado) y su peso"""
+        if token in self._indice:
+            return token, 1.0
+        if len(token) < 5:
+            # En palabras cortas una letra de diferencia cambia el significado ('rea' / 'area')
+            return None, 0.0
+        if token not in self._difusos:
+            parecidos = difflib.get_close_matches(token, self._indice.keys(), n=1, cutoff=self.corte_difuso)
+            self._difusos[token] = parecidos[0] if parecidos else None
+        return self._difusos[token], 0.9
+
+    def emparejar(self, nombre_campo: str) -> Optional[Tuple[str, float]]:
+        """
+        Busca el dato del cliente que corresponde a un nombre de campo
+
+        Args:
+            nombre_campo: Nombre o etiqueta del campo en el formulario
+
+        Returns:
+            Tupla (campo_cliente, puntuacion) o None si nada supera el umbral
+        """
+        tokens = tokenizar(nombre_campo)
+        if not tokens:
+            return None
+
+        # Etiquetas confirmadas anteriormente
+        aprendida = self._aprendidas.get(' '.join(tokens))
+        if aprendida is not None:
+            return aprendida, 1.0
+
+        # Traducir cada palabra del nombre a una del vocabulario
+        equivalentes = {}
+        for token in tokens:
+            conocido, peso = self._token_conocido(token)
+            if conocido is not None:
+                equivalentes[conocido] = max(peso, equivalentes.get(conocido, 0))
+
+        candidatos = set()
+        for token in equivalentes:
+            candidatos |= self._indice[token]
+
+        mejor = None
+        for posicion in candidatos:
+            campo_cliente, variante = self._variantes[posicion]
+            unida = ''.join(variante)
+
+            if unida in equivalentes and len(variante) > 1:
+                cubiertos, peso = 1, equivalentes[unida]
+            elif all(token in equivalentes for token in variante):
+                cubiertos = len(set(variante))
+                peso = min(equivalentes[token] for token in variante)
+            else:
+                continue
+
+            puntuacion = peso * min(cubiertos / len(tokens), 1.0)
+            if mejor is None or puntuacion > mejor[1]:
+                mejor = (campo_cliente, puntuacion)
+
+        if mejor is None or mejor[1] < self.umbral:
+            return None
+        return mejor
+
+    def emparejar_todos(self, nombres_campos) -> Dict[str, str]:
+        """
+        Empareja todos los campos de un formulario (resultado en caché por conjunto de nombres)
+
+        Returns:
+            Diccionario {nombre_campo_pdf: campo_cliente}
+        """
+        clave = frozenset(nombres_campos)
+        if clave not in self._emparejamientos:
+            resultado = {}
+            for nombre in clave:
+                emparejado = self.emparejar(nombre)
+                if emparejado:
+                    resultado[nombre] = emparejado[0]
+            self._emparejamientos[clave] = resultado
+        return self._emparejamientos[clave]
+
+
+class MapaFormulario:
+    """
+    Mapa campo → widgets → páginas de un formulario PDF, calculado una vez por plantilla
+    """
+
+    def __init__(self, reader: PdfReader):
+        """
+        Args:
+            reader: PDF con formulario interactivo
+        """
+        # {nombre_campo: {'tipo': 'texto'|'checkbox'|'radio', 'paginas': [..], 'estados': [..]}}
+        self.campos = {}
+
+        for num_pagina, page in enumerate(reader.pages):
+            for anotacion in page.get('/Annots') or []:
+                widget = anotacion.get_object()
+                if widget.get('/Subtype') != '/Widget':
+                    continue
+
+                nombre, tipo_pdf, flags = self._datos_campo(widget)
+                if not nombre or tipo_pdf not in ('/Tx', '/Ch', '/Btn') or flags & _FF_PULSADOR:
+                    continue
+
+                if tipo_pdf == '/Btn':
+                    tipo = 'radio' if flags & _FF_RADIO else 'checkbox'
+                else:
+                    tipo = 'texto'
+
+                campo = self.campos.setdefault(nombre, {'tipo': tipo, 'paginas': [], 'estados': []})
+                if num_pagina not in campo['paginas']:
+                    campo['paginas'].append(num_pagina)
+
+                if tipo != 'texto':
+                    apariencia = widget.get('/AP', {}).get('/N', {})
+                    for estado in apariencia.keys():
+                        if estado != '/Off' and estado not in campo['estados']:
+                            campo['estados'].append(estado)
+
+    @staticmethod
+    def _datos_campo(widget) -> Tuple[str, Optional[str], int]:
+        """Nombre completo, tipo (/FT) y flags (/Ff) de un widget, heredados de sus padres"""
+        partes = []
+        tipo = None
+        flags = None
+        nodo = widget
+        while nodo is not None:
+            if '/T' in nodo:
+                partes.append(str(nodo['/T']))
+            if tipo is None and '/FT' in nodo:
+                tipo = nodo['/FT']
+            if flags is None and '/Ff' in nodo:
+                flags = int(nodo['/Ff'])
+            nodo = nodo.get('/Parent')
+            nodo = nodo.get_object() if nodo is not None else None
+        return '.'.join(reversed(partes)), tipo, flags or 0
+
+    def valores_por_pagina(self, emparejamientos: Dict[str, str], datos_cliente: Dict) -> Dict[int, Dict[str, str]]:
+        """
+        Convierte los datos del cliente en valores de campos agrupados por página
+
+        Args:
+            emparejamientos: {nombre_campo_pdf: campo_cliente}
+            datos_cliente: Datos del cliente
+
+        Returns:
+            Diccionario {indice_pagina: {nombre_campo_pdf: valor}}
+        """
+        por_pagina = {}
+        for nombre_campo, campo_cliente in emparejamientos.items():
+            campo = self.campos.get(nombre_campo)
+            valor = datos_cliente.get(campo_cliente)
+            if campo is None or valor is None:
+                continue
+
+            valor_pdf = self._valor_para_campo(campo, valor)
+            if valor_pdf is None:
+                continue
+
+            for num_pagina in campo['paginas']:
+                por_pagina.setdefault(num_pagina, {})[nombre_campo] = valor_pdf
+
+        return por_pagina
+
+    @staticmethod
+    def _valor_para_campo(campo: Dict, valor) -> Optional[str]:
+        """Convierte un dato del cliente al valor que espera el tipo de campo"""
+        if campo['tipo'] == 'texto':
+            if isinstance(valor, bool):
+                return 'Sí' if valor else 'No'
+            return str(valor)
+
+        if campo['tipo'] == 'checkbox':
+            if valor and campo['estados']:
+                return campo['estados'][0]
+            return '/Off'
+
+        # Botones de opción: elegir el estado que significa sí/no
+        buscados = ESTADOS_SI if valor else ESTADOS_NO
+        for estado in campo['estados']:
+            if normalizar(estado.lstrip('/')) in buscados:
+                return estado
+        return None
+
+
+# Mapas de formulario ya calculados, por huella del PDF (compartidos entre hilos)
+_MAPAS = OrderedDict()
+_MAX_MAPAS = 32
+_MAPAS_LOCK = threading.Lock()
+
+
+def huella_reader(reader: PdfReader) -> str:
+    """Huella SHA-256 del contenido del PDF leído"""
+    stream = reader.stream
+    posicion = stream.tell()
+    stream.seek(0)
+    huella = hashlib.sha256(stream.read()).hexdigest()
+    stream.seek(posicion)
+    return huella
+
+
+def obtener_mapa_formulario(reader: PdfReader, huella: str = None) -> MapaFormulario:
+    """Devuelve el mapa del formulario, calculándolo solo la primera vez por plantilla"""
+    huella = huella or huella_reader(reader)
+    with _MAPAS_LOCK:
+        if huella in _MAPAS:
+            _MAPAS.move_to_end(huella)
+            return _MAPAS[huella]
+
+    # El mapa se calcula fuera del lock; si otro hilo lo ha guardado antes, se usa el suyo
+    mapa = MapaFormulario(reader)
+    with _MAPAS_LOCK:
+        mapa = _MAPAS.setdefault(huella, mapa)
+        _MAPAS.move_to_end(huella)
+        if len(_MAPAS) > _MAX_MAPAS:
+            _MAPAS.popitem(last=False)
+    return mapa
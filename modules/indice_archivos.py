@@ -0,0 +1,150 @@
+"""
+Módulo para mantener el índice local de los archivos del almacenamiento
+"""
+import json
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from .almacenamiento import PREFIJO_TEMPORAL
+from .lote import limpiar_nombre_archivo
+
+# Tamaño de los bloques de archivos que se guardan juntos en el índice
+_TAMANO_LOTE = 500
+
+
+def _fecha_recurso(texto: Optional[str]) -> Optional[datetime]:
+    """Convierte la fecha de creación de la API ('2024-01-31T10:00:00Z') a datetime"""
+    if not texto:
+        return None
+    return datetime.strptime(texto[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def _entrada_indice(recurso: Dict, sincronizado: datetime) -> Dict:
+    """Datos del índice local para un archivo devuelto por iterar_archivos"""
+    public_id = recurso['public_id']
+    carpeta = recurso.get('folder') or recurso.get('asset_folder')
+    if carpeta is None and '/' in public_id:
+        carpeta = public_id.rsplit('/', 1)[0]
+
+    return {
+        'public_id': public_id,
+        'resource_type': recurso.get('resource_type'),
+        'carpeta': carpeta,
+        'nombre_archivo': recurso.get('original_filename') or recurso.get('display_name'),
+        'formato': recurso.get('format') or (Path(public_id).suffix.lstrip('.') or None),
+        'bytes': recurso.get('bytes'),
+        'url': recurso.get('secure_url') or recurso.get('url'),
+        'fecha_subida': _fecha_recurso(recurso.get('created_at')),
+        'fecha_sincronizacion': sincronizado
+    }
+
+
+def sincronizar_indice(almacenamiento, db_manager, folder: str = "soporte_admin",
+                       completo: bool = False) -> Dict:
+    """
+    Actualiza el índice local con los archivos del almacenamiento
+
+    En modo incremental solo se recorren los archivos posteriores a la última
+    sincronización (el recorrido se corta al llegar a los ya indexados). El modo
+    completo recorre todo y además quita del índice los archivos que ya no existen.
+
+    Args:
+        almacenamiento: Almacenamiento (Cloudinary o local)
+        db_manager: Gestor de base de datos con el índice
+        folder: Carpeta a sincronizar
+        completo: Recorrer todo el almacenamiento en lugar de solo lo nuevo
+
+    Returns:
+        Diccionario con 'recorridos', 'nuevos' y 'eliminados'
+    """
+    desde = None if completo else db_manager.ultima_fecha_sincronizada(folder)
+    sincronizado = datetime.utcnow()
+
+    recorridos = nuevos = 0
+    vistos = set()
+    lote = []
+    for recurso in almacenamiento.iterar_archivos(folder, desde=desde):
+        entrada = _entrada_indice(recurso, sincronizado)
+        recorridos += 1
+        vistos.add(entrada['public_id'])
+        lote.append(entrada)
+        if len(lote) >= _TAMANO_LOTE:
+            nuevos += db_manager.guardar_archivos(lote)
+            lote = []
+
+    nuevos += db_manager.guardar_archivos(lote)
+    eliminados = db_manager.eliminar_archivos_no_vistos(vistos, folder) if completo else 0
+
+    return {'recorridos': recorridos, 'nuevos': nuevos, 'eliminados': eliminados}
+
+
+def _nombre_libre(nombre: str, usados: set) -> str:
+    """Nombre de entrada que no coincide con ninguno ya usado (añade _1, _2... si hace falta)"""
+    candidato = nombre
+    contador = 0
+    while candidato in usados:
+        contador += 1
+        candidato = f"{Path(nombre).stem}_{contador}{Path(nombre).suffix}"
+    usados.add(candidato)
+    return candidato
+
+
+def exportar_documentos_cliente(almacenamiento, db_manager, cliente_id: int, zip_destino,
+                                workers: int = 8) -> Dict:
+    """
+    Descarga en paralelo todos los documentos de un cliente y los empaqueta en un ZIP
+
+    La lista de documentos sale del índice local; las descargas se hacen en un pool
+    de hilos a un directorio temporal (no a memoria) y cada archivo se copia por
+    bloques a su entrada del ZIP, en orden, y se borra. Al final se añade un
+    manifest.json con el resultado.
+
+    Args:
+        almacenamiento: Almacenamiento (Cloudinary o local)
+        db_manager: Gestor de base de datos con el índice
+        cliente_id: ID del cliente
+        zip_destino: Ruta o archivo binario del ZIP
+        workers: Descargas simultáneas
+
+    Returns:
+        Manifiesto con 'total', 'correctos', 'fallidos', 'segundos' y 'archivos'
+    """
+    inicio = time.perf_counter()
+    archivos = db_manager.buscar_archivos(cliente_id=cliente_id, limite=None)
+
+    entradas = []
+    usados = {'manifest.json'}
+    with tempfile.TemporaryDirectory(prefix=PREFIJO_TEMPORAL) as directorio, \
+            zipfile.ZipFile(zip_destino, 'w', zipfile.ZIP_DEFLATED) as zf:
+        resultados = almacenamiento.descargar_archivos([a.public_id for a in archivos], directorio, workers=workers)
+
+        for archivo, resultado in zip(archivos, resultados):
+            nombre = limpiar_nombre_archivo(archivo.nombre_archivo or Path(archivo.public_id).name)
+            if archivo.formato and not nombre.lower().endswith(f".{archivo.formato.lower()}"):
+                nombre = f"{nombre}.{archivo.formato}"
+            nombre = _nombre_libre(nombre, usados)
+
+            entrada = {'public_id': archivo.public_id, 'archivo': nombre, 'exito': resultado['exito']}
+            if resultado['exito']:
+                zf.write(resultado['resultado'], nombre)
+                Path(resultado['resultado']).unlink()
+            else:
+                entrada['error'] = resultado['error']
+            entradas.append(entrada)
+
+        correctos = sum(1 for e in entradas if e['exito'])
+        manifiesto = {
+            'cliente_id': cliente_id,
+            'total': len(entradas),
+            'correctos': correctos,
+            'fallidos': len(entradas) - correctos,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'archivos': entradas
+        }
+        zf.writestr('manifest.json', json.dumps(manifiesto, indent=2, ensure_ascii=False))
+
+    return manifiesto
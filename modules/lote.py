@@ -0,0 +1,163 @@
+"""
+Módulo para generar lotes de documentos rellenados en paralelo
+"""
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+
+def limpiar_nombre_archivo(texto: str) -> str:
+    """Convierte un texto en un nombre de archivo seguro"""
+    texto = str(texto or 'cliente').strip()
+    return "".join(c if c.isalnum() or c in '-_.' else '_' for c in texto) or 'cliente'
+
+
+def cargar_clientes(cliente_ids: List[int], db_manager=None) -> List[Dict]:
+    """
+    Carga los datos de varios clientes en una sola consulta
+
+    Args:
+        cliente_ids: IDs de los clientes
+        db_manager: Gestor de base de datos (si no se proporciona, se usa la configuración por defecto)
+
+    Returns:
+        Lista con los datos de cada cliente, en el orden de cliente_ids (None para los
+        IDs que no existen)
+    """
+    if db_manager is None:
+        from database import DatabaseManager
+        db_manager = DatabaseManager()
+
+    clientes = db_manager.obtener_clientes_por_ids(cliente_ids)
+    por_id = {c.id: c.to_dict() for c in clientes}
+    return [por_id.get(cliente_id) for cliente_id in cliente_ids]
+
+
+def crear_tareas_lote(cliente_ids: List[int], clientes: List[Optional[Dict]], nombre_base: str,
+                      extension: str) -> List[Dict]:
+    """
+    Tareas de un lote, una por cliente pedido
+
+    Los clientes que no existen se convierten en tareas ya fallidas (con 'error'),
+    que no se rellenan y quedan así en el manifiesto.
+
+    Args:
+        cliente_ids: IDs de los clientes pedidos
+        clientes: Datos de cada cliente según cargar_clientes (None si no existe)
+        nombre_base: Nombre de la plantilla sin extensión
+        extension: Extensión de los documentos generados ('pdf' o 'docx')
+
+    Returns:
+        Lista de tareas para generar_lote_zip
+    """
+    tareas = []
+    for cliente_id, datos in zip(cliente_ids, clientes):
+        if datos is None:
+            tareas.append({'cliente_id': cliente_id, 'datos_cliente': None, 'nombre_archivo': None,
+                           'error': 'El cliente no existe'})
+            continue
+        tareas.append({
+            'cliente_id': cliente_id,
+            'datos_cliente': datos,
+            'nombre_archivo': f"{limpiar_nombre_archivo(datos.get('razon_social'))}_{cliente_id}_{nombre_base}.{extension}"
+        })
+    return tareas
+
+
+def generar_lote_zip(tareas: List[Dict], trabajador: Callable, zip_destino,
+                     workers: Optional[int] = None, inicializador: Callable = None,
+                     initargs: tuple = (), info_plantilla: Dict = None) -> Dict:
+    """
+    Ejecuta las tareas en un pool de procesos y escribe cada resultado en un ZIP según termina
+
+    Cada tarea es un diccionario con al menos 'cliente_id', 'nombre_archivo' y 'datos_cliente'.
+    El trabajador recibe la tarea y devuelve {'exito', 'metodo', 'contenido', 'error'}. Las
+    tareas que ya traen 'error' no se envían al pool: constan como fallidas en el manifiesto.
+
+    Args:
+        tareas: Lista de tareas a procesar
+        trabajador: Función de nivel de módulo que rellena un documento
+        zip_destino: Ruta o archivo abierto en modo binario donde escribir el ZIP
+        workers: Número de procesos (por defecto, número de CPUs)
+        inicializador: Función que prepara cada proceso (plantilla ya analizada)
+        initargs: Argumentos del inicializador
+        info_plantilla: Información de la plantilla que se guarda en el manifiesto
+
+    Returns:
+        Manifiesto del lote (también incluido en el ZIP como manifest.json)
+    """
+    workers = workers or os.cpu_count() or 1
+    inicio = time.perf_counter()
+    documentos = []
+
+    with zipfile.ZipFile(zip_destino, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for orden, tarea in enumerate(tareas):
+            if tarea.get('error'):
+                documentos.append({
+                    'orden': orden, 'cliente_id': tarea['cliente_id'], 'archivo': None,
+                    'exito': False, 'metodo': None, 'error': tarea['error']
+                })
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=inicializador, initargs=initargs) as executor:
+            futuros = {
+                executor.submit(trabajador, tarea): orden
+                for orden, tarea in enumerate(tareas) if not tarea.get('error')
+            }
+
+            for futuro in as_completed(futuros):
+                orden = futuros[futuro]
+                tarea = tareas[orden]
+                entrada = {
+                    'orden': orden,
+                    'cliente_id': tarea['cliente_id'],
+                    'archivo': None,
+                    'exito': False,
+                    'metodo': None,
+                    'error': None
+                }
+
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    resultado = {'exito': False, 'error': str(e)}
+
+                entrada['metodo'] = resultado.get('metodo')
+                entrada['segundos'] = resultado.get('segundos')
+                if resultado.get('bytes_ahorrados') is not None:
+                    entrada['bytes_ahorrados'] = resultado['bytes_ahorrados']
+
+                if resultado.get('exito'):
+                    zf.writestr(tarea['nombre_archivo'], resultado['contenido'])
+                    entrada['archivo'] = tarea['nombre_archivo']
+                    entrada['exito'] = True
+                else:
+                    entrada['error'] = resultado.get('error') or 'Error desconocido'
+
+                documentos.append(entrada)
+
+        documentos.sort(key=lambda d: d.pop('orden'))
+
+        metodos = {}
+        for doc in documentos:
+            if doc['exito']:
+                metodos[doc['metodo']] = metodos.get(doc['metodo'], 0) + 1
+
+        manifiesto = {
+            'fecha': datetime.now().isoformat(),
+            'plantilla': info_plantilla or {},
+            'workers': workers,
+            'total': len(tareas),
+            'correctos': sum(1 for d in documentos if d['exito']),
+            'fallidos': sum(1 for d in documentos if not d['exito']),
+            'metodos': metodos,
+            'segundos': round(time.perf_counter() - inicio, 3),
+            'documentos': documentos
+        }
+
+        zf.writestr('manifest.json', json.dumps(manifiesto, indent=2, ensure_ascii=False))
+
+    return manifiesto
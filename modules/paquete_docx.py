@@ -0,0 +1,210 @@
+"""
+Módulo para generar copias de un .docx reescribiendo solo las partes XML modificadas
+"""
+import shutil
+import struct
+import zipfile
+import zlib
+from typing import Dict, Iterator, Tuple
+from lxml import etree
+
+from .documento import Origen, abrir_binario, leer_bytes
+
+_FIRMA_LOCAL = b'PK\x03\x04'
+_FIRMA_CENTRAL = b'PK\x01\x02'
+_FIRMA_FIN = b'PK\x05\x06'
+_CABECERA_LOCAL = struct.Struct('<4s5H3L2H')
+_CABECERA_CENTRAL = struct.Struct('<4s6H3L5H2L')
+_FIN_DIRECTORIO = struct.Struct('<4s4H2LH')
+
+# Bit de las cabeceras ZIP que se conserva: nombre codificado en UTF-8
+_FLAG_UTF8 = 0x0800
+_VERSION = 20
+
+# Límites del formato ZIP sin extensiones ZIP64 (tamaños y posiciones de 32 bits,
+# número de entradas de 16 bits)
+_MAX_ZIP = 0xFFFFFFFF
+_MAX_ENTRADAS = 0xFFFF
+
+
+def serializar_xml(elemento) -> bytes:
+    """Serializa una parte XML igual que python-docx al guardar"""
+    return etree.tostring(elemento, encoding='UTF-8', standalone=True)
+
+
+def _fecha_dos(fecha_hora: Tuple[int, ...]) -> Tuple[int, int]:
+    """Convierte (año, mes, día, hora, minuto, segundo) al formato de fecha y hora de ZIP"""
+    anio, mes, dia, hora, minuto, segundo = fecha_hora
+    return (hora << 11) | (minuto << 5) | (segundo // 2), ((anio - 1980) << 9) | (mes << 5) | dia
+
+
+class PaqueteDocx:
+    """
+    Paquete .docx leído una sola vez, con los bytes comprimidos de cada entrada
+
+    Al escribir una copia, las entradas sin cambios (imágenes, estilos, fuentes...)
+    se copian tal cual, ya comprimidas, y solo se comprimen de nuevo las partes
+    XML que se han modificado.
+    """
+
+    def __init__(self, origen: Origen):
+        """
+        Args:
+            origen: Ruta, bytes o archivo binario del .docx
+        """
+        self.datos = leer_bytes(origen)
+        vista = memoryview(self.datos)
+
+        # [(info, bytes_comprimidos)] en el orden original del paquete
+        self.entradas = []
+        with zipfile.ZipFile(abrir_binario(self.datos)) as paquete:
+            for info in paquete.infolist():
+                inicio = info.header_offset
+                cabecera = _CABECERA_LOCAL.unpack_from(self.datos, inicio)
+                if cabecera[0] != _FIRMA_LOCAL:
+                    raise ValueError(f"Entrada ZIP dañada: {info.filename}")
+                datos_inicio = inicio + _CABECERA_LOCAL.size + cabecera[9] + cabecera[10]
+                self.entradas.append((info, vista[datos_inicio:datos_inicio + info.compress_size]))
+
+        self._nombres = {info.filename: posicion for posicion, (info, _) in enumerate(self.entradas)}
+
+    @property
+    def nombres(self):
+        """Nombres de las entradas del paquete"""
+        return list(self._nombres)
+
+    def leer(self, nombre: str) -> bytes:
+        """
+        Devuelve el contenido descomprimido de una entrada
+
+        Args:
+            nombre: Nombre de la entrada (p. ej. 'word/document.xml')
+
+        Returns:
+            Contenido de la entrada
+        """
+        info, comprimido = self.entradas[self._nombres[nombre]]
+        if info.compress_type == zipfile.ZIP_STORED:
+            return bytes(comprimido)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(comprimido, -zlib.MAX_WBITS)
+        with zipfile.ZipFile(abrir_binario(self.datos)) as paquete:
+            return paquete.read(nombre)
+
+    def escribir(self, output_path, modificadas: Dict[str, bytes] = None) -> Dict:
+        """
+        Escribe una copia del paquete sustituyendo solo las entradas indicadas
+
+        La copia directa escribe un ZIP clásico. Si el resultado puede superar sus
+        límites (4 GB o 65535 entradas), se escribe con zipfile, que añade las
+        extensiones ZIP64 aunque vuelve a comprimir todas las entradas.
+
+        Args:
+            output_path: Ruta o archivo binario de salida
+            modificadas: {nombre_entrada: contenido nuevo sin comprimir}
+
+        Returns:
+            Diccionario con 'copiadas', 'reescritas' y 'bytes'
+        """
+        modificadas = modificadas or {}
+        desconocidas = set(modificadas) - set(self._nombres)
+        if desconocidas:
+            raise KeyError(f"Entradas que no existen en la plantilla: {sorted(desconocidas)}")
+
+        escribir = self._escribir_zip64 if self._necesita_zip64(modificadas) else self._escribir
+        if hasattr(output_path, 'write'):
+            return escribir(output_path, modificadas)
+        with open(output_path, 'wb') as salida:
+            return escribir(salida, modificadas)
+
+    def _necesita_zip64(self, modificadas: Dict[str, bytes]) -> bool:
+        """Indica si la copia puede superar los límites del ZIP clásico (estimación por exceso)"""
+        if len(self.entradas) > _MAX_ENTRADAS:
+            return True
+        total = 0
+        for info, comprimido in self.entradas:
+            if info.filename in modificadas:
+                # Deflate nunca crece más de unos pocos bytes por bloque de 16 KB
+                tamano = len(modificadas[info.filename])
+                comprimido_max = tamano + tamano // 1000 + 64
+            else:
+                tamano, comprimido_max = info.file_size, len(comprimido)
+            if tamano > _MAX_ZIP or comprimido_max > _MAX_ZIP:
+                return True
+            total += _CABECERA_LOCAL.size + _CABECERA_CENTRAL.size + 2 * len(info.filename.encode('utf-8')) + comprimido_max
+        return total + _FIN_DIRECTORIO.size > _MAX_ZIP
+
+    def _escribir_zip64(self, salida, modificadas: Dict[str, bytes]) -> Dict:
+        """Escribe la copia con zipfile (con ZIP64) para los paquetes que no caben en un ZIP clásico"""
+        inicio = salida.tell() if hasattr(salida, 'tell') else 0
+        with zipfile.ZipFile(abrir_binario(self.datos)) as origen, \
+                zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as destino:
+            for info, _ in self.entradas:
+                # ZipInfo nuevo: zipfile modifica el que recibe y el original se reutiliza
+                nueva = zipfile.ZipInfo(info.filename, info.date_time)
+                nueva.compress_type = zipfile.ZIP_DEFLATED
+                nueva.external_attr = info.external_attr
+                contenido = modificadas.get(info.filename)
+                with destino.open(nueva, 'w', force_zip64=True) as entrada:
+                    if contenido is not None:
+                        entrada.write(contenido)
+                    else:
+                        with origen.open(info) as original:
+                            shutil.copyfileobj(original, entrada, 1024 * 1024)
+
+        return {
+            'copiadas': len(self.entradas) - len(modificadas),
+            'reescritas': len(modificadas),
+            'bytes': salida.tell() - inicio if hasattr(salida, 'tell') else None
+        }
+
+    def _escribir(self, salida, modificadas: Dict[str, bytes]) -> Dict:
+        """Escribe las cabeceras locales, los datos y el directorio central"""
+        posicion = 0
+        central = []
+        copiadas = 0
+
+        for info, metodo, crc, comprimido, tamano in self._entradas_salida(modificadas):
+            nombre = info.filename.encode('utf-8' if info.flag_bits & _FLAG_UTF8 else 'cp437')
+            flags = info.flag_bits & _FLAG_UTF8
+            hora, fecha = _fecha_dos(info.date_time)
+
+            cabecera = _CABECERA_LOCAL.pack(
+                _FIRMA_LOCAL, _VERSION, flags, metodo, hora, fecha,
+                crc, len(comprimido), tamano, len(nombre), 0
+            )
+            central.append(_CABECERA_CENTRAL.pack(
+                _FIRMA_CENTRAL, info.create_system << 8 | _VERSION,
+                _VERSION, flags, metodo, hora, fecha, crc, len(comprimido), tamano,
+                len(nombre), 0, 0, 0, info.internal_attr, info.external_attr, posicion
+            ) + nombre)
+
+            salida.write(cabecera)
+            salida.write(nombre)
+            salida.write(comprimido)
+            posicion += len(cabecera) + len(nombre) + len(comprimido)
+            copiadas += info.filename not in modificadas
+
+        directorio = b''.join(central)
+        salida.write(directorio)
+        salida.write(_FIN_DIRECTORIO.pack(
+            _FIRMA_FIN, 0, 0, len(central), len(central), len(directorio), posicion, 0
+        ))
+
+        return {
+            'copiadas': copiadas,
+            'reescritas': len(modificadas),
+            'bytes': posicion + len(directorio) + _FIN_DIRECTORIO.size
+        }
+
+    def _entradas_salida(self, modificadas: Dict[str, bytes]) -> Iterator:
+        """Entradas a escribir: (info, metodo, crc, bytes_comprimidos, tamano_original)"""
+        for info, comprimido in self.entradas:
+            if info.filename not in modificadas:
+                yield info, info.compress_type, info.CRC, comprimido, info.file_size
+                continue
+
+            contenido = modificadas[info.filename]
+            compresor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+            nuevo = compresor.compress(contenido) + compresor.flush()
+            yield info, zipfile.ZIP_DEFLATED, zlib.crc32(contenido), nuevo, len(contenido)
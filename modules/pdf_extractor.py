@@ -5,8 +5,35 @@ import anthropic
 import base64
 import os
 import json
+import re
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from .documento import DocumentoPDF, Origen
+
+# Palabras y formatos que indican dónde aparece cada dato en el texto de un documento
+PISTAS_CAMPOS = {
+    'nombre_representante_legal': r'representante|apoderad[oa]|D\./Dña|\bdo(n|ña)\b',
+    'dni_representante': r'\bD\.?N\.?I\b|\bN\.?I\.?[FE]\b|\b\d{8}[ -]?[A-Z]\b|\b[XYZ]\d{7}[A-Z]\b',
+    'razon_social': r'raz[oó]n social|denominaci[oó]n|\bS\.?L\.?U?\b|\bS\.?A\.?U?\b',
+    'cif': r'\bC\.?I\.?F\b|\bN\.?I\.?F\b|\b[A-HJNP-SUVW][ .-]?\d{7}[0-9A-J]\b',
+    'direccion': r'domicilio|direcci[oó]n|\bcalle\b|\bc/|avda|avenida|plaza|\b\d{5}\b',
+    'correo_electronico': r'[\w.+-]+@[\w-]+\.[\w.]+|e-?mail|correo',
+    'numero_trabajadores': r'trabajador|emplead|plantilla',
+    'facturacion': r'factura|volumen (anual )?de negocio|cifra de negocio|€|euros',
+    'habilitaciones': r'habilitaci[oó]n|autorizaci[oó]n|registro industrial',
+    'isos': r'\bISO\b|\bUNE\b|certificaci[oó]n',
+    'rolece': r'ROLECE|\bREA\b|empresas acreditadas|licitadores',
+    'tiene_plan_igualdad': r'plan de igualdad|igualdad',
+    'tiene_protocolo_acoso': r'acoso',
+}
+
+# Formatos válidos que se pueden buscar localmente (sin IA) en el texto
+FORMATOS_CAMPOS = {
+    'cif': re.compile(r'\b([A-HJNP-SUVW])[ .-]?(\d{7}[0-9A-J])\b'),
+    'dni_representante': re.compile(r'\b(\d{8}|[XYZ]\d{7})[ -]?([A-Z])\b'),
+    'correo_electronico': re.compile(r'\b([\w.+-]+@[\w-]+(?:\.[\w-]+)+)()\b'),
+}
+
 
 class PDFExtractor:
     def __init__(self, api_key: str = None):
@@ -22,22 +49,22 @@ class PDFExtractor:
 
         self.client = anthropic.Anthropic(api_key=self.api_key)
 
-    def extraer_datos_cliente(self, pdf_path: str) -> Dict[str, any]:
+    def extraer_datos_cliente(self, pdf_path: Origen, nombre_archivo: str = None) -> Dict[str, any]:
         """
         Extrae datos del cliente desde un PDF usando Claude API
 
         Args:
-            pdf_path: Ruta al archivo PDF
+            pdf_path: Ruta al archivo PDF, bytes, archivo binario o DocumentoPDF
+            nombre_archivo: Nombre original del archivo (si no se pasa una ruta)
 
         Returns:
             Diccionario con los datos extraídos del cliente
         """
         # Extraer texto del PDF (Haiku no soporta análisis directo de PDFs)
-        from pypdf import PdfReader
-        reader = PdfReader(pdf_path)
+        documento = DocumentoPDF.desde(pdf_path, nombre_archivo)
         texto_pdf = ""
-        for page in reader.pages:
-            texto_pdf += page.extract_text() + "\n\n"
+        for texto_pagina in documento.textos_paginas:
+            texto_pdf += texto_pagina + "\n\n"
 
         # Definir el prompt para extraer datos
         prompt = f"""Analiza este documento y extrae la siguiente información sobre el cliente/empresa:
@@ -111,8 +138,8 @@ Ejemplo de formato de respuesta:
             datos_extraidos = json.loads(response_text.strip())
 
             # Guardar info del archivo original
-            datos_extraidos['pdf_original_nombre'] = Path(pdf_path).name
-            datos_extraidos['pdf_original_ruta'] = pdf_path
+            datos_extraidos['pdf_original_nombre'] = documento.nombre
+            datos_extraidos['pdf_original_ruta'] = documento.ruta
 
             return datos_extraidos
 
@@ -129,23 +156,208 @@ Ejemplo de formato de respuesta:
             Tupla (es_valido, lista_errores)
         """
         errores = []
+        for campo in ('cif', 'dni_representante', 'correo_electronico', 'numero_trabajadores'):
+            error = self._error_campo(campo, datos.get(campo))
+            if error:
+                errores.append(error)
+
+        return len(errores) == 0, errores
 
-        # Validaciones básicas
-        if datos.get('cif') and len(str(datos['cif'])) < 9:
-            errores.append("CIF parece incorrecto (muy corto)")
+    @staticmethod
+    def _error_campo(campo: str, valor) -> Optional[str]:
+        """Devuelve el error de validación de un campo, o None si es correcto"""
+        if not valor:
+            return None
 
-        if datos.get('dni_representante') and len(str(datos['dni_representante'])) not in [9, 10]:
-            errores.append("DNI parece incorrecto")
+        if campo == 'cif' and len(str(valor)) < 9:
+            return "CIF parece incorrecto (muy corto)"
 
-        if datos.get('correo_electronico') and '@' not in str(datos['correo_electronico']):
-            errores.append("Correo electrónico parece incorrecto")
+        if campo == 'dni_representante' and len(str(valor)) not in [9, 10]:
+            return "DNI parece incorrecto"
 
-        if datos.get('numero_trabajadores'):
+        if campo == 'correo_electronico' and '@' not in str(valor):
+            return "Correo electrónico parece incorrecto"
+
+        if campo == 'numero_trabajadores':
             try:
-                num = int(datos['numero_trabajadores'])
-                if num < 0:
-                    errores.append("Número de trabajadores no puede ser negativo")
+                if int(valor) < 0:
+                    return "Número de trabajadores no puede ser negativo"
             except (ValueError, TypeError):
-                errores.append("Número de trabajadores debe ser un número")
+                return "Número de trabajadores debe ser un número"
 
-        return len(errores) == 0, errores
+        return None
+
+    def campos_a_reparar(self, datos: Dict, incluir_nulos: bool = True) -> List[str]:
+        """
+        Campos extraídos que no pasan la validación o que han quedado vacíos
+
+        Args:
+            datos: Datos extraídos
+            incluir_nulos: Si True, también se reparan los campos a null
+
+        Returns:
+            Lista de nombres de campos
+        """
+        campos = []
+        for campo in PISTAS_CAMPOS:
+            valor = datos.get(campo)
+            if self._error_campo(campo, valor) or (incluir_nulos and valor is None):
+                campos.append(campo)
+        return campos
+
+    @staticmethod
+    def _fragmentos_relevantes(texto: str, campo: str, ventana: int = 150, maximo: int = 3) -> List[str]:
+        """
+        Trozos del texto alrededor de las pistas de un campo
+
+        Returns:
+            Hasta 'maximo' fragmentos, sin solapes, en orden de aparición
+        """
+        tramos = []
+        for coincidencia in re.finditer(PISTAS_CAMPOS[campo], texto, re.IGNORECASE):
+            inicio = max(coincidencia.start() - ventana, 0)
+            fin = min(coincidencia.end() + ventana, len(texto))
+            if tramos and inicio <= tramos[-1][1]:
+                tramos[-1] = (tramos[-1][0], fin)
+            elif len(tramos) < maximo:
+                tramos.append((inicio, fin))
+            else:
+                break
+
+        return [' '.join(texto[inicio:fin].split()) for inicio, fin in tramos]
+
+    @staticmethod
+    def _candidato_local(texto: str, campo: str) -> Optional[str]:
+        """Valor con formato válido si aparece uno solo en el texto (CIF, DNI o correo)"""
+        formato = FORMATOS_CAMPOS.get(campo)
+        if formato is None:
+            return None
+        candidatos = {''.join(coincidencia.groups()).upper() if campo != 'correo_electronico'
+                      else coincidencia.group(1) for coincidencia in formato.finditer(texto)}
+        return candidatos.pop() if len(candidatos) == 1 else None
+
+    def reparar_datos(self, pdf_path: Origen, datos: Dict, campos: List[str] = None) -> Dict:
+        """
+        Vuelve a extraer solo los campos incorrectos o vacíos de un PDF
+
+        Args:
+            pdf_path: Ruta al archivo PDF, bytes, archivo binario o DocumentoPDF
+            datos: Datos ya extraídos
+            campos: Campos a reparar (por defecto, los de campos_a_reparar)
+
+        Returns:
+            Datos combinados, con 'confianza_campos' y 'campos_reparados'
+        """
+        documento = DocumentoPDF.desde(pdf_path)
+        return self.reparar_datos_texto("\n\n".join(documento.textos_paginas), datos, campos)
+
+    def reparar_datos_texto(self, texto: str, datos: Dict, campos: List[str] = None) -> Dict:
+        """
+        Repara campos a partir del texto del documento
+
+        Primero se buscan localmente los campos con formato fijo (CIF, DNI, correo);
+        después se pregunta a la IA solo por los que quedan, enviándole únicamente
+        los fragmentos del texto donde aparecen sus pistas.
+
+        Args:
+            texto: Texto del documento
+            datos: Datos ya extraídos
+            campos: Campos a reparar (por defecto, los de campos_a_reparar)
+
+        Returns:
+            Datos combinados, con 'confianza_campos' ({campo: 0-1}) y 'campos_reparados'
+        """
+        reparados = dict(datos)
+        confianza = dict(datos.get('confianza_campos') or {})
+        campos = [c for c in (campos if campos is not None else self.campos_a_reparar(datos)) if c in PISTAS_CAMPOS]
+        corregidos = []
+
+        # 1. Formatos fijos con un único candidato en el texto
+        pendientes = []
+        for campo in campos:
+            candidato = self._candidato_local(texto, campo)
+            if candidato is not None and not self._error_campo(campo, candidato):
+                reparados[campo] = candidato
+                confianza[campo] = 0.8
+                corregidos.append(campo)
+            else:
+                pendientes.append(campo)
+
+        # 2. IA solo para los campos restantes, con sus fragmentos relevantes
+        contexto = {}
+        for campo in pendientes:
+            fragmentos = self._fragmentos_relevantes(texto, campo)
+            if fragmentos:
+                contexto[campo] = {'valor_actual': datos.get(campo), 'fragmentos': fragmentos}
+            else:
+                confianza[campo] = 0.0
+
+        if contexto:
+            for campo, resultado in self._consultar_campos_ia(contexto).items():
+                if campo not in contexto or not isinstance(resultado, dict):
+                    continue
+                valor = resultado.get('valor')
+                if valor is None or self._error_campo(campo, valor):
+                    confianza[campo] = 0.0
+                    continue
+                reparados[campo] = valor
+                try:
+                    confianza[campo] = max(0.0, min(float(resultado.get('confianza', 0.5)), 1.0))
+                except (TypeError, ValueError):
+                    confianza[campo] = 0.5
+                corregidos.append(campo)
+
+        reparados['confianza_campos'] = confianza
+        reparados['campos_reparados'] = corregidos
+        return reparados
+
+    def _consultar_campos_ia(self, contexto: Dict) -> Dict:
+        """
+        Pregunta a la IA por unos pocos campos a partir de fragmentos del documento
+
+        Args:
+            contexto: {campo: {'valor_actual': ..., 'fragmentos': [...]}}
+
+        Returns:
+            {campo: {'valor': ..., 'confianza': 0-1}}
+        """
+        contexto_json = json.dumps(contexto, indent=2, ensure_ascii=False)
+
+        prompt = f"""Estos campos de una empresa se extrajeron mal o no se encontraron. Para cada uno tienes su valor actual y los fragmentos del documento donde puede aparecer.
+
+CAMPOS A CORREGIR:
+{contexto_json}
+
+FORMATOS:
+- cif: letra + 7 dígitos + dígito o letra (ej: B12345678)
+- dni_representante: 8 dígitos + letra (ej: 12345678A) o NIE (X1234567A)
+- numero_trabajadores: número entero; facturacion: número decimal sin símbolos
+- tiene_plan_igualdad / tiene_protocolo_acoso: true o false
+
+Responde con JSON en este formato, solo con los campos pedidos:
+{{
+  "cif": {{"valor": "B12345678", "confianza": 0.9}}
+}}
+
+Usa "valor": null si el dato no aparece en los fragmentos. "confianza" va de 0 a 1.
+
+IMPORTANTE: Responde SOLO con JSON válido."""
+
+        try:
+            message = self.client.messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=100 + 60 * len(contexto),
+                messages=[{"role": "user", "content": prompt}]
+            )
+
+            response_text = message.content[0].text
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0]
+            elif "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0]
+
+            return json.loads(response_text.strip())
+
+        except Exception as e:
+            print(f"Error al reparar campos con IA: {e}")
+            return {}
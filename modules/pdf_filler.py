@@ -2,47 +2,159 @@
 Módulo para rellenar PDFs con datos de clientes usando IA
 """
 import anthropic
-import base64
 import os
 import json
+import threading
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List
 from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
 from io import BytesIO
+from .documento import DocumentoPDF, Origen
+from .lote import cargar_clientes, crear_tareas_lote, generar_lote_zip
+from .emparejador_campos import IndiceCampos, clave_etiqueta
+from .pdf_optimizador import optimizar_pdf
 
 class PDFFiller:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, optimizar_salida: bool = True, aplanar: bool = False,
+                 db_manager=None, sinonimos: Dict[str, str] = None):
         """
         Inicializa el rellenador de PDFs con Claude API
 
         Args:
             api_key: API key de Anthropic
+            optimizar_salida: Comprimir y deduplicar los PDFs generados
+            aplanar: Convertir los formularios rellenados en contenido estático
+            db_manager: Gestor de base de datos donde se guardan las etiquetas aprendidas
+            sinonimos: Etiquetas ya aprendidas {etiqueta: campo_cliente} (si no hay base de datos)
         """
         self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
         if not self.api_key:
             raise ValueError("Se requiere ANTHROPIC_API_KEY")
 
         self.client = anthropic.Anthropic(api_key=self.api_key)
+        self.indice_campos = IndiceCampos()
+        self.optimizar_salida = optimizar_salida
+        self.aplanar = aplanar
+        self.db_manager = db_manager
+
+        # Etiquetas confirmadas {etiqueta: campo_cliente}, consultadas antes que la IA
+        self.sinonimos = {}
+        self._corregidos = set()  # etiquetas normalizadas confirmadas por el usuario
+        self._huella_correcciones = None  # huella de las correcciones cargadas de la base de datos
+        self._formularios_consultados = set()
+        self.estadisticas = {'campos_locales': 0, 'campos_ia': 0, 'llamadas_ia': 0}
+
+        # El mismo rellenador se usa desde la página y desde los hilos de preparación y
+        # de trabajos: el índice de etiquetas y los conjuntos anteriores se modifican
+        # siempre con este cerrojo
+        self._lock = threading.RLock()
+
+        if db_manager is not None:
+            try:
+                for sinonimo in db_manager.obtener_sinonimos():
+                    self._aprender(sinonimo.etiqueta, sinonimo.campo_cliente)
+                    if sinonimo.origen == 'usuario':
+                        self._corregidos.add(sinonimo.etiqueta_normalizada)
+            except Exception as e:
+                print(f"No se pudieron cargar las etiquetas aprendidas: {e}")
+        for etiqueta, campo_cliente in (sinonimos or {}).items():
+            self._aprender(etiqueta, campo_cliente)
+
+    def _aprender(self, etiqueta: str, campo_cliente: str):
+        """Añade una etiqueta confirmada al índice en memoria"""
+        with self._lock:
+            self.sinonimos[etiqueta] = campo_cliente
+            self.indice_campos.aprender(etiqueta, campo_cliente)
+
+    def registrar_sinonimos(self, mapeos: Dict[str, str], origen: str = 'ia') -> int:
+        """
+        Guarda etiquetas de formulario confirmadas para los próximos rellenados
+
+        Args:
+            mapeos: Diccionario {etiqueta_o_nombre_campo: campo_cliente}
+            origen: 'ia' si lo propuso el análisis, 'usuario' si es una corrección
 
-    def analizar_formulario_pdf(self, pdf_path: str, datos_cliente: Dict) -> Dict:
+        Returns:
+            Número de etiquetas nuevas o modificadas en la base de datos
+        """
+        registros = []
+        with self._lock:
+            for etiqueta, campo_cliente in mapeos.items():
+                clave = clave_etiqueta(etiqueta or '')
+                if not clave or not campo_cliente:
+                    continue
+                # Las correcciones del usuario no se pisan con propuestas de la IA
+                if origen != 'usuario' and (
+                    clave in self._corregidos or self.indice_campos.emparejar(etiqueta) == (campo_cliente, 1.0)
+                ):
+                    continue
+                if origen == 'usuario':
+                    self._corregidos.add(clave)
+                self._aprender(etiqueta, campo_cliente)
+                registros.append({
+                    'etiqueta': etiqueta.strip()[:300],
+                    'etiqueta_normalizada': clave[:300],
+                    'campo_cliente': campo_cliente,
+                    'origen': origen
+                })
+
+        if not registros or self.db_manager is None:
+            return 0
+        try:
+            return self.db_manager.guardar_sinonimos(registros)
+        except Exception as e:
+            print(f"No se pudieron guardar las etiquetas aprendidas: {e}")
+            return 0
+
+    def confirmar_sinonimo(self, etiqueta: str, campo_cliente: str) -> int:
+        """Registra la corrección del usuario de una etiqueta (prevalece sobre la IA)"""
+        return self.registrar_sinonimos({etiqueta: campo_cliente}, origen='usuario')
+
+    def actualizar_sinonimos(self) -> bool:
+        """
+        Carga las correcciones del usuario guardadas desde otro rellenador o proceso
+
+        Solo se leen de la base de datos si su huella ha cambiado desde la última carga.
+
+        Returns:
+            True si se han cargado correcciones nuevas
+        """
+        if self.db_manager is None:
+            return False
+        try:
+            huella = self.db_manager.huella_correcciones()
+            if huella == self._huella_correcciones:
+                return False
+            correcciones = self.db_manager.obtener_correcciones()
+        except Exception as e:
+            print(f"No se pudieron cargar las correcciones de etiquetas: {e}")
+            return False
+
+        with self._lock:
+            for sinonimo in correcciones:
+                self._aprender(sinonimo.etiqueta, sinonimo.campo_cliente)
+                self._corregidos.add(sinonimo.etiqueta_normalizada)
+            self._huella_correcciones = huella
+        return True
+
+    def analizar_formulario_pdf(self, pdf_path: Origen, datos_cliente: Dict) -> Dict:
         """
         Analiza un formulario PDF y determina dónde colocar los datos del cliente
 
         Args:
-            pdf_path: Ruta al PDF formulario vacío
+            pdf_path: Ruta al PDF formulario vacío, bytes, archivo binario o DocumentoPDF
             datos_cliente: Diccionario con datos del cliente
 
         Returns:
             Información sobre cómo rellenar el formulario
         """
         # Extraer texto del PDF (Haiku no soporta análisis directo de PDFs)
-        reader = PdfReader(pdf_path)
+        documento = DocumentoPDF.desde(pdf_path)
         texto_pdf = ""
-        for page_num, page in enumerate(reader.pages):
+        for page_num, texto_pagina in enumerate(documento.textos_paginas):
             texto_pdf += f"\n\n--- PÁGINA {page_num + 1} ---\n"
-            texto_pdf += page.extract_text()
+            texto_pdf += texto_pagina
 
         # Crear descripción de los datos disponibles
         datos_disponibles = json.dumps(datos_cliente, indent=2, ensure_ascii=False)
@@ -112,199 +224,500 @@ IMPORTANTE:
             elif "```" in response_text:
                 response_text = response_text.split("```")[1].split("```")[0]
 
-            return json.loads(response_text.strip())
+            analisis = json.loads(response_text.strip())
 
         except Exception as e:
             raise Exception(f"Error al analizar formulario PDF: {e}")
 
-    def rellenar_pdf_interactivo(self, pdf_path: str, datos_cliente: Dict, output_path: str) -> bool:
+        # Recordar qué dato del cliente va en cada etiqueta para los próximos formularios
+        self.estadisticas['llamadas_ia'] += 1
+        self.estadisticas['campos_ia'] += len(analisis.get('campos', []))
+        self.registrar_sinonimos({
+            campo.get('etiqueta_en_pdf'): campo.get('campo_cliente')
+            for campo in analisis.get('campos', [])
+            if campo.get('campo_cliente') in datos_cliente
+        })
+        return analisis
+
+    def emparejar_campos_con_ia(self, nombres_campos: List[str], datos_cliente: Dict) -> Dict[str, str]:
         """
-        Intenta rellenar un PDF interactivo (con campos de formulario)
+        Pide a la IA qué dato del cliente corresponde a cada nombre de campo de un formulario
+
+        Solo se envían los nombres de los campos y de los datos (no el PDF ni los valores),
+        y el resultado se guarda como etiquetas aprendidas.
 
         Args:
-            pdf_path: Ruta al PDF original
-            datos_cliente: Datos del cliente
-            output_path: Ruta donde guardar el PDF rellenado
+            nombres_campos: Nombres de los campos del formulario sin emparejar
+            datos_cliente: Datos del cliente (solo se usan sus claves)
 
         Returns:
-            True si se pudo rellenar, False si no es un PDF interactivo
+            Diccionario {nombre_campo: campo_cliente}
         """
+        prompt = f"""Empareja los campos de un formulario PDF con los datos de un cliente.
+
+CAMPOS DEL FORMULARIO:
+{json.dumps(sorted(nombres_campos), ensure_ascii=False)}
+
+DATOS DEL CLIENTE DISPONIBLES:
+{json.dumps(sorted(datos_cliente), ensure_ascii=False)}
+
+Responde SOLO con JSON válido con este formato (omite los campos sin dato correspondiente):
+{{"campos": {{"nombre_campo_formulario": "dato_cliente"}}}}"""
+
         try:
-            reader = PdfReader(pdf_path)
-            writer = PdfWriter()
+            message = self.client.messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=1024,
+                messages=[{"role": "user", "content": prompt}]
+            )
 
-            # Obtener campos del formulario
-            form_fields = reader.get_form_text_fields()
+            response_text = message.content[0].text
 
-            # Verificar si tiene campos de formulario
-            if form_fields is None or len(form_fields) == 0:
-                return False
+            # Limpiar respuesta
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0]
+            elif "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0]
 
-            # Mapeo de nombres de campos comunes
-            mapeo_campos = {
-                'nombre_representante_legal': ['nombre', 'representante', 'nombre_representante', 'rep_legal'],
-                'dni_representante': ['dni', 'nif', 'dni_representante', 'nif_representante'],
-                'razon_social': ['razon_social', 'empresa', 'nombre_empresa', 'denominacion'],
-                'cif': ['cif', 'nif_empresa', 'cif_empresa'],
-                'direccion': ['direccion', 'domicilio', 'direccion_social'],
-                'correo_electronico': ['email', 'correo', 'correo_electronico', 'e-mail'],
-                'numero_trabajadores': ['trabajadores', 'num_trabajadores', 'plantilla'],
-                'facturacion': ['facturacion', 'volumen_negocio', 'ingresos'],
-                'habilitaciones': ['habilitaciones', 'autorizaciones'],
-                'isos': ['iso', 'isos', 'certificaciones'],
-                'rolece': ['rolece', 'rea'],
-                'tiene_plan_igualdad': ['plan_igualdad', 'igualdad'],
-                'tiene_protocolo_acoso': ['protocolo_acoso', 'acoso']
-            }
+            campos = json.loads(response_text.strip()).get('campos', {})
 
-            # Rellenar campos
-            for page in reader.pages:
-                writer.add_page(page)
+        except Exception as e:
+            print(f"Error al emparejar campos con IA: {e}")
+            return {}
+        finally:
+            self.estadisticas['llamadas_ia'] += 1
+
+        emparejados = {
+            nombre: dato for nombre, dato in campos.items()
+            if nombre in nombres_campos and dato in datos_cliente
+        }
+        self.estadisticas['campos_ia'] += len(emparejados)
+        self.registrar_sinonimos(emparejados)
+        return emparejados
+
+    def rellenar_pdf_interactivo(self, pdf_path: Origen, datos_cliente: Dict, output_path) -> bool:
+        """
+        Intenta rellenar un PDF interactivo (con campos de formulario)
 
-            campos_rellenados = 0
+        Args:
+            pdf_path: Ruta al PDF original, bytes, archivo binario o DocumentoPDF
+            datos_cliente: Datos del cliente
+            output_path: Ruta o archivo binario donde guardar el PDF rellenado
 
-            # Intentar rellenar cada campo del cliente
-            for campo_cliente, valor in datos_cliente.items():
-                if valor is None:
-                    continue
+        Returns:
+            True si se pudo rellenar, False si no es un PDF interactivo
+        """
+        return self._rellenar_interactivo(DocumentoPDF.desde(pdf_path), datos_cliente, output_path) is not None
 
-                # Buscar campo correspondiente en el PDF
-                for nombre_campo_pdf in form_fields.keys():
-                    nombre_lower = nombre_campo_pdf.lower()
-
-                    # Verificar si coincide con algún mapeo
-                    if campo_cliente in mapeo_campos:
-                        for variante in mapeo_campos[campo_cliente]:
-                            if variante in nombre_lower:
-                                # Convertir valor a string apropiado
-                                if isinstance(valor, bool):
-                                    valor_str = 'Sí' if valor else 'No'
-                                else:
-                                    valor_str = str(valor)
-
-                                writer.update_page_form_field_values(
-                                    writer.pages[0],
-                                    {nombre_campo_pdf: valor_str}
-                                )
-                                campos_rellenados += 1
-                                break
+    def _rellenar_interactivo(self, documento: DocumentoPDF, datos_cliente: Dict, output_path):
+        """
+        Rellena y guarda un PDF interactivo
+
+        Returns:
+            Información de la optimización de la salida, o None si no es un PDF interactivo
+        """
+        try:
+            writer, campos_rellenados = self._rellenar_campos_formulario(documento, datos_cliente)
 
             # Solo guardar si se rellenó al menos un campo
             if campos_rellenados == 0:
-                return False
-
-            # Guardar PDF rellenado
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+                return None
 
-            return True
+            # Se escribe primero en memoria: si falla a medias, la salida queda
+            # intacta para el overlay de respaldo
+            buffer = BytesIO()
+            optimizacion = self._guardar(writer, buffer)
 
         except Exception as e:
             print(f"Error al rellenar PDF interactivo: {e}")
-            return False
+            return None
+
+        if hasattr(output_path, 'write'):
+            output_path.write(buffer.getvalue())
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(buffer.getvalue())
+        return optimizacion
+
+    def _guardar(self, writer: PdfWriter, output_path) -> Dict:
+        """
+        Guarda un PDF generado, optimizándolo si está activado
 
-    def rellenar_pdf_con_ia(self, pdf_path: str, datos_cliente: Dict, output_path: str):
+        Returns:
+            Información de la optimización (bytes ahorrados), vacía si no se optimiza
         """
-        Rellena un PDF no interactivo usando IA para identificar campos y reportlab para escribir
+        if not self.optimizar_salida and not self.aplanar:
+            writer.write(output_path)
+            return {}
+        return optimizar_pdf(writer, output_path, aplanar=self.aplanar)
+
+    def _rellenar_campos_formulario(self, documento: DocumentoPDF, datos_cliente: Dict,
+                                    consultar_ia: bool = True):
+        """
+        Rellena los campos de formulario de un PDF ya leído (todas las páginas)
 
         Args:
-            pdf_path: Ruta al PDF formulario
+            documento: PDF original
             datos_cliente: Datos del cliente
-            output_path: Ruta de salida
+            consultar_ia: Si ningún campo coincide con las etiquetas conocidas, preguntar
+                          a la IA por los nombres (una vez por formulario) antes de rendirse
+
+        Returns:
+            Tupla (writer, numero_de_campos_rellenados)
         """
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter
-        import io
+        if not documento.tiene_formulario:
+            return PdfWriter(), 0
 
-        # Primero analizar el formulario con IA
-        analisis = self.analizar_formulario_pdf(pdf_path, datos_cliente)
+        # Mapa campo → widgets → páginas y emparejamiento, ambos en caché por plantilla
+        mapa = documento.mapa_formulario
 
-        # Leer el PDF original
-        reader = PdfReader(pdf_path)
-        writer = PdfWriter()
+        with self._lock:
+            emparejamientos = self.indice_campos.emparejar_todos(mapa.campos.keys())
+        valores_por_pagina = mapa.valores_por_pagina(emparejamientos, datos_cliente)
 
-        # Procesar cada página
-        for page_num, page in enumerate(reader.pages):
-            # Crear un canvas en memoria para el overlay
-            packet = io.BytesIO()
+        consultar = False
+        if not valores_por_pagina and consultar_ia:
+            with self._lock:
+                consultar = documento.huella not in self._formularios_consultados
+                self._formularios_consultados.add(documento.huella)
 
-            # Obtener dimensiones de la página
-            page_width = float(page.mediabox.width)
-            page_height = float(page.mediabox.height)
+        # Nombres desconocidos: una consulta barata de nombres en lugar del análisis completo
+        # (fuera del cerrojo, para no bloquear a los demás hilos mientras responde la IA)
+        if consultar and self.emparejar_campos_con_ia(list(mapa.campos), datos_cliente):
+            with self._lock:
+                emparejamientos = self.indice_campos.emparejar_todos(mapa.campos.keys())
+            valores_por_pagina = mapa.valores_por_pagina(emparejamientos, datos_cliente)
 
-            can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-            can.setFont("Helvetica", 10)
+        if not valores_por_pagina:
+            return PdfWriter(), 0
 
-            # Dibujar los campos según el análisis de IA
-            if 'campos' in analisis:
-                for campo in analisis['campos']:
-                    if campo.get('pagina', 1) == page_num + 1:
-                        valor = campo.get('valor', '')
+        # Clonar el documento para conservar el diccionario /AcroForm
+        writer = PdfWriter(clone_from=documento.reader)
 
-                        # Posición aproximada basada en la zona
-                        zona = campo.get('zona', 'media izquierda').lower()
+        campos_rellenados = set()
+        for num_pagina, valores in valores_por_pagina.items():
+            writer.update_page_form_field_values(writer.pages[num_pagina], valores, auto_regenerate=False)
+            campos_rellenados.update(valores)
 
-                        # Calcular posiciones aproximadas
-                        if 'superior' in zona:
-                            y = page_height * 0.75
-                        elif 'inferior' in zona:
-                            y = page_height * 0.25
-                        else:  # media
-                            y = page_height * 0.5
+        writer.set_need_appearances_writer(True)
 
-                        if 'izquierda' in zona:
-                            x = page_width * 0.2
-                        elif 'derecha' in zona:
-                            x = page_width * 0.7
-                        else:  # centro
-                            x = page_width * 0.5
+        self.estadisticas['campos_locales'] += len(campos_rellenados)
+        return writer, len(campos_rellenados)
 
-                        # Escribir el valor
-                        can.drawString(x, y, str(valor))
+    def rellenar_pdf_con_ia(self, pdf_path: Origen, datos_cliente: Dict, output_path):
+        """
+        Rellena un PDF no interactivo usando IA para identificar campos y un overlay de texto para escribir
 
-            can.save()
+        Args:
+            pdf_path: Ruta al PDF formulario, bytes, archivo binario o DocumentoPDF
+            datos_cliente: Datos del cliente
+            output_path: Ruta o archivo binario de salida
+        """
+        documento = DocumentoPDF.desde(pdf_path)
 
-            # Mover al principio del buffer
-            packet.seek(0)
+        # Primero analizar el formulario con IA
+        analisis = self.analizar_formulario_pdf(documento, datos_cliente)
 
-            # Leer el overlay
-            overlay_pdf = PdfReader(packet)
+        # Escribir los valores sobre el PDF original
+        self._escribir_overlay(documento, analisis, output_path)
 
-            # Fusionar con la página original
-            page.merge_page(overlay_pdf.pages[0])
-            writer.add_page(page)
+        return analisis
 
-        # Guardar el PDF resultante
-        with open(output_path, 'wb') as f:
-            writer.write(f)
+    def _escribir_overlay(self, documento: DocumentoPDF, analisis: Dict, output_path):
+        """
+        Escribe los valores de un análisis sobre las páginas del PDF
 
-        return analisis
+        Args:
+            documento: PDF original (su overlay se compila una sola vez)
+            analisis: Análisis del formulario con los campos y sus valores
+            output_path: Ruta o archivo binario de salida
 
-    def rellenar_pdf(self, pdf_path: str, datos_cliente: Dict, output_path: str) -> Dict:
+        Returns:
+            Información de la optimización de la salida
+        """
+        # Solo se tocan las páginas con campos; el resto se copia sin cambios
+        writer = documento.overlay.renderizar(documento.reader, analisis.get('campos', []))
+
+        # Guardar el PDF resultante (pypdf acepta ruta o archivo binario)
+        return self._guardar(writer, output_path)
+
+    def rellenar_pdf(self, pdf_path: Origen, datos_cliente: Dict, output_path) -> Dict:
         """
         Método principal para rellenar un PDF (intenta interactivo primero, luego IA)
 
         Args:
-            pdf_path: Ruta al PDF formulario
+            pdf_path: Ruta al PDF formulario, bytes, archivo binario o DocumentoPDF
             datos_cliente: Datos del cliente
-            output_path: Ruta de salida
+            output_path: Ruta o archivo binario de salida
 
         Returns:
             Diccionario con información del proceso
         """
+        # Leer el PDF una sola vez y compartirlo entre todas las etapas
+        documento = DocumentoPDF.desde(pdf_path)
+
         # Intentar rellenar como PDF interactivo
-        if self.rellenar_pdf_interactivo(pdf_path, datos_cliente, output_path):
+        optimizacion = self._rellenar_interactivo(documento, datos_cliente, output_path)
+        if optimizacion is not None:
             return {
                 'exito': True,
                 'metodo': 'pdf_interactivo',
-                'mensaje': 'PDF rellenado exitosamente (formulario interactivo)'
+                'mensaje': 'PDF rellenado exitosamente (formulario interactivo)',
+                'parseos': documento.parseos,
+                'optimizacion': optimizacion
             }
         else:
-            # Si no es interactivo, usar IA + reportlab
-            analisis = self.rellenar_pdf_con_ia(pdf_path, datos_cliente, output_path)
+            # Si no es interactivo, usar IA + overlay
+            analisis = self.analizar_formulario_pdf(documento, datos_cliente)
+            optimizacion = self._escribir_overlay(documento, analisis, output_path)
             return {
+                'exito': True,
+                'metodo': 'ia_overlay',
+                'mensaje': 'PDF rellenado con IA (las posiciones son aproximadas - verifica el resultado)',
+                'analisis': analisis,
+                'parseos': documento.parseos,
+                'optimizacion': optimizacion
+            }
+
+    def rellenar_pdf_bytes(self, pdf: Origen, datos_cliente: Dict) -> Dict:
+        """
+        Rellena un PDF en memoria, sin archivos temporales
+
+        Args:
+            pdf: PDF formulario como bytes, archivo binario o ruta
+            datos_cliente: Datos del cliente
+
+        Returns:
+            Información del proceso, con el PDF rellenado en 'contenido'
+        """
+        salida = BytesIO()
+        resultado = self.rellenar_pdf(pdf, datos_cliente, salida)
+        resultado['contenido'] = salida.getvalue()
+        return resultado
+
+    @staticmethod
+    def _aplicar_valores_cliente(analisis: Dict, datos_cliente: Dict) -> Dict:
+        """
+        Sustituye los valores de un análisis por los datos de otro cliente
+
+        El análisis de la plantilla identifica qué campo del cliente va en cada posición;
+        solo el valor depende del cliente, así que no hace falta volver a llamar a la IA.
+
+        Returns:
+            Copia del análisis con los valores del cliente
+        """
+        campos = []
+        for campo in analisis.get('campos', []):
+            campo = dict(campo)
+            campo_cliente = campo.get('campo_cliente')
+            valor = datos_cliente.get(campo_cliente) if campo_cliente else None
+            if campo.get('tipo') == 'checkbox':
+                valor = 'X' if valor else ''
+            elif isinstance(valor, bool):
+                valor = 'Sí' if valor else 'No'
+            # Sin dato del cliente el campo queda vacío: nunca se arrastra el valor
+            # del cliente con el que se analizó la plantilla
+            campo['valor'] = '' if valor is None else valor
+            campos.append(campo)
+
+        return {**analisis, 'campos': campos}
+
+    def analizar_plantilla(self, pdf_path: Origen, datos_referencia: Dict) -> Dict:
+        """
+        Analiza una plantilla una sola vez para rellenarla después con muchos clientes
+
+        Args:
+            pdf_path: Ruta al PDF formulario, bytes, archivo binario o DocumentoPDF
+            datos_referencia: Datos de un cliente de ejemplo (se usan para guiar a la IA)
+
+        Returns:
+            Diccionario con el método a usar ('pdf_interactivo' o 'ia_overlay') y el análisis
+        """
+        documento = DocumentoPDF.desde(pdf_path)
+        _, campos_rellenados = self._rellenar_campos_formulario(documento, datos_referencia)
+
+        if campos_rellenados > 0:
+            return {'metodo': 'pdf_interactivo', 'analisis': None}
+
+        return {
+            'metodo': 'ia_overlay',
+            'analisis': self.analizar_formulario_pdf(documento, datos_referencia)
+        }
+
+    def preparar_plantilla(self, pdf: Origen, campos_cliente: List[str]) -> Dict:
+        """
+        Lee y analiza una plantilla antes de saber con qué cliente se va a rellenar
+
+        El análisis no depende del cliente: solo decide qué dato va en cada campo o
+        etiqueta. Deja el PDF leído, el mapa del formulario y la geometría de las
+        páginas calculados, de modo que rellenar_preparado solo tiene que escribir.
+
+        Args:
+            pdf: PDF formulario como bytes, archivo binario, ruta o DocumentoPDF
+            campos_cliente: Nombres de los datos de un cliente (p. ej. columnas de Cliente)
+
+        Returns:
+            Diccionario con el 'documento', el 'metodo' y el 'analisis' de la plantilla
+        """
+        documento = DocumentoPDF.desde(pdf)
+        plantilla = self.analizar_plantilla(documento, {campo: '' for campo in campos_cliente})
+        if plantilla['metodo'] == 'ia_overlay':
+            # Precompilar la geometría de las páginas para el overlay
+            documento.overlay
+        return {'documento': documento, **plantilla}
+
+    def rellenar_preparado(self, preparada: Dict, datos_cliente: Dict) -> Dict:
+        """
+        Rellena en memoria una plantilla ya preparada con preparar_plantilla
+
+        No llama a la IA salvo que ningún campo del formulario interactivo coincida con
+        los datos del cliente: entonces, igual que rellenar_pdf, se analiza el PDF con
+        la IA y se escribe con el overlay.
+
+        Args:
+            preparada: Resultado de preparar_plantilla
+            datos_cliente: Datos del cliente
+
+        Returns:
+            Información del proceso, con el PDF rellenado en 'contenido'
+        """
+        inicio = time.perf_counter()
+        documento = preparada['documento']
+        salida = BytesIO()
+
+        campos_rellenados = 0
+        if preparada['metodo'] == 'pdf_interactivo':
+            writer, campos_rellenados = self._rellenar_campos_formulario(documento, datos_cliente)
+
+        if campos_rellenados:
+            optimizacion = self._guardar(writer, salida)
+            resultado = {
+                'exito': True,
+                'metodo': 'pdf_interactivo',
+                'mensaje': 'PDF rellenado exitosamente (formulario interactivo)'
+            }
+        else:
+            if preparada['metodo'] == 'pdf_interactivo':
+                # Ningún campo coincide: análisis completo con la IA y overlay
+                analisis = self.analizar_formulario_pdf(documento, datos_cliente)
+            else:
+                analisis = self._aplicar_valores_cliente(preparada['analisis'], datos_cliente)
+            optimizacion = self._escribir_overlay(documento, analisis, salida)
+            resultado = {
                 'exito': True,
                 'metodo': 'ia_overlay',
                 'mensaje': 'PDF rellenado con IA (las posiciones son aproximadas - verifica el resultado)',
                 'analisis': analisis
             }
+
+        resultado.update({
+            'ruta': 'preparada',
+            'segundos': round(time.perf_counter() - inicio, 4),
+            'parseos': documento.parseos,
+            'optimizacion': optimizacion,
+            'contenido': salida.getvalue()
+        })
+        return resultado
+
+    def rellenar_lote(self, plantilla_path: Origen, cliente_ids: List[int], workers: int = None,
+                      db_manager=None, zip_destino=None, nombre_plantilla: str = None) -> Dict:
+        """
+        Rellena una misma plantilla para muchos clientes y empaqueta los resultados en un ZIP
+
+        La plantilla se analiza una sola vez; cada copia se genera en un pool de procesos
+        sin llamadas a la IA y se escribe en el ZIP según termina.
+
+        Args:
+            plantilla_path: Ruta al PDF formulario, bytes o archivo binario
+            cliente_ids: IDs de los clientes a rellenar
+            workers: Número de procesos (por defecto, número de CPUs)
+            db_manager: Gestor de base de datos de donde leer los clientes
+            zip_destino: Ruta o archivo binario del ZIP (si no se indica, se devuelven los bytes)
+            nombre_plantilla: Nombre original de la plantilla (si no se pasa una ruta)
+
+        Returns:
+            Diccionario con el manifiesto del lote y, si no hay destino, los bytes del ZIP
+        """
+        if not cliente_ids:
+            raise ValueError("No se han indicado clientes para el lote")
+        clientes = cargar_clientes(cliente_ids, db_manager)
+        # Solo los clientes que existen guían el análisis de la plantilla
+        existentes = [datos for datos in clientes if datos is not None]
+        if not existentes:
+            raise ValueError("Ninguno de los clientes del lote existe")
+
+        documento = DocumentoPDF.desde(plantilla_path, nombre_plantilla)
+        nombre_plantilla = documento.nombre or 'plantilla.pdf'
+
+        plantilla = self.analizar_plantilla(documento, existentes[0])
+        nombre_base = Path(nombre_plantilla).stem
+
+        tareas = crear_tareas_lote(cliente_ids, clientes, nombre_base, 'pdf')
+
+        with self._lock:
+            sinonimos = dict(self.sinonimos)
+
+        buffer = BytesIO() if zip_destino is None else None
+        manifiesto = generar_lote_zip(
+            tareas,
+            _rellenar_pdf_lote,
+            zip_destino if zip_destino is not None else buffer,
+            workers=workers,
+            inicializador=_inicializar_proceso_lote,
+            initargs=(self.api_key, documento.datos, plantilla, self.optimizar_salida, self.aplanar,
+                      sinonimos),
+            info_plantilla={'nombre': nombre_plantilla, 'metodo': plantilla['metodo']}
+        )
+
+        resultado = {'exito': manifiesto['fallidos'] == 0, 'manifiesto': manifiesto}
+        if buffer is not None:
+            resultado['zip'] = buffer.getvalue()
+        return resultado
+
+
+# Estado de cada proceso del pool de lotes (plantilla leída y analizada una vez por proceso)
+_CONTEXTO_LOTE = {}
+
+
+def _inicializar_proceso_lote(api_key: str, plantilla_bytes: bytes, plantilla: Dict,
+                              optimizar_salida: bool = True, aplanar: bool = False,
+                              sinonimos: Dict[str, str] = None):
+    """Prepara un proceso del pool con la plantilla ya analizada y las etiquetas aprendidas"""
+    _CONTEXTO_LOTE['filler'] = PDFFiller(api_key, optimizar_salida=optimizar_salida, aplanar=aplanar,
+                                         sinonimos=sinonimos)
+    _CONTEXTO_LOTE['documento'] = DocumentoPDF(plantilla_bytes)
+    _CONTEXTO_LOTE['plantilla'] = plantilla
+
+
+def _rellenar_pdf_lote(tarea: Dict) -> Dict:
+    """Rellena la copia de un cliente dentro de un proceso del pool"""
+    inicio = time.perf_counter()
+    filler = _CONTEXTO_LOTE['filler']
+    plantilla = _CONTEXTO_LOTE['plantilla']
+    # La plantilla se lee una vez por proceso: cada copia se clona en su propio writer
+    documento = _CONTEXTO_LOTE['documento']
+    salida = BytesIO()
+
+    try:
+        if plantilla['metodo'] == 'pdf_interactivo':
+            writer, campos_rellenados = filler._rellenar_campos_formulario(
+                documento, tarea['datos_cliente'], consultar_ia=False
+            )
+            if campos_rellenados == 0:
+                return {'exito': False, 'metodo': plantilla['metodo'],
+                        'error': 'Ningún campo del formulario coincide con los datos del cliente'}
+            optimizacion = filler._guardar(writer, salida)
+        else:
+            analisis = filler._aplicar_valores_cliente(plantilla['analisis'], tarea['datos_cliente'])
+            optimizacion = filler._escribir_overlay(documento, analisis, salida)
+
+        return {
+            'exito': True,
+            'metodo': plantilla['metodo'],
+            'contenido': salida.getvalue(),
+            'bytes_ahorrados': optimizacion.get('bytes_ahorrados'),
+            'segundos': round(time.perf_counter() - inicio, 4)
+        }
+
+    except Exception as e:
+        return {'exito': False, 'metodo': plantilla['metodo'], 'error': str(e)}
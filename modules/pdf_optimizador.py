@@ -0,0 +1,107 @@
+"""
+Módulo para reducir el tamaño de los PDFs generados antes de guardarlos
+"""
+import os
+from io import BytesIO
+from typing import Dict
+from pypdf import PdfWriter
+from pypdf.generic import NameObject
+
+from .emparejador_campos import MapaFormulario
+
+
+def _valor_heredado(widget, clave: str):
+    """Busca una clave en un widget o en sus campos padre"""
+    nodo = widget
+    while nodo is not None:
+        if clave in nodo:
+            return nodo[clave]
+        nodo = nodo.get('/Parent')
+        nodo = nodo.get_object() if nodo is not None else None
+    return None
+
+
+def aplanar_formulario(writer: PdfWriter) -> int:
+    """
+    Convierte los campos del formulario en contenido estático de la página
+
+    Args:
+        writer: Documento con formulario interactivo
+
+    Returns:
+        Número de widgets aplanados
+    """
+    if '/AcroForm' not in writer._root_object:
+        return 0
+
+    aplanados = 0
+    for page in writer.pages:
+        valores = {}
+        for anotacion in page.get('/Annots') or []:
+            widget = anotacion.get_object()
+            if widget.get('/Subtype') != '/Widget':
+                continue
+
+            nombre, tipo, _ = MapaFormulario._datos_campo(widget)
+            if not nombre:
+                continue
+
+            valor = _valor_heredado(widget, '/V')
+            if tipo == '/Btn':
+                valores[nombre] = str(valor) if valor is not None else '/Off'
+            else:
+                valores[nombre] = '' if valor is None else str(valor)
+            aplanados += 1
+
+        if valores:
+            writer.update_page_form_field_values(page, valores, auto_regenerate=None, flatten=True)
+
+    writer.remove_annotations(subtypes='/Widget')
+    del writer._root_object[NameObject('/AcroForm')]
+    return aplanados
+
+
+def optimizar_pdf(writer: PdfWriter, output_path, aplanar: bool = False, medir: bool = False) -> Dict:
+    """
+    Comprime, deduplica y (opcionalmente) aplana un PDF y lo guarda
+
+    Args:
+        writer: Documento a guardar
+        output_path: Ruta o archivo binario de salida
+        aplanar: Si True, el formulario se convierte en contenido estático
+        medir: Si True, se escribe antes el PDF sin optimizar para informar del ahorro
+               (duplica el coste de guardar; solo para benchmark.py)
+
+    Returns:
+        Diccionario con 'bytes_original', 'bytes_final' y 'bytes_ahorrados' (los dos
+        relativos al original son None si no se mide)
+    """
+    bytes_original = None
+    if medir:
+        sin_optimizar = BytesIO()
+        writer.write(sin_optimizar)
+        bytes_original = sin_optimizar.tell()
+
+    widgets_aplanados = aplanar_formulario(writer) if aplanar else 0
+
+    # Comprimir los streams de contenido (los overlays se añaden sin comprimir)
+    for page in writer.pages:
+        page.compress_content_streams()
+
+    # Fusionar objetos idénticos (fuentes, imágenes, recursos repetidos) y quitar huérfanos
+    writer.compress_identical_objects()
+
+    if hasattr(output_path, 'write'):
+        inicio = output_path.tell() if hasattr(output_path, 'tell') else 0
+        writer.write(output_path)
+        bytes_final = output_path.tell() - inicio if hasattr(output_path, 'tell') else None
+    else:
+        writer.write(output_path)
+        bytes_final = os.path.getsize(output_path)
+
+    return {
+        'bytes_original': bytes_original,
+        'bytes_final': bytes_final,
+        'bytes_ahorrados': (bytes_original - bytes_final) if bytes_original is not None and bytes_final is not None else None,
+        'widgets_aplanados': widgets_aplanados
+    }
@@ -0,0 +1,146 @@
+"""
+Módulo para escribir valores sobre PDFs no interactivos con un overlay precompilado
+"""
+from typing import Dict, List, Tuple
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    DecodedStreamObject,
+    DictionaryObject,
+    NameObject,
+)
+
+# Nombre del recurso de fuente que se añade a las páginas rellenadas
+NOMBRE_FUENTE = '/FRellenar'
+
+
+def _posicion_zona(zona: str, ancho: float, alto: float) -> Tuple[float, float]:
+    """Calcula la posición aproximada (x, y) de una zona descrita por la IA"""
+    zona = (zona or 'media izquierda').lower()
+
+    if 'superior' in zona:
+        y = alto * 0.75
+    elif 'inferior' in zona:
+        y = alto * 0.25
+    else:  # media
+        y = alto * 0.5
+
+    if 'izquierda' in zona:
+        x = ancho * 0.2
+    elif 'derecha' in zona:
+        x = ancho * 0.7
+    else:  # centro
+        x = ancho * 0.5
+
+    return x, y
+
+
+def _texto_pdf(valor) -> bytes:
+    """Codifica un valor como cadena literal PDF (WinAnsi, con paréntesis escapados)"""
+    texto = str(valor).replace('\r', ' ').replace('\n', ' ')
+    datos = texto.encode('cp1252', errors='replace')
+    return b'(' + datos.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+class OverlayCompilado:
+    """
+    Parte estática de un overlay, calculada una sola vez por plantilla
+
+    Guarda el tamaño de cada página y la fuente a usar, de forma que rellenar un
+    cliente solo añade operaciones de texto a las páginas que tienen campos.
+    """
+
+    def __init__(self, reader: PdfReader, fuente: str = 'Helvetica', tamano: float = 10):
+        """
+        Args:
+            reader: PDF plantilla
+            fuente: Fuente estándar PDF con la que escribir
+            tamano: Tamaño de la fuente en puntos
+        """
+        self.tamano = tamano
+        self.paginas = []
+        for page in reader.pages:
+            caja = page.mediabox
+            self.paginas.append((float(caja.left), float(caja.bottom), float(caja.width), float(caja.height)))
+
+        self.fuente = DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject(f'/{fuente}'),
+            NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+        })
+        self._cabecera = f'BT {NOMBRE_FUENTE} {tamano:g} Tf '.encode('ascii')
+        self._zonas = {}
+
+    def posicion(self, pagina: int, zona: str) -> Tuple[float, float]:
+        """Posición absoluta (x, y) de una zona en una página, con caché por plantilla"""
+        clave = (pagina, zona)
+        if clave not in self._zonas:
+            izquierda, abajo, ancho, alto = self.paginas[pagina]
+            x, y = _posicion_zona(zona, ancho, alto)
+            self._zonas[clave] = (izquierda + x, abajo + y)
+        return self._zonas[clave]
+
+    def operaciones(self, campos: List[Dict]) -> Dict[int, bytes]:
+        """
+        Genera las operaciones de texto de cada página con campos
+
+        Args:
+            campos: Campos del análisis (con 'pagina', 'zona' y 'valor')
+
+        Returns:
+            Diccionario {indice_pagina: operaciones PDF}
+        """
+        por_pagina = {}
+        for campo in campos:
+            pagina = campo.get('pagina', 1) - 1
+            if not 0 <= pagina < len(self.paginas):
+                continue
+
+            x, y = self.posicion(pagina, campo.get('zona', 'media izquierda'))
+            por_pagina.setdefault(pagina, []).append(
+                self._cabecera + f'1 0 0 1 {x:.2f} {y:.2f} Tm '.encode('ascii')
+                + _texto_pdf(campo.get('valor', '')) + b' Tj ET'
+            )
+
+        return {pagina: b'\n'.join(ops) for pagina, ops in por_pagina.items()}
+
+    def renderizar(self, reader: PdfReader, campos: List[Dict]) -> PdfWriter:
+        """
+        Escribe los campos sobre una copia del PDF
+
+        Solo se modifican las páginas con campos; el resto se copia tal cual.
+
+        Args:
+            reader: PDF plantilla
+            campos: Campos del análisis con sus valores
+
+        Returns:
+            PdfWriter con el documento rellenado
+        """
+        writer = PdfWriter(clone_from=reader)
+        operaciones = self.operaciones(campos)
+        if not operaciones:
+            return writer
+
+        for pagina, ops in operaciones.items():
+            page = writer.pages[pagina]
+
+            # Añadir la fuente (como objeto directo) a los recursos de la página
+            if '/Resources' not in page:
+                page[NameObject('/Resources')] = DictionaryObject()
+            recursos = page['/Resources'].get_object()
+            if '/Font' not in recursos:
+                recursos[NameObject('/Font')] = DictionaryObject()
+            recursos['/Font'].get_object()[NameObject(NOMBRE_FUENTE)] = self.fuente
+
+            # Aislar el estado gráfico original y añadir el texto al final, en un
+            # único stream comprimido que sustituye al contenido de la página
+            original = page.get_contents()
+            contenido = DecodedStreamObject()
+            contenido.set_data(
+                b'q\n' + (original.get_data() if original is not None else b'') + b'\nQ\n' + ops + b'\n'
+            )
+            page.replace_contents(contenido)
+            page.compress_content_streams()
+
+        return writer
@@ -0,0 +1,88 @@
+"""
+Módulo para preparar en segundo plano las plantillas subidas, antes de elegir cliente
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# Plantillas preparadas (o en preparación) que se conservan en memoria
+_MAX_PREPARADAS = 16
+
+
+def huella_bytes(datos: bytes) -> str:
+    """Huella SHA-256 de un contenido"""
+    return hashlib.sha256(datos).hexdigest()
+
+
+class PreparadorPlantillas:
+    """
+    Lectura y análisis de plantillas en hilos de fondo, una sola vez por contenido
+
+    Cada plantilla se identifica por la huella de sus bytes y el tipo de preparación,
+    así que volver a subir el mismo archivo (o cada recarga de la página) reutiliza
+    el trabajo ya hecho o en curso en lugar de repetirlo.
+    """
+
+    def __init__(self, workers: int = 2, max_preparadas: int = _MAX_PREPARADAS):
+        """
+        Args:
+            workers: Número de hilos de preparación
+            max_preparadas: Número de plantillas que se conservan en memoria
+        """
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preparar_plantilla')
+        self._max_preparadas = max_preparadas
+        self._preparadas = OrderedDict()  # (huella, tipo) -> Future
+        self._lock = threading.Lock()
+
+    def preparar(self, datos: bytes, tipo: str, funcion: Callable, huella: str = None) -> Future:
+        """
+        Lanza la preparación de una plantilla si no está hecha ni en curso
+
+        Args:
+            datos: Contenido de la plantilla
+            tipo: Tipo de preparación (p. ej. 'pdf' o 'docx')
+            funcion: Función que recibe los bytes y devuelve la plantilla preparada
+            huella: Huella del contenido, si ya se conoce
+
+        Returns:
+            Future con la plantilla preparada
+        """
+        clave = (huella or huella_bytes(datos), tipo)
+        with self._lock:
+            futuro = self._preparadas.get(clave)
+            if futuro is not None and not (futuro.done() and futuro.exception() is not None):
+                self._preparadas.move_to_end(clave)
+                return futuro
+
+            # Nueva preparación (o reintento de una que falló)
+            futuro = self._executor.submit(funcion, datos)
+            self._preparadas[clave] = futuro
+            while len(self._preparadas) > self._max_preparadas:
+                self._preparadas.popitem(last=False)
+            return futuro
+
+    def obtener(self, datos: bytes, tipo: str, funcion: Callable, timeout: float = None, huella: str = None):
+        """
+        Devuelve la plantilla preparada, esperando a que termine si sigue en curso
+
+        Returns:
+            Resultado de la función de preparación
+        """
+        return self.preparar(datos, tipo, funcion, huella).result(timeout=timeout)
+
+    def estado(self, datos: bytes, tipo: str, huella: str = None) -> Optional[str]:
+        """
+        Estado de la preparación de una plantilla
+
+        Returns:
+            'en_curso', 'lista', 'error' o None si no se ha lanzado
+        """
+        with self._lock:
+            futuro = self._preparadas.get((huella or huella_bytes(datos), tipo))
+        if futuro is None:
+            return None
+        if not futuro.done():
+            return 'en_curso'
+        return 'error' if futuro.exception() is not None else 'lista'
@@ -0,0 +1,375 @@
+"""
+Módulo para aplicar muchos reemplazos de texto en documentos Word en una sola pasada
+"""
+import re
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+from lxml import etree
+
+from .paquete_docx import PaqueteDocx, serializar_xml
+from .texto_docx import partes_texto_docx
+
+# Etiquetas WordprocessingML usadas al recorrer el XML directamente
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_PARRAFO = _W + 'p'
+_RUN = _W + 'r'
+_HIPERVINCULO = _W + 'hyperlink'
+_TEXTO = _W + 't'
+_SEPARADORES = {_W + 'tab': '\t', _W + 'br': '\n', _W + 'cr': '\n'}
+_XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+
+@lru_cache(maxsize=64)
+def _compilar_patron(patrones: Tuple[str, ...]):
+    """
+    Compila una alternancia con todos los patrones (el más largo gana)
+
+    Las repeticiones de un mismo carácter con longitudes consecutivas
+    ('...', '....', ...) se agrupan en un único 'c{min,max}'.
+    """
+    repetidos = {}
+    literales = []
+    for patron in patrones:
+        if len(set(patron)) == 1 and len(patron) > 1:
+            repetidos.setdefault(patron[0], []).append(len(patron))
+        else:
+            literales.append(patron)
+
+    alternativas = []
+    for caracter, longitudes in repetidos.items():
+        longitudes.sort()
+        if longitudes[-1] - longitudes[0] + 1 == len(longitudes):
+            alternativas.append((longitudes[-1], f'{re.escape(caracter)}{{{longitudes[0]},{longitudes[-1]}}}'))
+        else:
+            literales.extend(caracter * n for n in longitudes)
+
+    alternativas.extend((len(patron), re.escape(patron)) for patron in literales)
+    alternativas.sort(key=lambda alternativa: alternativa[0], reverse=True)
+    return re.compile('|'.join(expresion for _, expresion in alternativas))
+
+
+def _segmentos_parrafo(p) -> List:
+    """
+    Elementos de texto (w:t) y separadores (tabuladores, saltos) de los runs de un párrafo
+
+    Incluye los runs dentro de hipervínculos, igual que Paragraph.text de python-docx.
+    """
+    segmentos = []
+    for hijo in p:
+        if hijo.tag == _RUN:
+            runs = (hijo,)
+        elif hijo.tag == _HIPERVINCULO:
+            runs = hijo.iterchildren(_RUN)
+        else:
+            continue
+        for run in runs:
+            for elemento in run:
+                if elemento.tag == _TEXTO or elemento.tag in _SEPARADORES:
+                    segmentos.append(elemento)
+    return segmentos
+
+
+def _textos_segmentos(segmentos: List) -> Tuple[List[str], List[int]]:
+    """Texto de cada segmento y posición en la que empieza dentro del párrafo"""
+    textos = [
+        (elemento.text or '') if elemento.tag == _TEXTO else _SEPARADORES[elemento.tag]
+        for elemento in segmentos
+    ]
+    inicios = []
+    posicion = 0
+    for texto in textos:
+        inicios.append(posicion)
+        posicion += len(texto)
+    return textos, inicios
+
+
+def _tramos(segmentos: List, textos: List[str], inicios: List[int], inicio: int, fin: int):
+    """
+    Tramos (indice_segmento, desde, hasta) que ocupa el texto [inicio, fin) del párrafo
+
+    Devuelve None si el texto incluye un tabulador o salto, que no se modifican.
+    """
+    primero = bisect_right(inicios, inicio) - 1
+    ultimo = bisect_right(inicios, fin - 1) - 1
+    if any(segmentos[i].tag != _TEXTO for i in range(primero, ultimo + 1)):
+        return None
+    return [
+        (i, max(inicio - inicios[i], 0), min(fin - inicios[i], len(textos[i])))
+        for i in range(primero, ultimo + 1)
+    ]
+
+
+def texto_parrafo(p) -> str:
+    """Texto de un elemento w:p tal y como lo ve Paragraph.text de python-docx"""
+    textos, _ = _textos_segmentos(_segmentos_parrafo(p))
+    return ''.join(textos)
+
+
+def parrafos_cuerpo(doc) -> List:
+    """Elementos w:p del cuerpo (incluidas tablas) de un documento python-docx o un w:document"""
+    return list(getattr(doc, 'element', doc).body.iter(_PARRAFO))
+
+
+def reemplazar_en_parrafo(p, buscar: str, valor: str) -> bool:
+    """
+    Reemplaza la primera aparición literal de un texto en un párrafo conservando los runs
+
+    Args:
+        p: Elemento w:p
+        buscar: Texto exacto a sustituir (puede estar repartido entre varios runs)
+        valor: Texto nuevo
+
+    Returns:
+        True si se encontró y reemplazó el texto
+    """
+    if not buscar:
+        return False
+
+    segmentos = _segmentos_parrafo(p)
+    textos, inicios = _textos_segmentos(segmentos)
+    inicio = ''.join(textos).find(buscar)
+    if inicio < 0:
+        return False
+
+    tramos = _tramos(segmentos, textos, inicios, inicio, inicio + len(buscar))
+    if tramos is None:
+        return False
+
+    aplicar_ediciones(dict(enumerate(segmentos)), [(buscar, tramos)], {buscar: valor})
+    return True
+
+
+def aplicar_ediciones(segmentos: Dict[int, object], ediciones: List, valores: Dict[str, str]) -> int:
+    """
+    Escribe los valores de una lista de ediciones en los elementos w:t de un párrafo
+
+    Las ediciones se aplican de derecha a izquierda para que las posiciones
+    de las anteriores sigan siendo válidas.
+
+    Args:
+        segmentos: {indice_segmento: elemento w:t}
+        ediciones: Lista de (patron, tramos) en orden del documento
+        valores: {patron: valor}; los patrones sin valor se dejan como están
+
+    Returns:
+        Número de ediciones aplicadas
+    """
+    nuevos = {}
+    aplicadas = 0
+    for patron, tramos in reversed(ediciones):
+        if patron not in valores:
+            continue
+        for posicion, (indice, desde, hasta) in enumerate(tramos):
+            texto = nuevos[indice] if indice in nuevos else (segmentos[indice].text or '')
+            nuevos[indice] = texto[:desde] + (valores[patron] if posicion == 0 else '') + texto[hasta:]
+        aplicadas += 1
+
+    for indice, nuevo in nuevos.items():
+        elemento = segmentos[indice]
+        elemento.text = nuevo
+        if nuevo != nuevo.strip():
+            elemento.set(_XML_SPACE, 'preserve')
+
+    return aplicadas
+
+
+class MotorReemplazos:
+    """
+    Reemplazo de muchos patrones a la vez sobre el texto de un documento Word
+
+    Todos los patrones se buscan con una única expresión regular, así que cada
+    párrafo se recorre una sola vez. Solo se reescriben los elementos de texto
+    que contienen una coincidencia, de modo que el formato de los runs se conserva.
+    """
+
+    def __init__(self, reemplazos: Dict[str, str]):
+        """
+        Args:
+            reemplazos: Diccionario {patron: valor}
+        """
+        self.reemplazos = {
+            patron: str(valor) if valor else ''
+            for patron, valor in reemplazos.items() if patron
+        }
+        self.patron = _compilar_patron(tuple(sorted(self.reemplazos))) if self.reemplazos else None
+
+    def buscar_parrafo(self, p) -> Tuple[List, List[Tuple[str, List[Tuple[int, int, int]]]]]:
+        """
+        Localiza las coincidencias de un párrafo sin modificarlo
+
+        Args:
+            p: Elemento w:p
+
+        Returns:
+            Tupla (segmentos, ediciones). Cada edición es (patron, tramos) y cada tramo
+            (indice_segmento, desde, hasta) indica la parte del texto de un w:t que ocupa
+        """
+        segmentos = _segmentos_parrafo(p)
+        ediciones = []
+        if self.patron is None:
+            return segmentos, ediciones
+
+        textos, inicios = _textos_segmentos(segmentos)
+        for coincidencia in self.patron.finditer(''.join(textos)):
+            tramos = _tramos(segmentos, textos, inicios, *coincidencia.span())
+            if tramos is not None:
+                ediciones.append((coincidencia.group(), tramos))
+
+        return segmentos, ediciones
+
+    def aplicar_parrafo(self, parrafo) -> int:
+        """
+        Aplica los reemplazos a un párrafo reescribiendo solo los textos afectados
+
+        Una coincidencia repartida entre varios runs deja el valor en el primero
+        y elimina el resto del patrón de los siguientes.
+
+        Args:
+            parrafo: Párrafo python-docx o elemento w:p
+
+        Returns:
+            Número de coincidencias reemplazadas
+        """
+        segmentos, ediciones = self.buscar_parrafo(getattr(parrafo, '_p', parrafo))
+        if not ediciones:
+            return 0
+        return aplicar_ediciones(dict(enumerate(segmentos)), ediciones, self.reemplazos)
+
+    def aplicar_documento(self, doc) -> int:
+        """
+        Aplica los reemplazos a todos los párrafos del cuerpo, incluidas las tablas
+
+        Args:
+            doc: Documento python-docx o elemento w:document
+
+        Returns:
+            Número total de coincidencias reemplazadas
+        """
+        return sum(self.aplicar_parrafo(p) for p in parrafos_cuerpo(doc))
+
+
+def _ruta_elemento(raiz, elemento) -> Tuple[int, ...]:
+    """Posición de un elemento como índices de hijo desde la raíz de su parte"""
+    ruta = []
+    while elemento is not raiz:
+        padre = elemento.getparent()
+        ruta.append(padre.index(elemento))
+        elemento = padre
+    return tuple(reversed(ruta))
+
+
+def _resolver_ruta(raiz, ruta: Tuple[int, ...]):
+    """Elemento situado en una ruta de índices de hijo"""
+    for indice in ruta:
+        raiz = raiz[indice]
+    return raiz
+
+
+class PlantillaWordCompilada:
+    """
+    Plantilla Word con la posición exacta de cada marcador y campo en blanco
+
+    Al compilar se recorre el documento una sola vez y se guarda, para cada párrafo
+    con coincidencias, la parte del paquete, la ruta de cada w:t afectado y los
+    tramos de texto que ocupa cada patrón. Rellenar un cliente solo lee las partes
+    XML con campos, visita esos elementos y copia el resto del paquete sin tocarlo.
+    """
+
+    def __init__(self, documento, patrones, tipo_campos: str = None):
+        """
+        Args:
+            documento: DocumentoWord de la plantilla
+            patrones: Patrones a localizar (claves del mapeo de reemplazos)
+            tipo_campos: Tipo de campos detectado en la plantilla
+        """
+        self.huella = documento.huella
+        self.paquete = PaqueteDocx(documento.datos)
+        self.patrones = tuple(sorted(patron for patron in patrones if patron))
+        self.tipo_campos = tipo_campos
+
+        # [(nombre_parte, {indice_segmento: ruta_w:t}, ediciones)]
+        self.ubicaciones = []
+
+        # Partes con texto rellenable: la principal, cabeceras y pies de página
+        motor = MotorReemplazos(dict.fromkeys(self.patrones, ''))
+        for nombre_parte in partes_texto_docx(self.paquete.nombres, self.paquete.leer):
+            raiz = etree.fromstring(self.paquete.leer(nombre_parte))
+            for p in raiz.iter(_PARRAFO):
+                segmentos, ediciones = motor.buscar_parrafo(p)
+                if not ediciones:
+                    continue
+                indices = {indice for _, tramos in ediciones for indice, _, _ in tramos}
+                rutas = {indice: _ruta_elemento(raiz, segmentos[indice]) for indice in indices}
+                self.ubicaciones.append((nombre_parte, rutas, ediciones))
+        documento.registrar_parseo()
+
+    @property
+    def num_campos(self) -> int:
+        """Número de marcadores y campos en blanco localizados"""
+        return sum(len(ediciones) for _, _, ediciones in self.ubicaciones)
+
+    def rellenar(self, reemplazos: Dict[str, str], output_path, documento=None) -> int:
+        """
+        Rellena una copia nueva de la plantilla tocando solo los textos localizados
+
+        Args:
+            reemplazos: Diccionario {patron: valor}
+            output_path: Ruta o archivo binario de salida
+            documento: DocumentoWord en el que contar la lectura de las partes con campos
+
+        Returns:
+            Número de campos rellenados
+        """
+        valores = {
+            patron: str(valor) if valor else ''
+            for patron, valor in reemplazos.items() if patron
+        }
+
+        raices = {}
+        rellenados = 0
+        for nombre_parte, rutas, ediciones in self.ubicaciones:
+            if nombre_parte not in raices:
+                raices[nombre_parte] = etree.fromstring(self.paquete.leer(nombre_parte))
+            raiz = raices[nombre_parte]
+            segmentos = {indice: _resolver_ruta(raiz, ruta) for indice, ruta in rutas.items()}
+            rellenados += aplicar_ediciones(segmentos, ediciones, valores)
+        if raices and documento is not None:
+            documento.registrar_parseo()
+
+        # Solo se vuelven a serializar las partes con campos; el resto se copia comprimido
+        self.paquete.escribir(output_path, {
+            nombre_parte: serializar_xml(raiz) for nombre_parte, raiz in raices.items()
+        })
+        return rellenados
+
+
+# Plantillas ya compiladas, por huella del documento y patrones
+_PLANTILLAS = OrderedDict()
+_MAX_PLANTILLAS = 32
+
+
+def obtener_plantilla_compilada(documento, patrones, clasificar: Callable[[str], str] = None) -> PlantillaWordCompilada:
+    """
+    Devuelve la plantilla compilada, compilándola solo la primera vez
+
+    Args:
+        documento: DocumentoWord de la plantilla
+        patrones: Patrones a localizar
+        clasificar: Función opcional texto → tipo de campos (solo se llama al compilar)
+
+    Returns:
+        Plantilla compilada
+    """
+    clave = (documento.huella, tuple(sorted(patron for patron in patrones if patron)))
+    if clave in _PLANTILLAS:
+        _PLANTILLAS.move_to_end(clave)
+        return _PLANTILLAS[clave]
+
+    tipo_campos = clasificar(documento.texto) if clasificar else None
+    plantilla = PlantillaWordCompilada(documento, clave[1], tipo_campos)
+    _PLANTILLAS[clave] = plantilla
+    if len(_PLANTILLAS) > _MAX_PLANTILLAS:
+        _PLANTILLAS.popitem(last=False)
+    return plantilla
@@ -0,0 +1,213 @@
+"""
+Módulo de retención: borra los documentos antiguos del almacenamiento y limpia los temporales locales
+"""
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .almacenamiento import PREFIJO_TEMPORAL, AlmacenamientoLocal, tipo_recurso
+from .indice_archivos import sincronizar_indice
+
+# Política por carpeta: 'max_dias' (antigüedad máxima) y 'max_archivos' (cuántos de
+# los más recientes se conservan); None desactiva el límite correspondiente
+POLITICAS_RETENCION = {
+    'soporte_admin/generated': {'max_dias': 90, 'max_archivos': 2000},
+    'soporte_admin/uploaded': {'max_dias': 365, 'max_archivos': None},
+}
+
+# Archivos que se borran del almacenamiento (y del índice) de una vez
+_TAMANO_LOTE = 500
+
+# Horas tras las que un temporal se da por abandonado
+_MAX_HORAS_TEMPORALES = 24
+
+# Días que se conservan las subidas y los trabajos terminados (con sus resultados)
+_DIAS_COLAS = 30
+
+ZonaTemporal = Tuple[Union[str, Path], str]
+
+
+def zonas_temporales(almacenamiento=None, cache=None) -> List[ZonaTemporal]:
+    """
+    Directorios locales donde la aplicación deja archivos de trabajo
+
+    Returns:
+        Lista de tuplas (directorio, patrón glob de los archivos que se pueden borrar)
+    """
+    zonas = [(tempfile.gettempdir(), f"{PREFIJO_TEMPORAL}*")]
+    if isinstance(almacenamiento, AlmacenamientoLocal):
+        zonas.append((almacenamiento.raiz, '.subida_*'))
+    cache = cache or getattr(almacenamiento, 'cache', None)
+    if cache is not None:
+        zonas.append((cache.directorio, '.descarga_*'))
+    return zonas
+
+
+def barrer_temporales(zonas: List[ZonaTemporal], max_horas: float = _MAX_HORAS_TEMPORALES,
+                      simular: bool = True) -> Dict:
+    """
+    Borra los archivos de trabajo abandonados (más antiguos que max_horas)
+
+    Los temporales recientes pueden pertenecer a una operación en curso y no se tocan.
+
+    Args:
+        zonas: Directorios y patrones a revisar (ver zonas_temporales)
+        max_horas: Antigüedad mínima, en horas, de un archivo para borrarlo
+        simular: Solo contar lo que se borraría
+
+    Returns:
+        Diccionario con 'archivos', 'bytes', 'eliminados' y 'errores'
+    """
+    limite = time.time() - max_horas * 3600
+    informe = {'archivos': 0, 'bytes': 0, 'eliminados': 0, 'errores': []}
+
+    for directorio, patron in zonas:
+        directorio = Path(directorio)
+        if not directorio.is_dir():
+            continue
+        for ruta in directorio.glob(patron):
+            try:
+                estado = ruta.stat()
+                if not ruta.is_file() or estado.st_mtime >= limite:
+                    continue
+                informe['archivos'] += 1
+                informe['bytes'] += estado.st_size
+                if not simular:
+                    ruta.unlink()
+                    informe['eliminados'] += 1
+            except FileNotFoundError:
+                # Lo ha borrado otra operación mientras tanto
+                continue
+            except OSError as e:
+                informe['errores'].append(f"{ruta}: {e}")
+
+    return informe
+
+
+def planificar_retencion(db_manager, politicas: Dict = None, ahora: datetime = None) -> Dict:
+    """
+    Archivos que sobran en cada carpeta según las políticas, sin borrar nada
+
+    Se calcula sobre el índice local, así que no recorre el almacenamiento.
+
+    Args:
+        db_manager: Gestor de base de datos con el índice
+        politicas: Políticas por carpeta (por defecto POLITICAS_RETENCION)
+        ahora: Fecha de referencia para la antigüedad (por defecto, ahora en UTC)
+
+    Returns:
+        Diccionario carpeta -> lista de ArchivoAlmacenado, del más antiguo al más reciente
+    """
+    politicas = POLITICAS_RETENCION if politicas is None else politicas
+    ahora = ahora or datetime.utcnow()
+
+    plan = {}
+    for carpeta, politica in politicas.items():
+        max_dias = politica.get('max_dias')
+        plan[carpeta] = db_manager.candidatos_retencion(
+            carpeta,
+            antes_de=ahora - timedelta(days=max_dias) if max_dias is not None else None,
+            conservar=politica.get('max_archivos')
+        )
+    return plan
+
+
+def _eliminar_lote(almacenamiento, db_manager, archivos: List) -> Tuple[int, List[str]]:
+    """
+    Borra un lote de archivos del almacenamiento (agrupados por tipo) y del índice
+
+    Los que ya no existían en el almacenamiento también se quitan del índice. Si el
+    índice no guarda el tipo de recurso de un archivo, se deduce de su formato y, si
+    no aparece con ese tipo, se prueba con el otro antes de darlo por borrado.
+
+    Returns:
+        Tupla (eliminados, errores)
+    """
+    por_tipo = {}
+    deducidos = set()
+    for archivo in archivos:
+        resource_type = archivo.resource_type
+        if resource_type is None:
+            resource_type = tipo_recurso(f".{archivo.formato}" if archivo.formato else archivo.public_id)
+            deducidos.add(archivo.public_id)
+        por_tipo.setdefault(resource_type, []).append(archivo.public_id)
+
+    borrados = []
+    errores = []
+    while por_tipo:
+        resource_type, public_ids = por_tipo.popitem()
+        for resultado in almacenamiento.eliminar_archivos(public_ids, resource_type=resource_type):
+            public_id = resultado['public_id']
+            if resultado['exito']:
+                borrados.append(public_id)
+            elif resultado.get('estado') == 'not_found' and public_id in deducidos:
+                deducidos.discard(public_id)
+                otro = 'raw' if resource_type == 'image' else 'image'
+                por_tipo.setdefault(otro, []).append(public_id)
+            elif resultado.get('estado') == 'not_found':
+                borrados.append(public_id)
+            else:
+                errores.append(f"{public_id}: {resultado.get('error') or resultado.get('estado')}")
+
+    db_manager.eliminar_archivos_indice(borrados)
+    return len(borrados), errores
+
+
+def aplicar_retencion(almacenamiento, db_manager, politicas: Dict = None, simular: bool = True,
+                      sincronizar: bool = True, cache=None, max_horas: float = _MAX_HORAS_TEMPORALES,
+                      dias_cola: Optional[int] = _DIAS_COLAS) -> Dict:
+    """
+    Aplica las políticas de retención y limpia los temporales locales
+
+    Por defecto es una simulación: calcula qué se borraría y cuánto ocupa sin tocar
+    nada. Con simular=False borra los archivos del almacenamiento por lotes (con el
+    borrado en bloque del almacenamiento), los quita del índice, purga las colas de
+    subidas y de trabajos y borra los temporales abandonados.
+
+    Args:
+        almacenamiento: Almacenamiento (Cloudinary o local)
+        db_manager: Gestor de base de datos con el índice
+        politicas: Políticas por carpeta (por defecto POLITICAS_RETENCION)
+        simular: Solo informar de lo que se borraría
+        sincronizar: Actualizar antes el índice con lo nuevo del almacenamiento
+        cache: Caché de descargas cuyos temporales revisar (por defecto la del almacenamiento)
+        max_horas: Antigüedad mínima, en horas, de un temporal para borrarlo
+        dias_cola: Días que se conservan las subidas y los trabajos terminados (None para no purgar)
+
+    Returns:
+        Diccionario con 'simulacion', 'carpetas' (por carpeta: 'candidatos', 'bytes',
+        'eliminados' y 'errores'), 'subidas', 'trabajos' y 'temporales'
+    """
+    politicas = POLITICAS_RETENCION if politicas is None else politicas
+
+    if sincronizar:
+        for carpeta in politicas:
+            sincronizar_indice(almacenamiento, db_manager, folder=carpeta)
+
+    informe = {'simulacion': simular, 'carpetas': {}}
+    for carpeta, archivos in planificar_retencion(db_manager, politicas).items():
+        resumen = {
+            'candidatos': len(archivos),
+            'bytes': sum(a.bytes or 0 for a in archivos),
+            'eliminados': 0,
+            'errores': []
+        }
+        if not simular:
+            for inicio in range(0, len(archivos), _TAMANO_LOTE):
+                eliminados, errores = _eliminar_lote(almacenamiento, db_manager, archivos[inicio:inicio + _TAMANO_LOTE])
+                resumen['eliminados'] += eliminados
+                resumen['errores'].extend(errores)
+        informe['carpetas'][carpeta] = resumen
+
+    informe['subidas'] = informe['trabajos'] = 0
+    if dias_cola is not None:
+        antes_de = datetime.utcnow() - timedelta(days=dias_cola)
+        informe['subidas'] = db_manager.purgar_subidas(antes_de, simular=simular)
+        informe['trabajos'] = db_manager.purgar_trabajos(antes_de, simular=simular)
+
+    informe['temporales'] = barrer_temporales(
+        zonas_temporales(almacenamiento, cache), max_horas=max_horas, simular=simular
+    )
+    return informe
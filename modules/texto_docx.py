@@ -0,0 +1,216 @@
+"""
+Módulo para extraer el texto de un .docx leyendo el XML en streaming, sin python-docx
+"""
+import posixpath
+import re
+import zipfile
+from typing import Callable, List
+from lxml import etree
+
+from .documento import Origen, abrir_binario
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_CUERPO = _W + 'body'
+_PARRAFO = _W + 'p'
+_RUN = _W + 'r'
+_HIPERVINCULO = _W + 'hyperlink'
+_TABLA = _W + 'tbl'
+_FILA = _W + 'tr'
+_CELDA = _W + 'tc'
+_TEXTO = _W + 't'
+_BR = _W + 'br'
+_TIPO = _W + 'type'
+_VAL = _W + 'val'
+_VMERGE = f'{_W}tcPr/{_W}vMerge'
+
+# Elementos de un run que equivalen a un carácter (igual que Run.text de python-docx)
+_CARACTERES = {
+    _W + 'tab': '\t',
+    _W + 'ptab': '\t',
+    _W + 'cr': '\n',
+    _W + 'noBreakHyphen': '-',
+}
+
+_PARTES_CABECERA = re.compile(r'word/(header|footer)\d*\.xml$')
+
+# Relaciones y tipos de contenido del paquete (para localizar la parte principal)
+_RELACION = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+_OVERRIDE = '{http://schemas.openxmlformats.org/package/2006/content-types}Override'
+_REL_PRINCIPAL = '/officeDocument'
+_REL_CABECERAS = ('/header', '/footer')
+_PARTE_PRINCIPAL = 'word/document.xml'
+
+
+def _relaciones(leer: Callable[[str], bytes], nombre_rels: str) -> List:
+    """Relaciones (tipo, destino) de un archivo .rels, o None si no existe"""
+    try:
+        raiz = etree.fromstring(leer(nombre_rels))
+    except KeyError:
+        return None
+    return [
+        (relacion.get('Type', ''), relacion.get('Target', ''))
+        for relacion in raiz.iter(_RELACION) if relacion.get('TargetMode') != 'External'
+    ]
+
+
+def _resolver_destino(origen: str, destino: str) -> str:
+    """Nombre de la entrada a la que apunta una relación desde la parte 'origen'"""
+    if destino.startswith('/'):
+        return destino.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(origen), destino))
+
+
+def _orden_natural(nombre: str):
+    """Clave para ordenar 'header2' antes que 'header10'"""
+    return [int(trozo) if trozo.isdigit() else trozo for trozo in re.split(r'(\d+)', nombre)]
+
+
+def partes_texto_docx(nombres: List[str], leer: Callable[[str], bytes]) -> List[str]:
+    """
+    Partes del paquete con texto: la principal seguida de cabeceras y pies de página
+
+    La parte principal se toma de la relación officeDocument del paquete (o, si no
+    la hay, de [Content_Types].xml), así que no tiene por qué llamarse
+    word/document.xml. Las cabeceras y pies son los que enlaza la parte principal,
+    en orden natural (header2 antes que header10).
+
+    Args:
+        nombres: Nombres de las entradas del paquete
+        leer: Función nombre → contenido de una entrada (KeyError si no existe)
+
+    Returns:
+        Lista de nombres de entrada
+    """
+    principal = None
+    for tipo, destino in _relaciones(leer, '_rels/.rels') or []:
+        if tipo.endswith(_REL_PRINCIPAL):
+            principal = _resolver_destino('', destino)
+            break
+
+    if principal not in nombres and '[Content_Types].xml' in nombres:
+        principal = None
+        for override in etree.fromstring(leer('[Content_Types].xml')).iter(_OVERRIDE):
+            tipo = override.get('ContentType', '')
+            if 'wordprocessingml' in tipo and tipo.endswith('.main+xml'):
+                principal = override.get('PartName', '').lstrip('/')
+                break
+
+    if principal not in nombres:
+        principal = _PARTE_PRINCIPAL
+
+    directorio, nombre = posixpath.split(principal)
+    relaciones = _relaciones(leer, posixpath.join(directorio, '_rels', f'{nombre}.rels'))
+    if relaciones is None:
+        cabeceras = [n for n in nombres if _PARTES_CABECERA.match(n)]
+    else:
+        cabeceras = {
+            _resolver_destino(principal, destino)
+            for tipo, destino in relaciones if tipo.endswith(_REL_CABECERAS)
+        }
+        cabeceras = [n for n in cabeceras if n in nombres]
+
+    return [principal] + sorted(cabeceras, key=_orden_natural)
+
+
+def _texto_parrafo(p) -> str:
+    """Texto de los runs directos de un párrafo (y de sus hipervínculos)"""
+    partes = []
+    for hijo in p:
+        if hijo.tag == _RUN:
+            runs = (hijo,)
+        elif hijo.tag == _HIPERVINCULO:
+            runs = hijo.iterchildren(_RUN)
+        else:
+            continue
+        for run in runs:
+            for elemento in run:
+                if elemento.tag == _TEXTO:
+                    partes.append(elemento.text or '')
+                elif elemento.tag == _BR:
+                    if elemento.get(_TIPO, 'textWrapping') == 'textWrapping':
+                        partes.append('\n')
+                elif elemento.tag in _CARACTERES:
+                    partes.append(_CARACTERES[elemento.tag])
+    return ''.join(partes)
+
+
+def _es_continuacion(celda) -> bool:
+    """Indica si una celda continúa una combinación vertical (su texto ya está en la de arriba)"""
+    vmerge = celda.find(_VMERGE)
+    return vmerge is not None and vmerge.get(_VAL, 'continue') == 'continue'
+
+
+def _texto_cuerpo(xml) -> List[str]:
+    """
+    Recorre document.xml en streaming y devuelve párrafos y celdas en el orden de extraer_texto_word
+
+    Primero van los párrafos del cuerpo y después el texto de cada celda de las
+    tablas del cuerpo, fila a fila. Las celdas combinadas aparecen una sola vez.
+    """
+    parrafos = []
+    celdas = []
+
+    for _, elemento in etree.iterparse(xml, events=('end',), tag=(_PARRAFO, _CELDA, _TABLA)):
+        padre = elemento.getparent()
+
+        if elemento.tag == _TABLA:
+            if padre.tag == _CUERPO:
+                _liberar(elemento)
+            continue
+
+        if elemento.tag == _PARRAFO:
+            if padre.tag == _CUERPO:
+                parrafos.append(_texto_parrafo(elemento))
+                _liberar(elemento)
+            continue
+
+        # Celda: solo las de tablas colgadas directamente del cuerpo
+        fila = padre
+        tabla = fila.getparent() if fila.tag == _FILA else None
+        if tabla is None or tabla.tag != _TABLA or tabla.getparent().tag != _CUERPO:
+            continue
+
+        if not _es_continuacion(elemento):
+            celdas.append('\n'.join(_texto_parrafo(p) for p in elemento.iterchildren(_PARRAFO)))
+        elemento.clear()
+
+    return parrafos + celdas
+
+
+def _liberar(elemento):
+    """Libera la memoria de un elemento ya procesado y de sus hermanos anteriores"""
+    elemento.clear()
+    while elemento.getprevious() is not None:
+        del elemento.getparent()[0]
+
+
+def _texto_parte(xml) -> List[str]:
+    """Párrafos con texto de una cabecera o pie de página, en orden"""
+    lineas = []
+    for _, elemento in etree.iterparse(xml, events=('end',), tag=_PARRAFO):
+        texto = _texto_parrafo(elemento)
+        if texto.strip():
+            lineas.append(texto)
+    return lineas
+
+
+def extraer_texto_docx(origen: Origen) -> str:
+    """
+    Extrae el texto de un documento Word leyendo su XML en streaming
+
+    Args:
+        origen: Ruta, bytes o archivo binario del .docx
+
+    Returns:
+        Texto de párrafos y tablas del cuerpo, seguido del de cabeceras y pies de página
+    """
+    with zipfile.ZipFile(abrir_binario(origen)) as paquete:
+        principal, *cabeceras = partes_texto_docx(paquete.namelist(), paquete.read)
+        with paquete.open(principal) as xml:
+            lineas = _texto_cuerpo(xml)
+
+        for nombre in cabeceras:
+            with paquete.open(nombre) as xml:
+                lineas.extend(_texto_parte(xml))
+
+    return '\n'.join(lineas)
@@ -0,0 +1,191 @@
+"""
+Módulo para hacer extracciones y rellenados en segundo plano, con cola persistente
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+
+def huella_trabajo(tipo: str, entrada: bytes, parametros: Dict = None) -> str:
+    """Huella SHA-256 de un trabajo: tipo, contenido de la entrada y parámetros"""
+    huella = hashlib.sha256()
+    huella.update(tipo.encode('utf-8'))
+    huella.update(hashlib.sha256(entrada).digest())
+    huella.update(json.dumps(parametros or {}, sort_keys=True, default=str).encode('utf-8'))
+    return huella.hexdigest()
+
+
+class ColaTrabajos:
+    """
+    Cola de trabajos (extracción, rellenado, lotes) atendida por un pool de hilos
+
+    Los trabajos se guardan en la base de datos y se hacen fuera del hilo de la
+    página, así que navegar a otra página o recargar no los interrumpe. El resultado
+    queda guardado: la página solo consulta el estado y lo muestra cuando termina, y
+    pedir otra vez el mismo trabajo devuelve el ya hecho en lugar de repetirlo.
+
+    Cada tipo de trabajo tiene una función registrada que recibe la entrada (bytes)
+    y los parámetros (más 'nombre_archivo'), y devuelve un diccionario con
+    'resultado' (serializable a JSON) y, si genera un documento, 'salida' (bytes)
+    y 'nombre_salida'.
+
+    Mientras hace un trabajo, el repartidor renueva su latido en la base de datos;
+    los que se quedan sin latido (su proceso ha muerto) se vuelven a poner en cola,
+    sin tocar los que está haciendo otro proceso.
+    """
+
+    def __init__(self, db_manager, workers: int = 2, intervalo: float = 5.0, caducidad: float = 120.0):
+        """
+        Args:
+            db_manager: Gestor de base de datos donde se guarda la cola
+            workers: Número de trabajos simultáneos
+            intervalo: Cada cuántos segundos se revisa la cola aunque no lleguen trabajos nuevos
+            caducidad: Segundos sin latido tras los que un trabajo en curso se da por abandonado
+                       (debe ser bastante mayor que el intervalo)
+        """
+        self.db_manager = db_manager
+        self.workers = workers
+        self.intervalo = intervalo
+        self.caducidad = caducidad
+        self._funciones = {}
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='trabajo')
+        self._hay_trabajo = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def registrar(self, tipo: str, funcion: Callable[[bytes, Dict], Dict]):
+        """Asocia un tipo de trabajo a la función que lo hace"""
+        self._funciones[tipo] = funcion
+
+    def iniciar(self):
+        """Arranca el hilo que reparte los trabajos (retoma los que quedaron abandonados)"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._repartir, name='cola_trabajos', daemon=True)
+        self._hilo.start()
+
+    def detener(self, esperar: bool = True):
+        """Detiene el reparto de trabajos (los que están en curso terminan)"""
+        self._detener.set()
+        self._hay_trabajo.set()
+        if self._hilo is not None and esperar:
+            self._hilo.join()
+        self._executor.shutdown(wait=esperar)
+
+    def enviar(self, tipo: str, entrada: bytes, nombre_archivo: str = None, parametros: Dict = None) -> int:
+        """
+        Añade un trabajo a la cola y vuelve inmediatamente
+
+        Args:
+            tipo: Tipo de trabajo (debe tener una función registrada)
+            entrada: Documento de entrada
+            nombre_archivo: Nombre del documento de entrada
+            parametros: Parámetros del trabajo (serializables a JSON)
+
+        Returns:
+            ID del trabajo (para consultar su estado)
+        """
+        if tipo not in self._funciones:
+            raise ValueError(f"Tipo de trabajo no registrado: {tipo}")
+        entrada = bytes(entrada)
+        trabajo_id = self.db_manager.crear_trabajo(
+            tipo, huella_trabajo(tipo, entrada, parametros), entrada,
+            nombre_archivo=nombre_archivo, parametros=json.dumps(parametros or {}, default=str)
+        )
+        self._hay_trabajo.set()
+        return trabajo_id
+
+    def estado(self, trabajo_id: int) -> Optional[Dict]:
+        """
+        Estado de un trabajo
+
+        Returns:
+            Diccionario con 'estado', 'resultado', 'error', 'nombre_salida' y 'segundos',
+            o None si no existe
+        """
+        trabajo = self.db_manager.obtener_trabajo(trabajo_id)
+        if trabajo is None:
+            return None
+        segundos = None
+        if trabajo.fecha_inicio and trabajo.fecha_fin:
+            segundos = (trabajo.fecha_fin - trabajo.fecha_inicio).total_seconds()
+        return {
+            'estado': trabajo.estado,
+            'resultado': json.loads(trabajo.resultado) if trabajo.resultado else None,
+            'error': trabajo.error,
+            'nombre_salida': trabajo.nombre_salida,
+            'segundos': segundos
+        }
+
+    def salida(self, trabajo_id: int) -> Optional[bytes]:
+        """Documento generado por un trabajo completado (None si no hay)"""
+        trabajo = self.db_manager.obtener_trabajo(trabajo_id, con_salida=True)
+        return trabajo.salida if trabajo is not None else None
+
+    def _repartir(self):
+        """
+        Bucle del hilo repartidor: reserva trabajos en cuanto queda un hilo libre
+
+        Cada trabajo que termina despierta al repartidor, así que un hilo libre no
+        espera a que acaben los demás del lote. En cada vuelta se renueva el latido
+        de los trabajos en curso y, de vez en cuando, se retoman los abandonados.
+        """
+        en_curso = {}  # futuro -> ID del trabajo
+        ultima_revision = None
+        while not self._detener.is_set():
+            self._hay_trabajo.clear()
+            en_curso = {futuro: trabajo_id for futuro, trabajo_id in en_curso.items() if not futuro.done()}
+
+            try:
+                if ultima_revision is None or time.monotonic() - ultima_revision >= self.caducidad / 2:
+                    self.db_manager.reanudar_trabajos_interrumpidos(
+                        datetime.utcnow() - timedelta(seconds=self.caducidad)
+                    )
+                    ultima_revision = time.monotonic()
+                self.db_manager.renovar_trabajos(list(en_curso.values()))
+
+                libres = self.workers - len(en_curso)
+                trabajos = self.db_manager.tomar_trabajos_pendientes(limite=libres) if libres > 0 else []
+            except Exception as e:
+                print(f"Error al leer la cola de trabajos: {e}")
+                trabajos = []
+
+            for trabajo in trabajos:
+                futuro = self._executor.submit(self._hacer, trabajo)
+                en_curso[futuro] = trabajo['id']
+                futuro.add_done_callback(lambda _: self._hay_trabajo.set())
+
+            # Dormir hasta que llegue un trabajo, termine uno o toque renovar los latidos
+            self._hay_trabajo.wait(self.intervalo)
+
+    def _hacer(self, trabajo: Dict):
+        """Hace un trabajo reservado y registra el resultado"""
+        try:
+            funcion = self._funciones.get(trabajo['tipo'])
+            if funcion is None:
+                raise ValueError(f"Tipo de trabajo no registrado: {trabajo['tipo']}")
+            parametros = dict(json.loads(trabajo['parametros'] or '{}'), nombre_archivo=trabajo['nombre_archivo'])
+            salida = funcion(trabajo['entrada'], parametros)
+            resultado = json.dumps(salida.get('resultado'), default=str)
+        except Exception as e:
+            self._registrar(self.db_manager.fallar_trabajo, trabajo['id'], str(e))
+            return
+
+        self._registrar(
+            self.db_manager.completar_trabajo, trabajo['id'], resultado,
+            salida.get('salida'), salida.get('nombre_salida')
+        )
+
+    @staticmethod
+    def _registrar(funcion, *args):
+        """Guarda el resultado de un trabajo sin tumbar el hilo si falla la base de datos"""
+        try:
+            funcion(*args)
+        except Exception as e:
+            print(f"Error al registrar el resultado del trabajo: {e}")
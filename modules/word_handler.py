@@ -5,11 +5,58 @@ import anthropic
 import os
 import json
 import re
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
 from pathlib import Path
 from typing import Dict, List, Tuple
 from docx import Document
 from docx.shared import Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from .documento import DocumentoWord, Origen
+from .lote import cargar_clientes, crear_tareas_lote, generar_lote_zip
+from .paquete_docx import PaqueteDocx, serializar_xml
+from .reemplazo_word import (
+    MotorReemplazos,
+    PlantillaWordCompilada,
+    obtener_plantilla_compilada,
+    parrafos_cuerpo,
+    reemplazar_en_parrafo,
+    texto_parrafo,
+)
+
+# Ediciones aprendidas de la IA por huella de plantilla: qué dato del cliente va en cada hueco.
+# Los hilos de la cola de trabajos la comparten: se accede siempre con _MAPEOS_IA_LOCK y
+# cada mapeo guardado no se modifica después (al aprender se guarda uno nuevo)
+_MAPEOS_IA = OrderedDict()
+_MAX_MAPEOS_IA = 32
+_MAPEOS_IA_LOCK = threading.Lock()
+
+
+def _obtener_mapeo_ia(huella: str):
+    """Mapeo aprendido de una plantilla (None si aún no se ha consultado a la IA)"""
+    with _MAPEOS_IA_LOCK:
+        mapeo = _MAPEOS_IA.get(huella)
+        if mapeo is not None:
+            _MAPEOS_IA.move_to_end(huella)
+        return mapeo
+
+
+def _guardar_mapeo_ia(huella: str, mapeo: Dict):
+    """Guarda el mapeo aprendido de una plantilla, descartando el menos usado si hay demasiados"""
+    with _MAPEOS_IA_LOCK:
+        _MAPEOS_IA[huella] = mapeo
+        _MAPEOS_IA.move_to_end(huella)
+        if len(_MAPEOS_IA) > _MAX_MAPEOS_IA:
+            _MAPEOS_IA.popitem(last=False)
+
+# Campos en blanco que la IA puede rellenar (puntos, líneas, casillas, "Haga clic aquí")
+_HUECO = re.compile(r'\.{3,}|…{2,}|_{3,}|☐|[Hh]aga clic aquí')
+
+# Marcadores {{...}} de una plantilla
+_MARCADOR = re.compile(r'\{\{[^{}]*\}\}')
+
 
 class WordHandler:
     def __init__(self, api_key: str = None):
@@ -25,28 +72,17 @@ class WordHandler:
 
         self.client = anthropic.Anthropic(api_key=self.api_key)
 
-    def extraer_texto_word(self, docx_path: str) -> str:
+    def extraer_texto_word(self, docx_path: Origen) -> str:
         """
         Extrae todo el texto de un documento Word
 
         Args:
-            docx_path: Ruta al archivo .docx
+            docx_path: Ruta al archivo .docx, bytes, archivo binario o DocumentoWord
 
         Returns:
             Texto completo del documento
         """
-        doc = Document(docx_path)
-        texto_completo = []
-
-        for para in doc.paragraphs:
-            texto_completo.append(para.text)
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    texto_completo.append(cell.text)
-
-        return '\n'.join(texto_completo)
+        return DocumentoWord.desde(docx_path).texto
 
     def detectar_tipo_campos(self, texto: str) -> str:
         """
@@ -71,17 +107,19 @@ class WordHandler:
         else:
             return 'mixto'
 
-    def extraer_datos_cliente_word(self, docx_path: str) -> Dict[str, any]:
+    def extraer_datos_cliente_word(self, docx_path: Origen, nombre_archivo: str = None) -> Dict[str, any]:
         """
         Extrae datos del cliente desde un documento Word usando Claude API
 
         Args:
-            docx_path: Ruta al archivo Word
+            docx_path: Ruta al archivo Word, bytes, archivo binario o DocumentoWord
+            nombre_archivo: Nombre original del archivo (si no se pasa una ruta)
 
         Returns:
             Diccionario con los datos extraídos
         """
-        texto = self.extraer_texto_word(docx_path)
+        documento = DocumentoWord.desde(docx_path, nombre_archivo)
+        texto = documento.texto
 
         prompt = f"""Analiza este texto extraído de un documento Word y extrae la siguiente información sobre el cliente/empresa:
 
@@ -142,8 +180,8 @@ Ejemplo:
                 response_text = response_text.split("```")[1].split("```")[0]
 
             datos = json.loads(response_text.strip())
-            datos['pdf_original_nombre'] = Path(docx_path).name
-            datos['pdf_original_ruta'] = docx_path
+            datos['pdf_original_nombre'] = documento.nombre
+            datos['pdf_original_ruta'] = documento.ruta
 
             return datos
 
@@ -212,63 +250,61 @@ IMPORTANTE: Responde SOLO con JSON válido."""
             print(f"Error en análisis IA: {e}")
             return []
 
-    def rellenar_word_inteligente(self, docx_path: str, datos_cliente: Dict, output_path: str) -> Dict:
+    def rellenar_word_inteligente(self, docx_path: Origen, datos_cliente: Dict, output_path) -> Dict:
         """
         Método inteligente que mantiene el formato original y rellena campos automáticamente
 
         Args:
-            docx_path: Ruta al documento Word original
+            docx_path: Ruta al documento Word original, bytes, archivo binario o DocumentoWord
             datos_cliente: Datos del cliente
-            output_path: Ruta de salida
+            output_path: Ruta o archivo binario de salida
 
         Returns:
             Información del proceso
         """
-        # Cargar documento original
-        doc = Document(docx_path)
-        texto_completo = self.extraer_texto_word(docx_path)
-
-        # Detectar tipo de campos
-        tipo_campos = self.detectar_tipo_campos(texto_completo)
-
-        print(f"Tipo de campos detectado: {tipo_campos}")
+        documento = DocumentoWord.desde(docx_path)
 
         # Crear mapeo inteligente de reemplazos
         reemplazos = self._crear_mapeo_reemplazos(datos_cliente)
 
-        # Aplicar reemplazos en párrafos
-        for para in doc.paragraphs:
-            texto_original = para.text
-            texto_nuevo = texto_original
+        # Plantilla compilada: tipo de campos y posición de cada marcador, calculados
+        # solo la primera vez que se usa esta plantilla
+        plantilla = self.compilar_plantilla(documento, reemplazos)
 
-            for patron, valor in reemplazos.items():
-                texto_nuevo = texto_nuevo.replace(patron, str(valor) if valor else '')
+        print(f"Tipo de campos detectado: {plantilla.tipo_campos}")
 
-            if texto_nuevo != texto_original:
-                para.text = texto_nuevo
+        # Rellenar solo los textos localizados, conservando el formato de los runs
+        campos_rellenados = plantilla.rellenar(reemplazos, output_path, documento)
 
-        # Aplicar reemplazos en tablas
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        texto_original = para.text
-                        texto_nuevo = texto_original
+        return {
+            'exito': True,
+            'metodo': f'inteligente_{plantilla.tipo_campos}',
+            'mensaje': f'Documento rellenado (tipo: {plantilla.tipo_campos})',
+            'campos_rellenados': campos_rellenados,
+            'parseos': documento.parseos
+        }
 
-                        for patron, valor in reemplazos.items():
-                            texto_nuevo = texto_nuevo.replace(patron, str(valor) if valor else '')
+    def compilar_plantilla(self, docx_path: Origen, reemplazos: Dict[str, str] = None) -> PlantillaWordCompilada:
+        """
+        Compila una plantilla Word: tipo de campos y posición de cada marcador y campo en blanco
 
-                        if texto_nuevo != texto_original:
-                            para.text = texto_nuevo
+        El resultado se guarda en memoria por huella de la plantilla, así que rellenar
+        muchos clientes con la misma plantilla solo la analiza una vez.
 
-        # Guardar documento
-        doc.save(output_path)
+        Args:
+            docx_path: Ruta al documento Word, bytes, archivo binario o DocumentoWord
+            reemplazos: Mapeo de reemplazos cuyos patrones se localizan
+                (por defecto, el de un cliente con todos los datos)
 
-        return {
-            'exito': True,
-            'metodo': f'inteligente_{tipo_campos}',
-            'mensaje': f'Documento rellenado (tipo: {tipo_campos})'
-        }
+        Returns:
+            Plantilla compilada
+        """
+        if reemplazos is None:
+            reemplazos = self._crear_mapeo_reemplazos({'nombre_representante_legal': '-'})
+
+        return obtener_plantilla_compilada(
+            DocumentoWord.desde(docx_path), reemplazos.keys(), self.detectar_tipo_campos
+        )
 
     def _crear_mapeo_reemplazos(self, datos_cliente: Dict) -> Dict[str, str]:
         """
@@ -318,39 +354,275 @@ IMPORTANTE: Responde SOLO con JSON válido."""
 
         return reemplazos
 
-    def rellenar_word_con_ia(self, docx_path: str, datos_cliente: Dict, output_path: str) -> Dict:
+    def rellenar_word_con_ia(self, docx_path: Origen, datos_cliente: Dict, output_path,
+                             solo_pendientes: bool = False) -> Dict:
         """
-        Usa IA para analizar el documento completo y rellenarlo manteniendo formato
+        Usa IA para localizar los campos del documento y los rellena manteniendo formato
+
+        Antes de llamar a la IA se resuelve localmente todo lo posible: los marcadores
+        {{...}} conocidos y las ediciones aprendidas de rellenados anteriores de esta
+        misma plantilla. La IA solo recibe los párrafos que siguen sin resolver (los
+        de valores elaborados y, si el cliente tiene datos que los anteriores no
+        tenían, los que se quedaron con huecos) y no reescribe el documento: devuelve
+        una lista compacta de ediciones (párrafo, texto a sustituir y valor) que se
+        aplican localmente sobre los runs.
 
         Args:
-            docx_path: Ruta al documento Word
+            docx_path: Ruta al documento Word, bytes, archivo binario o DocumentoWord
             datos_cliente: Datos del cliente
-            output_path: Ruta de salida
+            output_path: Ruta o archivo binario de salida
+            solo_pendientes: En la primera consulta, enviar a la IA solo los párrafos que
+                siguen con marcadores o huecos tras los marcadores conocidos (plantillas
+                con marcadores), en vez del documento entero
 
         Returns:
             Información del proceso
         """
-        # Extraer texto original
-        texto_original = self.extraer_texto_word(docx_path)
+        documento = DocumentoWord.desde(docx_path)
+        # Copia del árbol: el del DocumentoWord se comparte entre rellenados
+        raiz = documento.copia_cuerpo()
+        parrafos = parrafos_cuerpo(raiz)
+
+        # 1. Marcadores conocidos
+        marcadores = {
+            patron: valor for patron, valor in self._crear_mapeo_reemplazos(datos_cliente).items()
+            if patron.startswith('{{')
+        }
+        campos_locales = MotorReemplazos(marcadores).aplicar_documento(raiz)
+
+        # 2. Ediciones aprendidas de esta plantilla
+        mapeo = _obtener_mapeo_ia(documento.huella)
+        fallidas = []
+        if mapeo is not None:
+            for edicion in mapeo['ediciones']:
+                valor = self._valor_edicion_aprendida(edicion, datos_cliente)
+                if valor is None:
+                    continue
+                if self._aplicar_edicion(parrafos, dict(edicion, valor=valor)):
+                    campos_locales += 1
+                else:
+                    fallidas.append(edicion)
+
+        # 3. IA solo para lo que queda sin resolver: los párrafos con valores elaborados
+        # y, si este cliente tiene datos que no tenía ninguno de los anteriores, los
+        # huecos que entonces no se pudieron aprender
+        pendientes = None
+        if mapeo is not None:
+            pendientes = set(mapeo['sin_resolver'])
+            if self._campos_nuevos(mapeo, datos_cliente):
+                pendientes |= mapeo['huecos']
+            pendientes = sorted(pendientes)
+        elif solo_pendientes:
+            pendientes = [
+                indice for indice, parrafo in enumerate(parrafos)
+                if self._sin_rellenar(texto_parrafo(parrafo))
+            ]
+
+        campos_ia = 0
+        llamadas_ia = 0
+        if pendientes is None or pendientes:
+            ediciones = self.analizar_ediciones_con_ia(parrafos, datos_cliente, pendientes)
+            llamadas_ia = 1
+            for edicion in ediciones:
+                if self._aplicar_edicion(parrafos, edicion):
+                    campos_ia += 1
+                else:
+                    fallidas.append(edicion)
+            self._aprender_ediciones(documento.huella, ediciones, datos_cliente, parrafos, mapeo)
+
+        # Solo se vuelve a serializar el cuerpo; el resto del paquete se copia comprimido
+        PaqueteDocx(documento.datos).escribir(output_path, {
+            str(documento.documento.part.partname).lstrip('/'): serializar_xml(raiz)
+        })
+
+        if not llamadas_ia:
+            metodo, ruta = ('mapeo_aprendido' if mapeo is not None else 'marcadores'), 'local'
+        elif pendientes is not None or campos_locales:
+            metodo, ruta = 'ia_parcial', 'mixta'
+        else:
+            metodo, ruta = 'ia', 'ia'
+
+        return {
+            'exito': True,
+            'metodo': metodo,
+            'ruta': ruta,
+            'mensaje': f'Documento Word rellenado ({campos_locales} campos locales, {campos_ia} con IA)',
+            'campos_rellenados': campos_locales + campos_ia,
+            'campos_locales': campos_locales,
+            'campos_ia': campos_ia,
+            'llamadas_ia': llamadas_ia,
+            'ediciones_fallidas': fallidas,
+            'parseos': documento.parseos
+        }
+
+    @staticmethod
+    def _sin_rellenar(texto: str) -> bool:
+        """Indica si un texto tiene huecos o marcadores {{...}} (tras aplicar los conocidos)"""
+        return bool(_HUECO.search(texto) or _MARCADOR.search(texto))
+
+    def _ruta_plantilla(self, documento: DocumentoWord) -> str:
+        """
+        Ruta de rellenado de una plantilla
+
+        Returns:
+            'local' si solo tiene marcadores conocidos, 'mixta' si tiene marcadores y
+            además marcadores desconocidos o campos en blanco, 'ia' si no tiene marcadores
+        """
+        if self.compilar_plantilla(documento).tipo_campos != 'marcadores':
+            return 'ia'
+        conocidos = self._crear_mapeo_reemplazos({})
+        if _HUECO.search(documento.texto) or any(m not in conocidos for m in _MARCADOR.findall(documento.texto)):
+            return 'mixta'
+        return 'local'
+
+    @staticmethod
+    def _aplicar_edicion(parrafos: List, edicion: Dict) -> bool:
+        """Aplica una edición {parrafo, buscar, valor} sobre los párrafos del documento"""
+        try:
+            indice = int(edicion.get('parrafo'))
+        except (TypeError, ValueError):
+            return False
+        if not 0 <= indice < len(parrafos):
+            return False
+
+        valor = edicion.get('valor')
+        return reemplazar_en_parrafo(
+            parrafos[indice], str(edicion.get('buscar') or ''), '' if valor is None else str(valor)
+        )
+
+    @staticmethod
+    def _valor_edicion_aprendida(edicion: Dict, datos_cliente: Dict):
+        """Valor de una edición aprendida para un cliente (None si no aplica)"""
+        valor = datos_cliente.get(edicion['campo'])
+        if isinstance(valor, bool):
+            return edicion.get('valor_si') if valor else None
+        if valor is None or valor == '':
+            return None
+        return str(valor)
+
+    @staticmethod
+    def _tiene_valor(valor) -> bool:
+        """Indica si un dato del cliente tiene valor (una casilla desmarcada no lo tiene)"""
+        return valor is not None and valor != '' and valor is not False
+
+    @classmethod
+    def _campos_nuevos(cls, mapeo: Dict, datos_cliente: Dict) -> bool:
+        """Indica si el cliente tiene algún dato que no tenía ninguno de los clientes ya consultados"""
+        return any(
+            cls._tiene_valor(valor) and campo not in mapeo['campos_vistos']
+            for campo, valor in datos_cliente.items()
+        )
+
+    @classmethod
+    def _aprender_ediciones(cls, huella: str, ediciones: List[Dict], datos_cliente: Dict,
+                            parrafos: List, anterior: Dict = None):
+        """
+        Guarda qué dato del cliente rellena cada hueco de una plantilla
+
+        Las ediciones cuyo valor es directamente un dato del cliente se reutilizan en
+        los siguientes rellenados sin IA; los párrafos con valores elaborados quedan
+        marcados como pendientes para consultarlos de nuevo. Los párrafos que siguen
+        con huecos (datos que este cliente no tenía) se guardan aparte, junto con los
+        datos que sí tenía, para volver a consultarlos con el primer cliente que
+        tenga alguno más.
+
+        Args:
+            huella: Huella de la plantilla
+            ediciones: Ediciones devueltas por la IA para este cliente
+            datos_cliente: Datos del cliente
+            parrafos: Párrafos del documento ya rellenado
+            anterior: Mapeo que se completa (None si es la primera consulta)
+        """
+        aprendidas = list(anterior['ediciones']) if anterior else []
+        conocidas = {(e['parrafo'], e['buscar'], e['campo']) for e in aprendidas}
+        sin_resolver = set(anterior['sin_resolver']) if anterior else set()
+
+        for edicion in ediciones:
+            campo = edicion.get('campo')
+            valor = datos_cliente.get(campo) if campo else None
+            base = {'parrafo': edicion.get('parrafo'), 'buscar': edicion.get('buscar'), 'campo': campo}
+
+            if isinstance(valor, bool) and valor:
+                nueva = dict(base, valor_si=edicion.get('valor'))
+            elif valor is not None and not isinstance(valor, bool) and str(valor) == str(edicion.get('valor')):
+                nueva = base
+            else:
+                try:
+                    sin_resolver.add(int(edicion.get('parrafo')))
+                except (TypeError, ValueError):
+                    pass
+                continue
+
+            if (base['parrafo'], base['buscar'], campo) not in conocidas:
+                conocidas.add((base['parrafo'], base['buscar'], campo))
+                aprendidas.append(nueva)
+
+        # Huecos que quedan tras rellenar (solo entre los revisados en esta consulta)
+        revisados = range(len(parrafos)) if anterior is None else anterior['huecos']
+        huecos = {
+            indice for indice in revisados
+            if indice not in sin_resolver and cls._sin_rellenar(texto_parrafo(parrafos[indice]))
+        }
+
+        campos_vistos = set(anterior['campos_vistos']) if anterior else set()
+        campos_vistos.update(campo for campo, valor in datos_cliente.items() if cls._tiene_valor(valor))
+
+        _guardar_mapeo_ia(huella, {
+            'ediciones': aprendidas,
+            'sin_resolver': sin_resolver,
+            'huecos': huecos,
+            'campos_vistos': campos_vistos
+        })
+
+    def analizar_ediciones_con_ia(self, parrafos: List, datos_cliente: Dict, indices: List[int] = None) -> List[Dict]:
+        """
+        Pide a la IA las ediciones necesarias para rellenar un documento
+
+        Args:
+            parrafos: Elementos w:p del documento en orden
+            datos_cliente: Datos del cliente
+            indices: Párrafos a enviar (por defecto, todos)
+
+        Returns:
+            Lista de ediciones: [{"parrafo": 12, "buscar": "……", "valor": "...", "campo": "..."}]
+        """
+        # Solo se envían los párrafos con texto, numerados para que la IA los referencie
+        lineas = []
+        for indice in (range(len(parrafos)) if indices is None else indices):
+            if not 0 <= indice < len(parrafos):
+                continue
+            texto = texto_parrafo(parrafos[indice])
+            if texto.strip():
+                lineas.append(f"[{indice}] {texto}")
+
         datos_json = json.dumps(datos_cliente, indent=2, ensure_ascii=False)
 
-        # Análisis con IA para crear documento rellenado
-        prompt = f"""Tienes un documento Word y datos de un cliente. Rellena el documento de forma inteligente.
+        prompt = f"""Tienes un documento Word (cada párrafo va precedido de su número entre corchetes) y datos de un cliente.
 
-DOCUMENTO ORIGINAL:
-{texto_original}
+DOCUMENTO:
+{chr(10).join(lineas)}
 
 DATOS DEL CLIENTE:
 {datos_json}
 
 INSTRUCCIONES:
-1. Identifica campos vacíos: puntos suspensivos (…), líneas (_____), "Haga clic aquí", etc.
-2. Rellena cada campo con el dato correspondiente del cliente
-3. Para checkboxes (☐), ponles [X] si el dato es true
-4. Mantén TODA la estructura y formato del documento
-5. Devuelve el documento COMPLETO rellenado
+1. Identifica campos vacíos: puntos suspensivos (…), líneas (_____), "Haga clic aquí", marcadores {{...}} sin rellenar, etc.
+2. Para cada campo que puedas rellenar con los datos del cliente, indica:
+   - "parrafo": número del párrafo
+   - "buscar": texto EXACTO del párrafo a sustituir (el hueco o marcador, copiado literalmente)
+   - "valor": texto con el que sustituirlo
+   - "campo": nombre del dato del cliente del que sale el valor (null si no sale directamente de uno)
+3. Para checkboxes (☐) que deban marcarse según datos booleanos, usa "buscar": "☐" y "valor": "☒"
+4. NO devuelvas el documento ni párrafos sin cambios, solo las ediciones
 
-Responde SOLO con el texto del documento rellenado, sin explicaciones."""
+Responde con JSON en este formato:
+{{
+  "ediciones": [
+    {{"parrafo": 3, "buscar": "……………", "valor": "Juan Pérez García", "campo": "nombre_representante_legal"}}
+  ]
+}}
+
+IMPORTANTE: Responde SOLO con JSON válido."""
 
         try:
             message = self.client.messages.create(
@@ -359,46 +631,210 @@ Responde SOLO con el texto del documento rellenado, sin explicaciones."""
                 messages=[{"role": "user", "content": prompt}]
             )
 
-            texto_rellenado = message.content[0].text
+            response_text = message.content[0].text
+            if "```json" in response_text:
+                response_text = response_text.split("```json")[1].split("```")[0]
+            elif "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0]
 
-            # Crear documento preservando estructura original
-            doc_original = Document(docx_path)
-            lineas_nuevas = texto_rellenado.split('\n')
-            idx_linea = 0
+            resultado = json.loads(response_text.strip())
+            return resultado.get('ediciones', [])
 
-            # Reemplazar párrafos manteniendo formato
-            for para in doc_original.paragraphs:
-                if idx_linea < len(lineas_nuevas):
-                    # Mantener formato del párrafo original
-                    for run in para.runs:
-                        run.text = ''
-                    if para.runs:
-                        para.runs[0].text = lineas_nuevas[idx_linea]
-                    else:
-                        para.add_run(lineas_nuevas[idx_linea])
-                    idx_linea += 1
+        except Exception as e:
+            raise Exception(f"Error al rellenar Word con IA: {e}")
 
-            doc_original.save(output_path)
+    def rellenar_word(self, docx_path: Origen, datos_cliente: Dict, output_path) -> Dict:
+        """
+        Método principal: usa el rellenado local siempre que es posible y la IA solo si hace falta
 
-            return {
-                'exito': True,
-                'mensaje': 'Documento Word rellenado con IA'
-            }
+        Las plantillas con marcadores se rellenan localmente. Si además tienen marcadores
+        desconocidos o campos en blanco, se aplican los marcadores conocidos y solo los
+        párrafos que siguen sin rellenar se consultan a la IA (ruta 'mixta'). El resto de
+        plantillas pasa por rellenar_word_con_ia, que también consulta a la IA solo lo que
+        no sabe resolver.
 
-        except Exception as e:
-            raise Exception(f"Error al rellenar Word con IA: {e}")
+        Args:
+            docx_path: Ruta al documento Word, bytes, archivo binario o DocumentoWord
+            datos_cliente: Datos del cliente
+            output_path: Ruta o archivo binario de salida
 
-    def rellenar_word(self, docx_path: str, datos_cliente: Dict, output_path: str) -> Dict:
+        Returns:
+            Información del proceso, con la ruta seguida ('local', 'mixta' o 'ia') y su duración
         """
-        Método principal mejorado que usa IA para análisis robusto
+        inicio = time.perf_counter()
+        documento = DocumentoWord.desde(docx_path)
+
+        ruta = self._ruta_plantilla(documento)
+
+        if ruta == 'local':
+            resultado = self.rellenar_word_inteligente(documento, datos_cliente, output_path)
+            resultado['ruta'] = 'local'
+        else:
+            resultado = self.rellenar_word_con_ia(documento, datos_cliente, output_path,
+                                                  solo_pendientes=ruta == 'mixta')
+
+        resultado['segundos'] = round(time.perf_counter() - inicio, 4)
+        print(f"Ruta de rellenado: {resultado['ruta']} ({resultado['metodo']}, {resultado['segundos']:.2f} s)")
+        return resultado
+
+    def rellenar_word_bytes(self, docx: Origen, datos_cliente: Dict) -> Dict:
+        """
+        Rellena un documento Word en memoria, sin archivos temporales
 
         Args:
-            docx_path: Ruta al documento Word
+            docx: Documento Word como bytes, archivo binario o ruta
             datos_cliente: Datos del cliente
-            output_path: Ruta de salida
 
         Returns:
-            Información del proceso
+            Información del proceso, con el documento rellenado en 'contenido'
+        """
+        salida = BytesIO()
+        resultado = self.rellenar_word(docx, datos_cliente, salida)
+        resultado['contenido'] = salida.getvalue()
+        return resultado
+
+    def preparar_plantilla(self, docx: Origen) -> Dict:
         """
-        # Usar método con IA directamente (más robusto con cualquier formato)
-        return self.rellenar_word_con_ia(docx_path, datos_cliente, output_path)
+        Lee y compila una plantilla Word antes de saber con qué cliente se va a rellenar
+
+        La plantilla compilada queda en memoria por huella, así que rellenar_word
+        la encuentra ya hecha. Las consultas a la IA dependen de los datos del cliente
+        y se hacen al rellenar.
+
+        Args:
+            docx: Documento Word como bytes, archivo binario, ruta o DocumentoWord
+
+        Returns:
+            Diccionario con los 'datos' de la plantilla, su 'huella' y su 'tipo_campos'
+        """
+        documento = DocumentoWord.desde(docx)
+        plantilla = self.compilar_plantilla(documento)
+        return {'datos': documento.datos, 'huella': documento.huella, 'tipo_campos': plantilla.tipo_campos}
+
+    def aprender_plantilla(self, docx: Origen, clientes: List[Dict]) -> Dict:
+        """
+        Analiza con la IA una plantilla que no se puede rellenar solo localmente, una sola vez para un grupo de clientes
+
+        La IA recibe un cliente combinado con el primer valor no vacío de cada dato
+        entre todos los clientes, así que aprende el hueco de cualquier dato que tenga
+        alguno de ellos. El documento generado se descarta: solo interesa el mapeo.
+
+        Args:
+            docx: Documento Word como bytes, archivo binario, ruta o DocumentoWord
+            clientes: Datos de los clientes que se van a rellenar
+
+        Returns:
+            Mapeo aprendido de la plantilla (ediciones y párrafos sin resolver), o None
+            si no ha hecho falta consultar a la IA
+        """
+        documento = DocumentoWord.desde(docx)
+        mapeo = _obtener_mapeo_ia(documento.huella)
+        if mapeo is None:
+            combinados = {}
+            for datos in clientes:
+                for campo, valor in datos.items():
+                    if valor is None or valor == '' or valor is False:
+                        combinados.setdefault(campo, valor)
+                    elif combinados.get(campo) in (None, '', False):
+                        combinados[campo] = valor
+            self.rellenar_word_con_ia(documento, combinados, BytesIO(),
+                                      solo_pendientes=self._ruta_plantilla(documento) == 'mixta')
+            mapeo = _obtener_mapeo_ia(documento.huella)
+        return mapeo
+
+    def rellenar_lote(self, plantilla_path: Origen, cliente_ids: List[int], workers: int = None,
+                      db_manager=None, zip_destino=None, nombre_plantilla: str = None) -> Dict:
+        """
+        Rellena una misma plantilla Word para muchos clientes y empaqueta los resultados en un ZIP
+
+        La plantilla se lee y se clasifica una sola vez. Si no se puede rellenar solo
+        con marcadores conocidos, la IA la analiza también una sola vez (ver aprender_plantilla) y el mapeo aprendido
+        se pasa a todos los procesos. Cada cliente pasa por el enrutador de
+        rellenar_word: solo los párrafos con valores elaborados vuelven a la IA.
+
+        Args:
+            plantilla_path: Ruta al documento Word plantilla, bytes o archivo binario
+            cliente_ids: IDs de los clientes a rellenar
+            workers: Número de procesos (por defecto, número de CPUs)
+            db_manager: Gestor de base de datos de donde leer los clientes
+            zip_destino: Ruta o archivo binario del ZIP (si no se indica, se devuelven los bytes)
+            nombre_plantilla: Nombre original de la plantilla (si no se pasa una ruta)
+
+        Returns:
+            Diccionario con el manifiesto del lote y, si no hay destino, los bytes del ZIP
+        """
+        if not cliente_ids:
+            raise ValueError("No se han indicado clientes para el lote")
+        clientes = cargar_clientes(cliente_ids, db_manager)
+        # Solo los clientes que existen guían el análisis de la plantilla
+        existentes = [datos for datos in clientes if datos is not None]
+        if not existentes:
+            raise ValueError("Ninguno de los clientes del lote existe")
+
+        plantilla = DocumentoWord.desde(plantilla_path, nombre_plantilla)
+        plantilla_bytes = plantilla.datos
+        nombre_plantilla = plantilla.nombre or 'plantilla.docx'
+
+        tipo_campos = self.compilar_plantilla(plantilla).tipo_campos
+        metodo = f'inteligente_{tipo_campos}' if self._ruta_plantilla(plantilla) == 'local' else 'ia'
+        mapeo = self.aprender_plantilla(plantilla, existentes) if metodo == 'ia' else None
+        nombre_base = Path(nombre_plantilla).stem
+
+        tareas = crear_tareas_lote(cliente_ids, clientes, nombre_base, 'docx')
+
+        buffer = BytesIO() if zip_destino is None else None
+        manifiesto = generar_lote_zip(
+            tareas,
+            _rellenar_word_lote,
+            zip_destino if zip_destino is not None else buffer,
+            workers=workers,
+            inicializador=_inicializar_proceso_lote,
+            initargs=(self.api_key, plantilla_bytes, metodo, plantilla.huella, mapeo),
+            info_plantilla={'nombre': nombre_plantilla, 'tipo_campos': tipo_campos, 'metodo': metodo}
+        )
+
+        resultado = {'exito': manifiesto['fallidos'] == 0, 'manifiesto': manifiesto}
+        if buffer is not None:
+            resultado['zip'] = buffer.getvalue()
+        return resultado
+
+
+# Estado de cada proceso del pool de lotes (plantilla leída, clasificada y analizada una vez)
+_CONTEXTO_LOTE = {}
+
+
+def _inicializar_proceso_lote(api_key: str, plantilla_bytes: bytes, metodo: str,
+                              huella: str = None, mapeo: Dict = None):
+    """Prepara un proceso del pool con la plantilla ya clasificada y el mapeo de la IA"""
+    _CONTEXTO_LOTE['handler'] = WordHandler(api_key)
+    _CONTEXTO_LOTE['documento'] = DocumentoWord(plantilla_bytes)
+    _CONTEXTO_LOTE['metodo'] = metodo
+    if mapeo is not None:
+        _guardar_mapeo_ia(huella, mapeo)
+
+
+def _rellenar_word_lote(tarea: Dict) -> Dict:
+    """Rellena la copia de un cliente dentro de un proceso del pool"""
+    inicio = time.perf_counter()
+    handler = _CONTEXTO_LOTE['handler']
+    metodo = _CONTEXTO_LOTE['metodo']
+    # La plantilla se lee una vez por proceso: cada cliente rellena una copia de su
+    # árbol (o solo las partes con campos, si se rellena con la plantilla compilada)
+    documento = _CONTEXTO_LOTE['documento']
+    salida = BytesIO()
+
+    try:
+        # El enrutador rellena localmente lo que puede con el mapeo recibido del
+        # proceso principal; la IA solo recibe los párrafos que siguen sin resolver
+        resultado = handler.rellenar_word(documento, tarea['datos_cliente'], salida)
+
+        return {
+            'exito': True,
+            'metodo': resultado.get('metodo', metodo),
+            'ruta': resultado.get('ruta'),
+            'contenido': salida.getvalue(),
+            'segundos': round(time.perf_counter() - inicio, 4)
+        }
+
+    except Exception as e:
+        return {'exito': False, 'metodo': metodo, 'error': str(e)}